@@ -0,0 +1,158 @@
+""" Module to serve the latest Param values to local clients over HTTP, as a snapshot or as a stream of Server-Sent Events """
+
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+
+from hal.logger import logger
+from hal.param import Param
+
+
+class Board:
+    """
+    Latest parsed values, timestamps and alarms of all Params of all fridges, as processed by the Dispatchers. Responses are encoded once per publish() so that serving them to any number of readers costs no more than writing bytes.
+    """
+
+    def __init__(self, history: int = 100) -> None:
+        """
+        history (int) number of recent update events kept for subscribers that fall behind, older subscribers are sent a new snapshot instead
+        """
+        # key = fridge name, value = dict with key = param name and value = entry
+        self._state: dict[str, dict[str, dict]] = {}
+        self._changes: dict[str, dict[str, dict]] = {}  # entries updated since publish
+        self._version: int = 0
+        self._snapshot: bytes = self._encode(self._state)
+        self._events: deque[tuple[int, bytes]] = deque(maxlen=history)
+        self._condition = threading.Condition()
+
+    def _encode(self, fridges: dict[str, dict[str, dict]]) -> bytes:
+        """return JSON encoded fridges (dict) tagged with the current version"""
+        return json.dumps({"version": self._version, "fridges": fridges}).encode()
+
+    def update(
+        self, fridge: str, param: Param, value: str, timestamp: str, alarms: list[str]
+    ) -> None:
+        """
+        Record the latest value of a Param, it is served once published
+        fridge (str) name of the fridge the Param belongs to
+        param (Param) param object
+        value (str) parsed value
+        timestamp (str) timestamp associated with the value
+        alarms (list[str]) descriptions of the alarms raised by the value, empty if none
+        """
+        entry = {
+            "value": value,
+            "timestamp": timestamp,
+            "category": param.category,
+            "alarms": alarms,
+        }
+        with self._condition:
+            self._state.setdefault(fridge, {})[param.name] = entry
+            self._changes.setdefault(fridge, {})[param.name] = entry
+
+    def publish(self) -> None:
+        """encode the current snapshot and an update event with the entries changed since the last publish, and wake up subscribers"""
+        with self._condition:
+            if not self._changes:
+                return
+            self._version += 1
+            self._snapshot = self._encode(self._state)
+            data = self._encode(self._changes).decode()
+            event = f"id: {self._version}\nevent: update\ndata: {data}\n\n"
+            self._events.append((self._version, event.encode()))
+            self._changes = {}
+            self._condition.notify_all()
+
+    @property
+    def snapshot(self) -> tuple[int, bytes]:
+        """return tuple of (version, JSON encoded snapshot of all entries)"""
+        with self._condition:
+            return self._version, self._snapshot
+
+    def wait(self, version: int, timeout: float) -> tuple[int, list[bytes]] | None:
+        """
+        Block till there are updates newer than version (int) or timeout (float) in seconds elapses
+        return tuple of (latest version, list of encoded events newer than version), None if some of those events are no longer kept and a new snapshot is needed
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._version > version, timeout)
+            if self._version == version:
+                return version, []
+            if not self._events or self._events[0][0] > version + 1:
+                return None
+            return self._version, [event for v, event in self._events if v > version]
+
+
+class BoardHandler(BaseHTTPRequestHandler):
+    """serves a JSON snapshot at /values and a Server-Sent Events stream at /events"""
+
+    KEEPALIVE: float = 15.0  # seconds between keep-alive comments on idle streams
+
+    def do_GET(self) -> None:
+        """ """
+        if self.path == "/values":
+            self._send_snapshot()
+        elif self.path == "/events":
+            self._send_events()
+        else:
+            self.send_error(404)
+
+    def _send_snapshot(self) -> None:
+        """ """
+        version, body = self.server.board.snapshot
+        etag = f'"{version}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_events(self) -> None:
+        """stream a snapshot event followed by update events till the client disconnects"""
+        board = self.server.board
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        try:
+            version = None  # send a snapshot first
+            while True:
+                if version is None:
+                    version, snapshot = board.snapshot
+                    head = f"id: {version}\nevent: snapshot\ndata: ".encode()
+                    self.wfile.write(head + snapshot + b"\n\n")
+                    self.wfile.flush()
+                update = board.wait(version, self.KEEPALIVE)
+                if update is None:  # fell behind
+                    version = None
+                    continue
+                version, events = update
+                self.wfile.write(b"".join(events) or b": keep-alive\n\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+    def log_message(self, format: str, *args) -> None:
+        """don't log every request"""
+
+
+def serve(
+    board: Board, port: int = 8080, host: str = "127.0.0.1"
+) -> ThreadingHTTPServer:
+    """
+    Serve the latest values on board (Board) over HTTP from a daemon thread
+    port (int) port to listen on
+    host (str) address to listen on, default = localhost only
+    return the running server
+    """
+    server = ThreadingHTTPServer((host, port), BoardHandler)
+    server.board = board
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Serving latest values at http://{host}:{port}/values and /events")
+    return server
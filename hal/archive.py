@@ -0,0 +1,185 @@
+""" Module to compress finished logfiles into seekable archives and read time ranges back from them """
+
+from collections.abc import Iterator
+from datetime import date, datetime, timedelta
+import os
+from pathlib import Path
+import zlib
+
+import numpy as np
+
+from hal.fridge import Fridge
+from hal.logger import logger
+from hal.param import Param
+from hal.reader import Plan, get_logpath
+from hal.store import parse_timestamp
+
+# record layout of the sidecar index, one record per block
+INDEX = np.dtype(
+    [("first", "<f8"), ("last", "<f8"), ("offset", "<i8"), ("length", "<i8")]
+)
+
+# uncompressed size of a block in bytes, the unit of decompression when reading
+BLOCKSIZE = 1 << 18
+
+
+def get_archivepath(path: Path) -> Path:
+    """return path of the archive of the logfile at path (Path)"""
+    return path.with_name(path.name + ".gz")
+
+
+def get_indexpath(path: Path) -> Path:
+    """return path of the sidecar index of the logfile at path (Path)"""
+    return path.with_name(path.name + ".idx")
+
+
+def get_time(token: list[str]) -> float:
+    """
+    token (list[str]) line of a logfile split by its delimiter, with the timestamp logged as dd-mm-yy,HH:MM:SS
+    return POSIX time of the line, raise ValueError or IndexError if the line has no valid timestamp
+    """
+    return parse_timestamp(f"{token[0]} {token[1]}")
+
+
+def archive_logfile(path: Path, blocksize: int = BLOCKSIZE) -> tuple[int, int]:
+    """
+    Compress a logfile into blocks of complete lines, each an independent gzip member so the archive is also a valid gzip file, and write an index of the time range and byte range of each block. The logfile is removed once its archive has been verified.
+    path (Path) path to the logfile
+    blocksize (int) uncompressed size of each block in bytes, blocks end at the first line break after this
+    return tuple of (size of the logfile, size of the archive and index) in bytes
+    """
+    archivepath, indexpath = get_archivepath(path), get_indexpath(path)
+    partpath = archivepath.with_name(archivepath.name + ".part")
+    records, checksum = [], 0
+    with path.open("rb") as logfile, partpath.open("wb") as archivefile:
+        while block := logfile.read(blocksize) + logfile.readline():
+            checksum = zlib.crc32(block, checksum)
+            times = []
+            for line in block.decode(encoding="utf-8", errors="ignore").splitlines():
+                try:
+                    times.append(get_time(line.split(",", 2)))
+                except (ValueError, IndexError):  # ignore bad log
+                    continue
+            member = zlib.compressobj(wbits=31)  # gzip container
+            data = member.compress(block) + member.flush()
+            first, last = (min(times), max(times)) if times else (np.inf, -np.inf)
+            records.append((first, last, archivefile.tell(), len(data)))
+            archivefile.write(data)
+        archivefile.flush()
+        os.fsync(archivefile.fileno())
+
+    # verify archive before replacing the logfile with it
+    index = np.array(records, dtype=INDEX)
+    with partpath.open("rb") as archivefile:
+        restored = 0
+        for offset, length in zip(index["offset"], index["length"]):
+            archivefile.seek(offset)
+            block = zlib.decompress(archivefile.read(length), 31)
+            restored = zlib.crc32(block, restored)
+    if restored != checksum:
+        partpath.unlink()
+        raise ValueError(f"Archive of {path} does not match the logfile.")
+    index.tofile(indexpath)
+    partpath.replace(archivepath)
+    size = path.stat().st_size
+    path.unlink()
+    return size, archivepath.stat().st_size + indexpath.stat().st_size
+
+
+def archive(folder: Path, before: date, blocksize: int = BLOCKSIZE) -> tuple[int, int]:
+    """
+    Archive all logfiles in date folders of a log folder dated before a date, logfiles of the current date are still being written to and must not be archived
+    folder (Path) folder the instruments log to, containing one subfolder per date
+    before (date) only archive date folders before this date
+    blocksize (int) uncompressed size of each block in bytes
+    return tuple of (size of the logfiles, size of their archives) in bytes
+    """
+    total, compressed = 0, 0
+    for datefolder in sorted(folder.iterdir()):
+        try:
+            day = datetime.strptime(datefolder.name, "%y-%m-%d").date()
+        except ValueError:  # not a date folder
+            continue
+        if day >= before or not datefolder.is_dir():
+            continue
+        for path in sorted(datefolder.glob("*.log")):
+            try:
+                size, archived = archive_logfile(path, blocksize)
+            except (OSError, ValueError) as err:
+                logger.error(f"Failed to archive {path} due to {err = }.")
+                continue
+            total, compressed = total + size, compressed + archived
+            logger.debug(f"Archived {path} from {size} to {archived} bytes.")
+    if total:
+        logger.info(
+            f"Archived {total / 1e6:.1f} MB of logfiles in {folder} into "
+            f"{compressed / 1e6:.1f} MB ({total / compressed:.1f}x smaller)."
+        )
+    return total, compressed
+
+
+def read_lines(path: Path, start: float, stop: float) -> Iterator[str]:
+    """
+    Yield lines of a logfile logged in a time range, decompressing only the blocks that overlap the range if the logfile has been archived
+    path (Path) path to the logfile, as if it had not been archived
+    start (float) POSIX time from which to read lines (inclusive)
+    stop (float) POSIX time till which to read lines (exclusive)
+    """
+    archivepath, indexpath = get_archivepath(path), get_indexpath(path)
+    if archivepath.exists() and indexpath.exists():
+        index = np.fromfile(indexpath, dtype=INDEX)
+        blocks = index[(index["last"] >= start) & (index["first"] < stop)]
+        with archivepath.open("rb") as archivefile:
+            for offset, length in zip(blocks["offset"], blocks["length"]):
+                archivefile.seek(offset)
+                block = zlib.decompress(archivefile.read(length), 31)
+                text = block.decode(encoding="utf-8", errors="ignore")
+                yield from _filter(text.splitlines(), start, stop)
+    elif path.exists():  # not archived yet, scan it whole
+        with path.open(encoding="utf-8", errors="ignore") as logfile:
+            yield from _filter((line.rstrip("\n") for line in logfile), start, stop)
+
+
+def _filter(lines, start: float, stop: float) -> Iterator[str]:
+    """yield lines (Iterable[str]) with timestamps in [start, stop)"""
+    for line in lines:
+        try:
+            time = get_time(line.split(",", 2))
+        except (ValueError, IndexError):  # ignore bad log
+            continue
+        if start <= time < stop:
+            yield line
+
+
+def read_range(
+    fridge: Fridge, start: datetime, stop: datetime
+) -> dict[Param, dict[str, str]]:
+    """
+    Read values of all Params of a fridge logged in a time range from archived or plain logfiles
+    fridge (Fridge) fridge whose logfiles are read
+    start (datetime) time from which to read values (inclusive)
+    stop (datetime) time till which to read values (exclusive)
+    return data dictionary with key = Param, value = dict with key = timestamp string and value = Param value string, in chronological order unlike Reader.read() which is reverse chronological
+    """
+    logged: dict[str, list[Param]] = {}  # key = logfile prefix, value = Params
+    for param in fridge.params:
+        logged.setdefault(param.filename, []).append(param)
+    data = {param: {} for param in fridge.params}
+    day = start.date()
+    while day <= stop.date():
+        datestamp = day.strftime("%y-%m-%d")
+        for filename, params in logged.items():
+            path = get_logpath(fridge.logfolder, filename, datestamp)
+            plan = Plan({param: param.pos for param in params})
+            lines = read_lines(path, start.timestamp(), stop.timestamp())
+            for line in lines:
+                token = line.split(",")
+                timestamp = f"{token[0]} {token[1]}"
+                try:
+                    extracted = plan.extract(token)
+                except IndexError:  # ignore bad log
+                    continue
+                for param, value in extracted.items():
+                    data[param][timestamp] = value
+        day += timedelta(days=1)
+    return data
@@ -0,0 +1,120 @@
+""" Module to bulk ingest historical logfiles into HAL's store """
+
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+import gzip
+from pathlib import Path
+import time
+
+import numpy as np
+
+from hal.archive import get_archivepath, get_time
+from hal.fridge import Fridge
+from hal.logger import logger
+from hal.reader import Plan, get_logpath
+from hal.store import Store
+
+
+def parse_logfile(
+    path: Path, positions: dict[str, int | str]
+) -> tuple[dict[str, tuple[np.ndarray, np.ndarray]], int, int]:
+    """
+    Stream through a logfile line by line and extract the values of all Params logged in it, meant to be run in a worker process
+    path (Path) path to the logfile, its archive is read if it has been archived
+    positions (dict) key = param name, value = param pos
+    return tuple of (dict with key = param name and value = tuple of (POSIX times, values) arrays, number of uncompressed bytes read, number of lines read)
+    """
+    times = {name: [] for name in positions}
+    values = {name: [] for name in positions}
+    plan = Plan(positions)
+    nlines = 0
+    if not path.exists():  # archived, decompress it whole as all of it is needed
+        path = get_archivepath(path)
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "rt", encoding="utf-8", errors="ignore") as file:
+        for line in file:
+            nlines += 1
+            token = line.rstrip("\n").split(",")
+            try:  # timestamp is logged as dd-mm-yy,HH:MM:SS
+                posix = get_time(token)
+            except (ValueError, IndexError):  # ignore bad log
+                continue
+            try:
+                extracted = plan.extract(token)
+            except IndexError:  # ignore bad log
+                continue
+            for name, value in extracted.items():
+                try:
+                    value = float(value)
+                except ValueError:  # ignore bad log
+                    continue
+                times[name].append(posix)
+                values[name].append(value)
+        nbytes = file.buffer.tell()  # decompressed size if archived
+    columns = {
+        name: (np.array(times[name]), np.array(values[name])) for name in positions
+    }
+    return columns, nbytes, nlines
+
+
+def backfill(
+    fridge: Fridge, start: date, stop: date, workers: int = None, store: Store = None
+) -> dict[str, float]:
+    """
+    Parse all logfiles of all Params of a fridge between two dates across a pool of worker processes and save their values to the store in bulk
+    fridge (Fridge) fridge to backfill
+    start (date) first date to backfill
+    stop (date) last date to backfill (inclusive)
+    workers (int) number of worker processes, default = number of cores
+    store (Store) store to save values to, default = HAL's store for the fridge
+    return dict of throughput statistics
+    """
+    store = store if store is not None else Store(fridge.name)
+
+    # key = logfile prefix, value = dict with key = param name and value = param pos
+    specs = defaultdict(dict)
+    for param in fridge.params:
+        specs[param.filename][param.name] = param.pos
+
+    jobs = []  # list of (logfile path, positions) in chronological order
+    day = start
+    while day <= stop:
+        datestamp = day.strftime("%y-%m-%d")
+        for filename, positions in specs.items():
+            path = get_logpath(fridge.logfolder, filename, datestamp)
+            if path.exists() or get_archivepath(path).exists():
+                jobs.append((path, positions))
+        day += timedelta(days=1)
+    logger.info(
+        f"Backfilling {len(jobs)} {fridge} logfile(s) from {start} to {stop}..."
+    )
+
+    nbytes = nlines = nsamples = nskipped = 0
+    tic = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(parse_logfile, *zip(*jobs)) if jobs else []
+        for (path, _), (columns, size, count) in zip(jobs, results):
+            nbytes, nlines = nbytes + size, nlines + count
+            for name, (times, values) in columns.items():
+                saved = store.insert(name, times, values)
+                nsamples, nskipped = nsamples + saved, nskipped + times.size - saved
+            logger.debug(f"Backfilled {path} with {count} lines.")
+    elapsed = time.perf_counter() - tic
+
+    stats = {
+        "files": len(jobs),
+        "lines": nlines,
+        "samples": nsamples,
+        "skipped": nskipped,  # samples already stored e.g. by an earlier backfill
+        "seconds": elapsed,
+        "lines/s": nlines / elapsed if elapsed else 0.0,
+        "MB/s": nbytes / 1e6 / elapsed if elapsed else 0.0,
+    }
+    logger.info(
+        f"Backfilled {nsamples} samples from {nlines} lines in {elapsed:.2f}s "
+        f"({stats['lines/s']:.0f} lines/s, {stats['MB/s']:.2f} MB/s)."
+    )
+    if nskipped:
+        logger.info(f"Skipped {nskipped} samples that were already stored.")
+    return stats
@@ -0,0 +1,102 @@
+""" Module to persist HAL's state across restarts """
+
+from pathlib import Path
+import sqlite3
+import threading
+
+# set checkpoint file path
+CHECKPOINTPATH = Path.cwd() / "checkpoint.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS databases (fridge TEXT PRIMARY KEY, database_id TEXT);
+CREATE TABLE IF NOT EXISTS pages (
+    fridge TEXT, param TEXT, page_id TEXT, PRIMARY KEY (fridge, param)
+);
+CREATE TABLE IF NOT EXISTS posts (
+    fridge TEXT, param TEXT, timestamp TEXT, value TEXT, PRIMARY KEY (fridge, param)
+);
+CREATE TABLE IF NOT EXISTS offsets (
+    fridge TEXT, path TEXT, inode INTEGER, offset INTEGER, last BLOB,
+    PRIMARY KEY (fridge, path)
+);
+"""
+
+
+class Checkpoint:
+    """SQLite backed store of the Notion page map, the last posted values and the reader's logfile offsets of each fridge, safe to share between threads"""
+
+    def __init__(self, path: Path = CHECKPOINTPATH) -> None:
+        """
+        path (Path) path to the SQLite file the checkpoint is stored in, created if it does not exist
+        """
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def get_database_id(self, fridge: str) -> str | None:
+        """return Notion database id saved for fridge (str), None if not saved"""
+        query = "SELECT database_id FROM databases WHERE fridge = ?"
+        with self._lock:
+            row = self._db.execute(query, (fridge,)).fetchone()
+        return row[0] if row else None
+
+    def get_page_map(self, fridge: str) -> dict[str, str]:
+        """return dict with key = param name and value = page id saved for fridge (str)"""
+        query = "SELECT param, page_id FROM pages WHERE fridge = ?"
+        with self._lock:
+            return dict(self._db.execute(query, (fridge,)))
+
+    def save_page_map(self, fridge: str, database_id: str, page_map: dict[str, str]):
+        """
+        fridge (str) name of the fridge the Notion database belongs to
+        database_id (str) Notion database id
+        page_map (dict) key = param name, value = page id, replaces any saved page map
+        """
+        with self._lock, self._db:
+            query = "INSERT OR REPLACE INTO databases VALUES (?, ?)"
+            self._db.execute(query, (fridge, database_id))
+            self._db.execute("DELETE FROM pages WHERE fridge = ?", (fridge,))
+            query = "INSERT INTO pages VALUES (?, ?, ?)"
+            rows = [(fridge, name, page_id) for name, page_id in page_map.items()]
+            self._db.executemany(query, rows)
+
+    def get_posts(self, fridge: str) -> dict[str, tuple[str, str]]:
+        """return dict with key = param name and value = tuple of (timestamp, value) last posted for fridge (str)"""
+        query = "SELECT param, timestamp, value FROM posts WHERE fridge = ?"
+        with self._lock:
+            rows = self._db.execute(query, (fridge,)).fetchall()
+        return {name: (timestamp, value) for name, timestamp, value in rows}
+
+    def save_posts(self, fridge: str, posts: dict[str, tuple[str, str]]) -> None:
+        """
+        fridge (str) name of the fridge the posts belong to
+        posts (dict) key = param name, value = tuple of (timestamp, value) posted
+        """
+        with self._lock, self._db:
+            query = "INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?)"
+            rows = [(fridge, name, *post) for name, post in posts.items()]
+            self._db.executemany(query, rows)
+
+    def get_offsets(self, fridge: str) -> dict[str, tuple[int, int, bytes]]:
+        """return dict with key = logfile path string and value = tuple of (inode, offset, last line) saved for fridge (str)"""
+        query = "SELECT path, inode, offset, last FROM offsets WHERE fridge = ?"
+        with self._lock:
+            rows = self._db.execute(query, (fridge,)).fetchall()
+        return {path: (inode, offset, last) for path, inode, offset, last in rows}
+
+    def save_offsets(self, fridge: str, offsets: dict[str, tuple[int, int, bytes]]):
+        """
+        fridge (str) name of the fridge the logfiles belong to
+        offsets (dict) key = logfile path string, value = tuple of (inode, offset, last line), replaces any saved offsets
+        """
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM offsets WHERE fridge = ?", (fridge,))
+            query = "INSERT INTO offsets VALUES (?, ?, ?, ?, ?)"
+            rows = [(fridge, path, *offset) for path, offset in offsets.items()]
+            self._db.executemany(query, rows)
+
+    def close(self) -> None:
+        """ """
+        with self._lock:
+            self._db.close()
@@ -1,12 +1,58 @@
 """ Implements subset of Notion API specific to HAL'S functioning """
 
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import threading
 import time
 
 import requests
+from requests.adapters import HTTPAdapter
 
-from hal.config import DELAY, INTERVAL, FRIDGE_NAME, NOTION_TOKENPATH, PARAMS
+from hal.checkpoint import Checkpoint
+from hal.config import NOTION_TOKENPATH
+from hal.fridge import Fridge
+from hal.limiter import RateLimiter
 from hal.logger import logger
+from hal.metrics import POST_SECONDS, POSTS, RATE_LIMITED
 from hal.param import Param
+from hal.retry import Backoff
+
+
+# 4xx status codes that Notion documents as retryable
+RETRYABLE = {408, 409, 429}
+
+
+def get_session(
+    pool_size: int = 8, tokenpath: Path = NOTION_TOKENPATH
+) -> requests.Session:
+    """
+    return keep-alive session authorized to call Notion's API, meant to be shared by all calls (and all Clients) so TLS connections are reused
+    pool_size (int) maximum number of connections kept open
+    tokenpath (Path) path to the file containing the Notion API token
+    """
+    with tokenpath.open() as tokenfile:
+        token = tokenfile.read()
+
+    session = requests.Session()
+    session.headers.update(
+        {
+            "Authorization": "Bearer " + token,
+            "Notion-Version": "2022-06-28",
+            "Content-Type": "application/json",
+        }
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_metadata(page: dict) -> tuple[str, tuple[str]]:
+    """return tuple of (title, tuple of categories) of a page (dict) as returned by Notion's API"""
+    properties = page.get("properties", {})
+    title = properties.get("Parameter", {}).get("title", [])
+    categories = properties.get("Category", {}).get("multi_select", [])
+    title = "".join(text.get("plain_text", "") for text in title)
+    return title, tuple(category.get("name") for category in categories)
 
 
 class Client:
@@ -16,73 +62,259 @@ class Client:
 
     def __init__(
         self,
+        fridge: Fridge,
+        session: requests.Session = None,
+        limiter: RateLimiter = None,
+        workers: int = 8,
+        timeout: float = 30.0,
+        connect_timeout: float = 5.0,
+        checkpoint: Checkpoint = None,
+        base_url: str = None,
     ) -> None:
-        """ """
-        with NOTION_TOKENPATH.open() as tokenfile:
-            self._token: str = tokenfile.read()
+        """
+        fridge (Fridge) fridge whose Params are posted to its Notion database
+        session (requests.Session) as returned by get_session() to make API calls with, may be shared between Clients, a new one is created if None
+        limiter (RateLimiter) to pace calls to Notion's API, may be shared between Clients, a new one matched to Notion's rate limit is created if None
+        workers (int) maximum number of API calls in flight at once when posting many values
+        timeout (float) in seconds, time to wait for Notion to respond before giving up on an API call
+        connect_timeout (float) in seconds, time to wait for a connection to Notion before giving up on an API call, short so that an outage in which connecting hangs is noticed quickly
+        checkpoint (Checkpoint) to restore the page map from instead of setting up the Notion database again, optional
+        base_url (str) URL of Notion's API, e.g. to point the Client at a local stub, default = BASE_URL
+        """
+        self._fridge = fridge
+        self._base_url = base_url if base_url is not None else Client.BASE_URL
+        self._session = session if session is not None else get_session(workers)
+        self._limiter = limiter if limiter is not None else RateLimiter()
+        self._timeout = (connect_timeout, timeout)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._checkpoint = checkpoint
 
-        self._headers: dict[str, str] = {
-            "Authorization": "Bearer " + self._token,
-            "Notion-Version": "2022-06-28",
-            "Content-Type": "application/json",
-        }
-
-        self._database_id: str = self._get_database_id()
-        logger.info(f"Notion client connected to database with id: {self._database_id}")
+        if self._restore():
+            logger.info(f"Notion client restored database with id: {self._database_id}")
+            if self._refresh():
+                return
+        else:
+            self._database_id: str = self._get_database_id()
+            logger.info(
+                f"Notion client connected to database with id: {self._database_id}"
+            )
         self._page_map: dict[Param, str] = self._get_page_map()
-        self._update_page()  # update page name and category
+        if self._checkpoint:
+            page_map = {
+                param.name: page_id for param, page_id in self._page_map.items()
+            }
+            self._checkpoint.save_page_map(
+                self._fridge.name, self._database_id, page_map
+            )
+
+    def _restore(self) -> bool:
+        """restore database id and page map from the checkpoint, return bool indicating whether all Params have a saved page"""
+        if not self._checkpoint:
+            return False
+        params = self._fridge.params
+        database_id = self._checkpoint.get_database_id(self._fridge.name)
+        page_map = self._checkpoint.get_page_map(self._fridge.name)
+        if database_id is None or any(param.name not in page_map for param in params):
+            return False
+        self._database_id = database_id
+        self._page_map = {param: page_map[param.name] for param in params}
+        return True
+
+    def _refresh(self) -> bool:
+        """
+        Update names and categories of the pages in the restored page map where they differ from those of the Param, e.g. after a category was edited in the config
+        return bool indicating whether all pages in the page map are still in the database, the page map must be set up again if not
+        """
+        metadata = {page["id"]: get_metadata(page) for page in self._get_pages()}
+        if any(page_id not in metadata for page_id in self._page_map.values()):
+            logger.info("Notion client found restored pages missing, mapping again.")
+            return False
+        stale = {
+            param: page_id
+            for param, page_id in self._page_map.items()
+            if metadata[page_id] != (param.name, (param.category,))
+        }
+        list(self._executor.map(self._update_page, stale, stale.values()))
+        logger.info(f"Notion client updated {len(stale)} restored pages.")
+        return True
 
     def _get_database_id(self) -> str:
         """get database id based on fridge_name"""
-        url = Client.BASE_URL + "/search"
-        payload = {"query": FRIDGE_NAME}
-        response = requests.post(url, json=payload, headers=self._headers)
+        url = self._base_url + "/search"
+        payload = {"query": self._fridge.name}
+        response = self._setup_request("post", url, json=payload)
         return response.json()["results"][0]["id"]
 
-    def _get_page_map(self) -> dict[str, str]:
-        """return dict with key = param name and value = page id"""
-        url = Client.BASE_URL + f"/databases/{self._database_id}/query"
-        pages = requests.post(url, headers=self._headers).json()["results"]
-        return dict(zip(PARAMS, [p["id"] for p in pages]))
+    def _get_bot_id(self) -> str:
+        """return user id of HAL's Notion integration, which pages created by HAL are created by"""
+        url = self._base_url + "/users/me"
+        return self._setup_request("get", url).json()["id"]
+
+    def _get_pages(self) -> list[dict]:
+        """return all pages in the database, following pagination cursors"""
+        url = self._base_url + f"/databases/{self._database_id}/query"
+        payload, pages = {"page_size": 100}, []  # 100 = Notion's maximum
+        while True:
+            results = self._setup_request("post", url, json=payload).json()
+            pages.extend(results["results"])
+            if not results.get("has_more"):
+                return pages
+            payload["start_cursor"] = results["next_cursor"]
+
+    def _get_page_map(self) -> dict[Param, str]:
+        """
+        Map each Param to the page titled with its name. Pages with other titles that HAL created e.g. left over from renamed Params are reused for Params without a page, and pages are created for the rest. Pages created by anyone else e.g. notes added by hand are left alone. Page names and categories are only updated where they differ from those of the Param.
+        return dict with key = Param object and value = page id
+        """
+        params = self._fridge.params
+        names = {param.name for param in params}
+        pages, orphans = {}, []  # key = title, value = (page id, metadata)
+        for page in self._get_pages():
+            metadata = get_metadata(page)
+            if metadata[0] in names and metadata[0] not in pages:
+                pages[metadata[0]] = (page["id"], metadata)
+            else:
+                creator = page.get("created_by", {}).get("id")
+                orphans.append((page["id"], metadata, creator))
+        if orphans and len(pages) < len(params):  # only look up HAL if needed
+            bot_id = self._get_bot_id()
+            orphans = [orphan[:2] for orphan in orphans if orphan[2] == bot_id]
 
-    def _update_page(self):
-        """ """
+        page_map, stale, missing = {}, [], []
+        for param in params:
+            if param.name in pages:
+                page_id, metadata = pages[param.name]
+            elif orphans:
+                page_id, metadata = orphans.pop(0)
+                logger.info(
+                    f"Reusing page {page_id} titled '{metadata[0]}' for {param.name}."
+                )
+            else:
+                missing.append(param)
+                continue
+            page_map[param] = page_id
+            if metadata != (param.name, (param.category,)):
+                stale.append(param)
+
+        # create and update pages concurrently, paced by the rate limiter
+        page_ids = self._executor.map(self._create_page, missing)
+        page_map |= dict(zip(missing, page_ids))
+        updates = {param: page_map[param] for param in stale}
+        list(self._executor.map(self._update_page, updates, updates.values()))
+        logger.info(
+            f"Notion client mapped {len(params)} Params to pages, created "
+            f"{len(missing)} and updated {len(stale)}."
+        )
+        return {param: page_map[param] for param in params}
+
+    def _get_properties(self, param: Param) -> dict:
+        """return page properties holding the name and category of param (Param)"""
+        return {
+            "Parameter": {"title": [{"text": {"content": param.name}}]},
+            "Category": {"multi_select": [{"name": param.category}]},
+        }
+
+    def _create_page(self, param: Param) -> str:
+        """create a page for param (Param) in the database, return its page id"""
+        url = self._base_url + "/pages"
         payload = {
-            "properties": {
-                "Parameter": {"title": [{"text": {}}]},
-                "Category": {"multi_select": [{}]},
-            }
+            "parent": {"database_id": self._database_id},
+            "properties": self._get_properties(param),
         }
-        for param, page_id in self._page_map.items():
-            name, category = param.name, param.category
-            url = Client.BASE_URL + f"/pages/{page_id}"
-            payload["properties"]["Parameter"]["title"][0]["text"]["content"] = name
-            payload["properties"]["Category"]["multi_select"][0]["name"] = category
-            requests.patch(url, json=payload, headers=self._headers)
-            logger.info(f"Updated {name = } and {category = } at {page_id = }")
-            time.sleep(DELAY)
-
-    def _errorcheck(self, response: requests.Response) -> bool:
-        """ """  # TODO complete it
+        page_id = self._setup_request("post", url, json=payload).json()["id"]
+        logger.info(f"Created page for {param.name} at {page_id = }")
+        return page_id
+
+    def _update_page(self, param: Param, page_id: str) -> None:
+        """update name and category of the page with page_id (str) to those of param (Param)"""
+        url = self._base_url + f"/pages/{page_id}"
+        payload = {"properties": self._get_properties(param)}
+        self._setup_request("patch", url, json=payload)
+        name, category = param.name, param.category
+        logger.info(f"Updated {name = } and {category = } at {page_id = }")
+
+    def _setup_request(
+        self, method: str, url: str, attempts: int = 5, **kwargs
+    ) -> requests.Response:
+        """
+        make an API call needed to set up the database, retrying failed calls with backoff as HAL can't run without them
+        attempts (int) number of attempts before giving up and raising the error, kwargs are passed on to requests
+        return successful response
+        """
+        backoff = Backoff()
+        for attempt in range(1, attempts + 1):
+            try:
+                response = self._request(method, url, **kwargs)
+                response.raise_for_status()
+                return response
+            except requests.exceptions.RequestException as err:
+                if attempt == attempts:
+                    raise
+                delay = backoff.failure()
+                logger.warning(f"Got {err = }, retrying in {delay:.1f}s...")
+                time.sleep(delay)
+
+    def _request(
+        self, method: str, url: str, abort: threading.Event = None, **kwargs
+    ) -> requests.Response | None:
+        """
+        make a rate limited API call with the shared session, kwargs are passed on to requests
+        abort (threading.Event) if set before the call is made, including while waiting for the rate limiter, the call is given up and None is returned
+        """
+        if not self._limiter.acquire(self._fridge.name, abort):
+            return None
+        with POST_SECONDS.time():
+            response = self._session.request(
+                method, url, timeout=self._timeout, **kwargs
+            )
+        if response.status_code == 429:
+            RATE_LIMITED.inc()
+        return response
+
+    def _errorcheck(self, response: requests.Response) -> str:
+        """
+        return "ok" if the response (requests.Response) is successful, "rejected" if Notion refused the call e.g. because the page was archived (4xx other than those Notion documents as retryable), retrying it soon won't help, and "error" otherwise
+        """
         if response.status_code == 200:
-            return True
-        else:
-            logger.error(f"{response}: {response.text}")
-            return False
+            return "ok"
+        logger.error(f"{response}: {response.text}")
+        if 400 <= response.status_code < 500 and response.status_code not in RETRYABLE:
+            return "rejected"
+        return "error"
 
-    def post(self, param: Param, value: str) -> bool:
-        """ """
+    def post(self, param: Param, value: str, abort: threading.Event = None) -> str:
+        """
+        Post value of a Param once, it is up to the caller to retry if the post fails
+        abort (threading.Event) set once Notion can't be reached, the post is given up without an API call if it is set before the call is made
+        return "ok" if the post succeeded, "error" if it failed but may succeed if retried e.g. during an outage, or "rejected" if Notion refused it for good
+        """
         page_id = self._page_map[param]
-        url = Client.BASE_URL + f"/pages/{page_id}"
+        url = self._base_url + f"/pages/{page_id}"
         data = {"properties": {"Value": {"rich_text": [{"text": {"content": value}}]}}}
         try:
-            response = requests.patch(url, json=data, headers=self._headers)
-        except (
-            requests.exceptions.ConnectionError,
-            requests.exceptions.ChunkedEncodingError,
-        ) as err:
-            logger.error(f"Got {err = }, retrying in {INTERVAL}s...")
-            time.sleep(INTERVAL)
-            self.post(param, value)
-        else:
-            return self._errorcheck(response)
+            response = self._request("patch", url, abort=abort, json=data)
+        except requests.exceptions.RequestException as err:
+            logger.error(f"Got {err = } while posting {param.name}.")
+            POSTS.inc(self._fridge.name, "error")
+            unreachable = (requests.ConnectionError, requests.Timeout)
+            if abort is not None and isinstance(err, unreachable):
+                abort.set()
+                self._limiter.wake()
+            return "error"
+        if response is None:  # given up as Notion can't be reached
+            return "error"
+        result = self._errorcheck(response)
+        POSTS.inc(self._fridge.name, result)
+        return result
+
+    def post_many(self, values: dict[Param, str]) -> dict[Param, str]:
+        """
+        Post values of many Params concurrently, paced by the rate limiter. Once a post fails because Notion can't be reached, posts not yet made are given up, so an outage costs at most one timeout per batch instead of one per batch of concurrent posts
+        values (dict) key = Param object, value = parsed value string to post
+        return dict with key = Param object and value = result of the post as returned by post()
+        """
+        abort = threading.Event()
+        futures = {
+            p: self._executor.submit(self.post, p, v, abort) for p, v in values.items()
+        }
+        return {param: future.result() for param, future in futures.items()}
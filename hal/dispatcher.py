@@ -2,51 +2,222 @@
 
 import time
 
+import requests
+
+from hal.api import Board
+from hal.checkpoint import Checkpoint
 from hal.client import Client
-from hal.config import INTERVAL, DELAY, PARAMS
+from hal.fridge import Fridge
+from hal.limiter import RateLimiter
 from hal.logger import logger
+from hal.metrics import HIT_RATE, PARAM_SECONDS, RETRIES, STALENESS
 from hal.param import Param
+from hal.retry import Backoff
+from hal.rules import Engine
+from hal.store import parse_timestamp
 
 
 class Dispatcher:
     """ """
 
-    def __init__(self) -> None:
-        """ """
-        self._interval: int = INTERVAL
-        self._client: Client = Client()
+    def __init__(
+        self,
+        fridge: Fridge,
+        checkpoint: Checkpoint = None,
+        heartbeat: int = 3600,
+        reject_time: int = 300,
+        session: requests.Session = None,
+        limiter: RateLimiter = None,
+        board: Board = None,
+        base_url: str = None,
+    ) -> None:
+        """
+        fridge (Fridge) fridge whose Params are dispatched
+        checkpoint (Checkpoint) to save posted values to and restore them from after a restart, optional
+        heartbeat (int) in seconds, time after which a value is re-posted even if it has not changed
+        reject_time (int) in seconds, time after which a Param whose post Notion rejected is posted again
+        session (requests.Session) to make Notion API calls with, may be shared between fridges, optional
+        limiter (RateLimiter) to pace Notion API calls, may be shared between fridges, optional
+        board (Board) to publish the latest values and alarms to local clients, optional
+        base_url (str) URL of Notion's API passed on to the Client, optional
+        """
+        self._fridge = fridge.name
+        self._checkpoint = checkpoint
+        self._heartbeat = heartbeat
+        self._reject_time = reject_time
+        self._board = board
+        self._client: Client = Client(
+            fridge,
+            session=session,
+            limiter=limiter,
+            checkpoint=checkpoint,
+            base_url=base_url,
+        )
         # for each param, save latest timestamp strings posted to Notion
-        self._timestamps: dict[Param, str] = {param.name: "" for param in PARAMS}
+        self._timestamps: dict[Param, str] = {param.name: "" for param in fridge.params}
+        # for each param, save value displayed on Notion and when it was posted
+        self._displayed: dict[str, tuple[str, float]] = {}
+        # for each param, save POSIX time of its latest logged value, see _report()
+        self._seen: dict[str, float] = {}
+        if checkpoint:  # don't re-post values that were posted before a restart
+            posts = checkpoint.get_posts(self._fridge)
+            for name, (timestamp, value) in posts.items():
+                if name in self._timestamps:
+                    self._timestamps[name] = timestamp
+                    self._displayed[name] = (value, time.monotonic())
+                    self._see(name, timestamp)
+        # number of updates skipped (hits) or posted (misses) due to the displayed values
+        self._hits, self._misses = 0, 0
+        # unsent updates, only the newest one is kept per param so size <= len(PARAMS)
+        self._outbox: dict[Param, tuple[str, str]] = {}
+        # key = Param whose last post Notion rejected, value = when, see _update()
+        self._rejected: dict[Param, float] = {}
+        self._backoff = Backoff()
+        self._rules = Engine(fridge.params)  # rolling state to evaluate alarm rules
 
-    def dispatch(self, data: dict[Param, dict[str, str]], siren) -> dict[Param, str]:
+    def dispatch(
+        self,
+        data: dict[Param, dict[str, str]],
+        siren,
+        new: dict[Param, dict[str, str]] = None,
+    ) -> dict[Param, str]:
         """
         data (dict) datadict as returned by the Reader
         siren (Siren) to send warnings if any Params are out of bounds
+        new (dict) all values read since the last dispatch as in Reader.new, so that rules see values logged between cycles, rules only see data if None
         return dict of alerts with key = Param object and value = param value
         """
         for param, values in data.items():
+            with PARAM_SECONDS.time(self._fridge, param.name, "rules"):
+                samples = values if new is None else new.get(param, {})
+                reasons = self._rules.update(param, samples)
             last_updated_timestamp = self._timestamps[param.name]
             latest_timestamp = "N/A" if not values else list(values)[-1]
             if latest_timestamp == "N/A":
-                self._dispatch(param, "N/A", latest_timestamp)
-            elif latest_timestamp != last_updated_timestamp:
-                value = param.parse(values[latest_timestamp])
-                if not param.validate(value):  # sound an alarm
-                    siren.warn(param, value)
-                self._dispatch(param, value, latest_timestamp)
+                self._update(param, "N/A", latest_timestamp)
+                if self._board:
+                    self._board.update(self._fridge, param, "N/A", "N/A", [])
+                continue
+            self._see(param.name, latest_timestamp)
+            if latest_timestamp != last_updated_timestamp:
+                raw_value = values[latest_timestamp]
+                with PARAM_SECONDS.time(self._fridge, param.name, "parse"):
+                    value = param.parse(raw_value)
+                if reasons is None:  # Param has no rules, just check it is valid
+                    with PARAM_SECONDS.time(self._fridge, param.name, "validate"):
+                        reasons = [] if param.validate(raw_value) else ["invalid"]
+                if reasons:  # sound an alarm
+                    siren.warn(param, value, self._fridge, "; ".join(reasons))
+                else:
+                    siren.clear(param, self._fridge)
+                self._update(param, value, latest_timestamp)
                 self._timestamps[param.name] = latest_timestamp
+                if self._board:
+                    self._board.update(
+                        self._fridge, param, value, latest_timestamp, reasons
+                    )
+        if self._board:  # serve values before posting them as posts may be slow
+            self._board.publish()
+        HIT_RATE.set(self.hit_rate, self._fridge)
+        self._report()
+        logger.debug(f"Skipped {self.hit_rate:.0%} of updates as unchanged so far.")
+        self._dispatch()
+
+    @property
+    def hit_rate(self) -> float:
+        """return fraction of updates that were not posted because the displayed value was unchanged"""
+        total = self._hits + self._misses
+        return self._hits / total if total else 0.0
 
-    def _dispatch(self, param: Param, value: str, timestamp: str) -> None:
+    def _see(self, name: str, timestamp: str) -> None:
+        """save timestamp (str) as that of the latest logged value of the param named name (str)"""
+        try:
+            self._seen[name] = parse_timestamp(timestamp)
+        except ValueError:  # unexpected timestamp format
+            pass
+
+    def _report(self) -> None:
+        """set staleness of every param with a logged value, including those missing from this cycle's data e.g. because their logfile is gone"""
+        now = time.time()
+        for name, seen in self._seen.items():
+            STALENESS.set(now - seen, self._fridge, name)
+
+    def _update(self, param: Param, value: str, timestamp: str) -> None:
         """
-        name (Param) param object
+        put update in the outbox if it changes the displayed value by more than the Param's deadband or if the displayed value is due for a heartbeat refresh. Params whose post Notion rejected are parked for reject_time, as posting them again right away would fail the same way till their page is fixed.
+        param (Param) param object
         value (str) parsed value to post
-        timestamp(str) timestamp associated with param value
+        timestamp (str) timestamp associated with param value
         """
-        success = self._client.post(param, value)
-        if success:
-            logger.info(f"Posted {param.name} = {value} as of {timestamp}.")
+        if param in self._rejected:
+            if time.monotonic() - self._rejected[param] < self._reject_time:
+                return
+            del self._rejected[param]
+        if param.name in self._displayed and param not in self._outbox:
+            displayed, posted_at = self._displayed[param.name]
+            is_fresh = time.monotonic() - posted_at < self._heartbeat
+            if is_fresh and not param.changed(displayed, value):
+                self._hits += 1
+                return
+        self._misses += 1
+        self._outbox[param] = (value, timestamp)
+
+    def _dispatch(self) -> None:
+        """
+        post all updates in the outbox in one concurrent batch, failed ones stay in the outbox to be re-posted next cycle, or once the backoff delay has passed if Notion could not be reached at all. never blocks for retries so that reading goes on during outages.
+        """
+        if not self._outbox:
+            return
+        if not self._backoff.ready:
+            logger.debug(f"Holding {len(self._outbox)} update(s) till Notion is back.")
+            return
+
+        # after an outage, probe with one update before flushing the rest in one burst
+        if self._backoff.failures:
+            probe = next(iter(self._outbox))
+            if not self._post([probe]):
+                # probe with the next update next time, one bad page can't block all
+                if probe in self._outbox:
+                    self._outbox[probe] = self._outbox.pop(probe)
+                delay = self._backoff.failure()
+                RETRIES.inc()
+                logger.info(f"Retrying {len(self._outbox)} update(s) in {delay:.1f}s.")
+                return
+        if self._post(list(self._outbox)):
+            self._backoff.success()
         else:
-            logger.info(f"Error posting {param.name} = {value}, retrying...")
-            time.sleep(self._interval)
-            self._dispatch(param, value, timestamp)
-        time.sleep(DELAY)
+            delay = self._backoff.failure()
+            RETRIES.inc()
+            logger.info(f"Retrying {len(self._outbox)} update(s) in {delay:.1f}s.")
+
+    def _post(self, params: list[Param]) -> bool:
+        """
+        post updates of params (list[Param]) in the outbox concurrently, and remove posted and rejected ones from the outbox
+        return bool indicating whether any update was posted or rejected i.e. Notion is reachable, or there were none to post
+        """
+        values = {param: self._outbox[param][0] for param in params}
+        results = self._client.post_many(values)
+        posts = {}  # key = param name, value = (timestamp, value) to checkpoint
+        for param, result in results.items():
+            value, timestamp = self._outbox[param]
+            if result == "ok":
+                logger.info(
+                    f"Posted {self._fridge} {param.name} = {value} as of {timestamp}."
+                )
+                del self._outbox[param]
+                posts[param.name] = (timestamp, value)
+                self._displayed[param.name] = (value, time.monotonic())
+            elif result == "rejected":
+                logger.error(
+                    f"Notion rejected {self._fridge} {param.name} = {value}, not "
+                    f"posting {param.name} for {self._reject_time}s, check its page."
+                )
+                del self._outbox[param]
+                self._rejected[param] = time.monotonic()
+            else:
+                logger.info(
+                    f"Error posting {self._fridge} {param.name} = {value}, will retry..."
+                )
+        if self._checkpoint and posts:
+            self._checkpoint.save_posts(self._fridge, posts)
+        return not results or any(result != "error" for result in results.values())
@@ -0,0 +1,38 @@
+""" Module to describe the fridges monitored by HAL """
+
+from pathlib import Path
+
+from hal.param import Param
+
+
+class Fridge:
+    """a fridge monitored by HAL, with the folder its instruments log to and the Params logged there"""
+
+    def __init__(self, name: str, logfolder: str | Path, params: tuple[Param]) -> None:
+        """
+        name (str) name of the fridge, must be unique and match the name of its Notion database
+        logfolder (str | Path) folder the fridge's instruments log to, containing one subfolder per date
+        params (tuple[Param]) Params to monitor
+        """
+        self.name = name
+        self.logfolder = Path(logfolder)
+        self.params = tuple(params)
+
+    def __repr__(self) -> str:
+        """ """
+        return f"Fridge({self.name})"
+
+
+def get_fridges() -> list[Fridge]:
+    """
+    return list of fridges listed as FRIDGES in the config, or of the one fridge set by FRIDGE_NAME, LOGFOLDER and PARAMS if FRIDGES is not set
+    """
+    from hal import config  # imported here as the config may import this module
+
+    fridges = getattr(config, "FRIDGES", None)
+    if fridges is None:
+        fridges = [Fridge(config.FRIDGE_NAME, config.LOGFOLDER, config.PARAMS)]
+    names = [fridge.name for fridge in fridges]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Fridges must have unique names, got {names}.")
+    return list(fridges)
@@ -0,0 +1,76 @@
+""" Module to rate limit HAL's calls to external APIs """
+
+from collections import deque
+from collections.abc import Hashable
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter that is safe to share between threads. Callers may identify themselves with a key e.g. a fridge name, calls are then handed out round robin among keys with callers waiting so that a busy key cannot starve the others.
+    """
+
+    def __init__(self, rate: float = 3.0, burst: int = 3) -> None:
+        """
+        rate (float) number of calls allowed per second on average, default = 3.0 to match Notion's rate limit
+        burst (int) maximum number of calls allowed in quick succession after being idle
+        """
+        self._rate = rate
+        self._burst = burst
+        self._tokens: float = burst
+        self._timestamp: float = time.monotonic()  # when tokens were last refilled
+        self._condition = threading.Condition()
+        # key = caller key, value = queue of waiting callers, in order of arrival
+        self._waiters: dict[Hashable, deque[object]] = {}
+        self._turns: deque[Hashable] = deque()  # keys with waiting callers, next first
+
+    def acquire(self, key: Hashable = None, abort: threading.Event = None) -> bool:
+        """
+        block till it is key's (Hashable) turn and a token is available, then consume it
+        abort (threading.Event) stop waiting once set, callers that set it must call wake() so that waiting callers notice
+        return bool indicating whether a token was consumed, False if aborted
+        """
+        ticket = object()
+        with self._condition:
+            if key not in self._waiters:
+                self._waiters[key] = deque()
+                self._turns.append(key)
+            self._waiters[key].append(ticket)
+            while True:
+                if abort is not None and abort.is_set():
+                    self._leave(key, ticket)
+                    return False
+                if self._waiters[self._turns[0]][0] is not ticket:
+                    self._condition.wait()
+                    continue
+                now = time.monotonic()
+                elapsed, self._timestamp = now - self._timestamp, now
+                self._tokens = min(self._burst, self._tokens + elapsed * self._rate)
+                if self._tokens >= 1:
+                    break
+                self._condition.wait((1 - self._tokens) / self._rate)
+
+            self._tokens -= 1
+            self._leave(key, ticket)
+            return True
+
+    def wake(self) -> None:
+        """wake up waiting callers e.g. to check whether they have been aborted"""
+        with self._condition:
+            self._condition.notify_all()
+
+    def _leave(self, key: Hashable, ticket: object) -> None:
+        """remove ticket (object) of key (Hashable) from the line, key goes to the back of the line if it was its turn"""
+        waiters = self._waiters[key]
+        is_turn = self._turns[0] == key and waiters[0] is ticket
+        waiters.remove(ticket)
+        if is_turn:
+            self._turns.popleft()
+            if waiters:  # go to the back of the line
+                self._turns.append(key)
+        elif not waiters:
+            self._turns.remove(key)
+        if not waiters:
+            del self._waiters[key]
+        self._condition.notify_all()
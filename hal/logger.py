@@ -1,20 +1,37 @@
 """ Module to log HAL's activity """
 
 from pathlib import Path
+import sys
+import threading
 
 from loguru import logger
 
 # set logs folder path
 LOGSPATH = Path.cwd() / "logs"
 
-# register log sinks with loguru logger
-logger.add(
-    LOGSPATH / "log_{time}.log",
-    format="<cyan>[{time:YY-MM-DD HH:mm:ss}]</> <lvl>[{module}] - {message}</>",
-    rotation="24 hours",  # current log file closed and new one started every 24 hours
-    retention="1 month",  # log files created more than a month ago will be removed
-    backtrace=True,
-    diagnose=True,
-)
+_lock = threading.Lock()
+_is_setup = False
 
-logger.debug("Logger activated!")
+
+def setup(folder: Path = LOGSPATH) -> None:
+    """
+    Register log sinks with loguru logger, once per process. Sinks are enqueued i.e. messages are written by a background thread, so that logging never blocks HAL's main loop on I/O. This is called by the entry point rather than on import so that importing HAL stays fast and doesn't create log files.
+    folder (Path) folder to write log files to
+    """
+    global _is_setup
+    with _lock:
+        if _is_setup:
+            return
+        logger.remove()  # replace loguru's default blocking stderr sink
+        logger.add(sys.stderr, enqueue=True)
+        logger.add(
+            folder / "log_{time}.log",
+            format="<cyan>[{time:YY-MM-DD HH:mm:ss}]</> <lvl>[{module}] - {message}</>",
+            rotation="24 hours",  # current log file closed and new one started every 24 hours
+            retention="1 month",  # log files created more than a month ago will be removed
+            enqueue=True,
+            backtrace=True,
+            diagnose=False,  # don't collect variable values in tracebacks, it is slow
+        )
+        _is_setup = True
+    logger.debug("Logger activated!")
@@ -1,37 +1,300 @@
 """ Entry point to run HAL """
 
-import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from pathlib import Path
 
+from hal import api
+from hal.archive import BLOCKSIZE, archive
+from hal.backfill import backfill
+from hal.checkpoint import Checkpoint
+from hal.client import get_session
 from hal.config import INTERVAL
 from hal.dispatcher import Dispatcher
-from hal.logger import logger
+from hal.fridge import get_fridges
+from hal.limiter import RateLimiter
+from hal.logger import logger, setup
+from hal import metrics
 from hal.reader import Reader
 from hal.siren import Siren
+from hal.store import Store
+from hal.watcher import Watcher
 
-import pprint
+# ways the load test's stubs can fail calls, see hal.replay.Stub
+FAILURES = ("ratelimit", "server", "connection", "timeout")
 
 
 @logger.catch
 def main():
+    """
+    Parse command line arguments and run HAL. 'hal' runs HAL's main loop, 'hal backfill --from <date> --to <date>' ingests past logfiles into HAL's store, 'hal archive' compresses logfiles of past days and 'hal loadtest' measures HAL's performance against synthetic or replayed logfiles.
+    """
+    parser = argparse.ArgumentParser(prog="hal", description=__doc__.strip())
+    subparsers = parser.add_subparsers(dest="command")
+    backfill_parser = subparsers.add_parser(
+        "backfill", help="parse past logfiles into HAL's store"
+    )
+    backfill_parser.add_argument(
+        "--from",
+        dest="start",
+        type=date.fromisoformat,
+        required=True,
+        help="first date to backfill in YYYY-MM-DD format",
+    )
+    backfill_parser.add_argument(
+        "--to",
+        dest="stop",
+        type=date.fromisoformat,
+        default=date.today(),
+        help="last date to backfill in YYYY-MM-DD format (inclusive), default = today",
+    )
+    backfill_parser.add_argument(
+        "--workers", type=int, help="number of worker processes, default = all cores"
+    )
+    archive_parser = subparsers.add_parser(
+        "archive", help="compress logfiles of past days into indexed archives"
+    )
+    archive_parser.add_argument(
+        "--before",
+        type=date.fromisoformat,
+        default=date.today(),
+        help="archive logfiles dated before this date in YYYY-MM-DD format, default = today",
+    )
+    archive_parser.add_argument(
+        "--blocksize",
+        type=int,
+        default=BLOCKSIZE,
+        help=f"uncompressed bytes per independently compressed block, default = {BLOCKSIZE}",
+    )
+    loadtest_parser = subparsers.add_parser(
+        "loadtest",
+        help="run HAL against synthetic or replayed logfiles and local Notion and Slack stubs, and report its performance",
+    )
+    loadtest_parser.add_argument(
+        "--duration", type=float, default=60.0, help="seconds to run for, default = 60"
+    )
+    loadtest_parser.add_argument(
+        "--params", type=int, default=100, help="number of synthetic Params"
+    )
+    loadtest_parser.add_argument(
+        "--logfiles", type=int, default=10, help="number of synthetic logfiles"
+    )
+    loadtest_parser.add_argument(
+        "--rate", type=float, default=1.0, help="lines per second per synthetic logfile"
+    )
+    loadtest_parser.add_argument(
+        "--prefill", type=float, default=0.0, help="MB of history per synthetic logfile"
+    )
+    loadtest_parser.add_argument(
+        "--alarms", type=int, default=0, help="number of always alarming Params"
+    )
+    loadtest_parser.add_argument(
+        "--replay",
+        type=Path,
+        metavar="FOLDER",
+        help="replay logfiles of the first configured fridge recorded in FOLDER",
+    )
+    loadtest_parser.add_argument(
+        "--date", help="date in yy-mm-dd format of the logfiles to replay"
+    )
+    loadtest_parser.add_argument(
+        "--speed", type=float, default=1.0, help="times faster than recorded to replay"
+    )
+    loadtest_parser.add_argument(
+        "--fridges",
+        type=int,
+        default=1,
+        metavar="N",
+        help="run one load test each for 1 up to N fridges and report how cycle time and memory use scale, default = 1",
+    )
+    loadtest_parser.add_argument(
+        "--notion-rate", type=float, default=3.0, help="Notion API calls per second"
+    )
+    loadtest_parser.add_argument(
+        "--notion-latency", type=float, default=0.0, help="seconds per Notion call"
+    )
+    loadtest_parser.add_argument(
+        "--notion-errors",
+        type=float,
+        default=0.0,
+        help="fraction of Notion calls failed",
+    )
+    loadtest_parser.add_argument(
+        "--notion-failure",
+        choices=FAILURES,
+        default="ratelimit",
+        help="how Notion calls fail: 429, 503, dropped connection or hanging, default = ratelimit",
+    )
+    loadtest_parser.add_argument(
+        "--slack-latency", type=float, default=0.0, help="seconds per Slack call"
+    )
+    loadtest_parser.add_argument(
+        "--slack-errors", type=float, default=0.0, help="fraction of Slack calls failed"
+    )
+    loadtest_parser.add_argument(
+        "--slack-failure",
+        choices=FAILURES,
+        default="ratelimit",
+        help="how Slack calls fail, as for --notion-failure",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve metrics in Prometheus text format at http://localhost:<port>/metrics",
+    )
+    parser.add_argument(
+        "--api-port",
+        type=int,
+        help="serve latest values at http://localhost:<port>/values and as Server-Sent Events at /events",
+    )
+    parser.add_argument(
+        "--profile",
+        type=int,
+        metavar="CYCLES",
+        help="profile this many cycles of the main loop and dump a report",
+    )
+    args = parser.parse_args()
+    setup()
+
+    if args.command == "backfill":
+        for fridge in get_fridges():
+            backfill(fridge, args.start, args.stop, workers=args.workers)
+    elif args.command == "archive":
+        logfolders = {fridge.logfolder for fridge in get_fridges()}
+        if args.before > date.today():
+            parser.error("--before must not be later than today")
+        for logfolder in sorted(logfolders):
+            archive(logfolder, args.before, args.blocksize)
+    elif args.command == "loadtest":
+        if args.replay and not args.date:
+            parser.error("--date is required to replay logfiles")
+        if args.fridges < 1:
+            parser.error("--fridges must be at least 1")
+        # imported here as only load tests need it
+        from hal.replay import loadtest, scale
+
+        kwargs = dict(
+            duration=args.duration,
+            nparams=args.params,
+            nfiles=args.logfiles,
+            rate=args.rate,
+            prefill=args.prefill,
+            nalarms=args.alarms,
+            source=args.replay,
+            date=args.date,
+            speed=args.speed,
+            fridge=get_fridges()[0] if args.replay else None,
+            interval=INTERVAL,
+            notion_rate=args.notion_rate,
+            notion_latency=args.notion_latency,
+            notion_errors=args.notion_errors,
+            notion_failure=args.notion_failure,
+            slack_latency=args.slack_latency,
+            slack_errors=args.slack_errors,
+            slack_failure=args.slack_failure,
+        )
+        if args.fridges > 1:
+            scale(args.fridges, **kwargs)
+        else:
+            loadtest(**kwargs)
+    else:
+        run(
+            metrics_port=args.metrics_port, api_port=args.api_port, profile=args.profile
+        )
+
+
+def run(metrics_port: int = None, api_port: int = None, profile: int = None):
     """
     HAL's main loop.
 
     Coordinates interaction between the reader, dispatcher, and the siren to read logfiles based on a user-specified config, post parameter values to Notion, and send alerts to a Slack channel.
+    All fridges in the config are monitored by one loop. They share one Notion session, one rate limiter that takes turns between fridges, and one Slack client, and each fridge has its own reader, dispatcher and store.
+
+    metrics_port (int) port to serve metrics at, metrics are not served if None
+    api_port (int) port to serve latest values at, values are not served if None
+    profile (int) number of cycles to profile, no profiling if None
     """
     logger.debug(f"Starting up HAL...")
-    reader = Reader()
-    dispatcher = Dispatcher()
+    if metrics_port is not None:
+        metrics.serve(metrics_port)
+    profiler = metrics.Profiler(profile) if profile else None
+    board = None
+    if api_port is not None:
+        board = api.Board()
+        api.serve(board, api_port)
+    fridges = get_fridges()
+    checkpoint = Checkpoint()
+    session, limiter = get_session(), RateLimiter()  # shared by all fridges
+    readers = [Reader(fridge, checkpoint=checkpoint) for fridge in fridges]
+    dispatchers = [
+        Dispatcher(
+            fridge,
+            checkpoint=checkpoint,
+            session=session,
+            limiter=limiter,
+            board=board,
+        )
+        for fridge in fridges
+    ]
+    stores = [Store(fridge.name) for fridge in fridges]
     siren = Siren()
+    watcher = Watcher()
+    # dispatch fridges concurrently so the rate limiter can take turns between them
+    executor = ThreadPoolExecutor(max_workers=len(fridges))
+    logger.info(f"Monitoring {len(fridges)} fridge(s): {fridges}.")
 
     try:
+        paths = None  # read all logfiles on the first cycle
         while True:
             logger.debug("Reading and posting data...")
-            data = reader.read()
-            dispatcher.dispatch(data, siren)
-            logger.debug(f"Sleeping for {INTERVAL}s till next update...")
-            time.sleep(INTERVAL)
+            cycle(readers, stores, dispatchers, siren, executor, paths)
+            if profiler:
+                profiler.tick()
+            logger.debug(f"Waiting up to {INTERVAL}s for logfiles to change...")
+            # re-read all logfiles at least every INTERVAL, even if some keep changing
+            logpaths = {path for reader in readers for path in reader.logspec}
+            with metrics.STAGE_SECONDS.time("wait"):
+                paths = watcher.wait_cycle(logpaths, interval=INTERVAL)
     except KeyboardInterrupt:
         logger.debug("Stopped HAL due to keyboard interrupt.")
+    finally:
+        executor.shutdown()
+        siren.close()
+        checkpoint.close()
+
+
+def cycle(
+    readers: list[Reader],
+    stores: list[Store],
+    dispatchers: list[Dispatcher],
+    siren: Siren,
+    executor: ThreadPoolExecutor,
+    paths: set[Path] = None,
+) -> None:
+    """
+    Run one cycle of HAL's main loop, shared with load tests so that they measure what HAL runs. Reads logfiles, stores every value read, dispatches the latest values and sends alerts raised in the cycle.
+    readers, stores, dispatchers (list) one of each per fridge, in the same order
+    siren (Siren) to send alerts with, shared by all fridges
+    executor (ThreadPoolExecutor) with a worker per fridge, to dispatch fridges concurrently so the rate limiter can take turns between them
+    paths (set[Path]) logfiles that changed since the last cycle, all logfiles are read if None
+    """
+    with metrics.STAGE_SECONDS.time("read"):
+        data = [
+            reader.read(None if paths is None else paths & reader.logspec.keys())
+            for reader in readers
+        ]
+    with metrics.STAGE_SECONDS.time("store"):
+        for store, reader in zip(stores, readers):
+            store.append(reader.new)  # every value read, not just the latest
+    with metrics.STAGE_SECONDS.time("dispatch"):
+        dispatches = [
+            executor.submit(dispatcher.dispatch, fridge_data, siren, reader.new)
+            for dispatcher, reader, fridge_data in zip(dispatchers, readers, data)
+        ]
+        for dispatch in dispatches:
+            dispatch.result()
+    siren.flush()  # send alerts raised in this cycle as one message per fridge
 
 
 if __name__ == "__main__":
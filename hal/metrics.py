@@ -0,0 +1,260 @@
+""" Module to instrument HAL's activity and expose it in Prometheus text format """
+
+import bisect
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+from pathlib import Path
+import pstats
+import sys
+import threading
+import time
+
+from hal.logger import logger
+
+# default histogram buckets in seconds, from sub-millisecond parsing to slow API calls
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+
+
+class Metric:
+    """base class of metrics with optional labels, safe to update from many threads"""
+
+    TYPE: str = ""
+    registry: list["Metric"] = []  # all metrics created, in order of creation
+
+    def __init__(self, name: str, description: str, labels: tuple[str] = ()) -> None:
+        """
+        name (str) metric name, must be unique
+        description (str) help text of the metric
+        labels (tuple[str]) label names, values are passed in the same order when updating the metric
+        """
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values: dict[tuple[str], object] = {}  # key = label values
+        self._lock = threading.Lock()
+        Metric.registry.append(self)
+
+    def _labelstring(self, values: tuple[str], extra: str = "") -> str:
+        """return label string e.g. {stage="read"} for label values (tuple[str])"""
+        pairs = [f'{k}="{v}"' for k, v in zip(self.labels, values)]
+        pairs += [extra] if extra else []
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> list[str]:
+        """return lines of this metric in Prometheus text format"""
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.TYPE}",
+        ]
+        with self._lock:
+            items = sorted(self._values.items())
+        for values, value in items:
+            lines.extend(self._render(values, value))
+        return lines
+
+    def _render(self, values: tuple[str], value) -> list[str]:
+        """return lines of one labelled value of this metric"""
+        return [f"{self.name}{self._labelstring(values)} {value}"]
+
+
+class Counter(Metric):
+    """monotonically increasing count"""
+
+    TYPE = "counter"
+
+    def inc(self, *values: str, amount: float = 1) -> None:
+        """increase count with label values (str) by amount (float)"""
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+
+class Gauge(Metric):
+    """value that can go up and down"""
+
+    TYPE = "gauge"
+
+    def set(self, value: float, *values: str) -> None:
+        """set value (float) with label values (str)"""
+        with self._lock:
+            self._values[values] = value
+
+
+class Histogram(Metric):
+    """distribution of observed values in cumulative buckets"""
+
+    TYPE = "histogram"
+
+    def __init__(self, *args, buckets: tuple[float] = BUCKETS, **kwargs) -> None:
+        """buckets (tuple[float]) upper bounds of buckets in ascending order"""
+        super().__init__(*args, **kwargs)
+        self._buckets = buckets
+
+    def observe(self, value: float, *values: str) -> None:
+        """record value (float) with label values (str)"""
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            if values not in self._values:  # counts per bucket, +Inf, sum
+                self._values[values] = [[0] * (len(self._buckets) + 1), 0.0]
+            counts, _ = state = self._values[values]
+            counts[index] += 1
+            state[1] += value
+
+    @contextlib.contextmanager
+    def time(self, *values: str):
+        """context manager that records time (in seconds) spent in it with label values (str)"""
+        tic = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - tic, *values)
+
+    def _render(self, values: tuple[str], value) -> list[str]:
+        """ """
+        counts, total = value
+        lines, cumulative = [], 0
+        for bound, count in zip((*self._buckets, "+Inf"), counts):
+            cumulative += count
+            labels = self._labelstring(values, f'le="{bound}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        lines.append(f"{self.name}_sum{self._labelstring(values)} {total}")
+        lines.append(f"{self.name}_count{self._labelstring(values)} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    """return all metrics in Prometheus text format"""
+    return (
+        "\n".join(line for metric in Metric.registry for line in metric.render()) + "\n"
+    )
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """serves metrics at /metrics"""
+
+    def do_GET(self) -> None:
+        """ """
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        """don't log every scrape"""
+
+
+def serve(port: int = 9090, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serve metrics over HTTP from a daemon thread
+    port (int) port to listen on
+    host (str) address to listen on, default = localhost only
+    return the running server
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Serving metrics at http://{host}:{port}/metrics")
+    return server
+
+
+class Profiler:
+    """
+    profiles a number of cycles of HAL's main loop and dumps a report. cProfile only profiles the thread it is enabled in, so the stacks of all threads, including the dispatch and Slack workers, are sampled at a fixed interval instead
+    """
+
+    def __init__(self, cycles: int, path: Path = None, interval: float = 0.005) -> None:
+        """
+        cycles (int) number of cycles to profile
+        path (Path) path to dump profile stats to, can be opened with pstats or snakeviz. default = profile_{time}.prof in the working directory
+        interval (float) in seconds, time between samples
+        """
+        self._cycles = cycles
+        filename = f"profile_{time.strftime('%y%m%d-%H%M%S')}.prof"
+        self._path = path or Path.cwd() / filename
+        self._interval = interval
+        # in pstats format, key = (filename, line, function), value = (primitive calls, calls, own time, cumulative time, callers)
+        self.stats: dict[tuple, tuple] = {}
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+
+    def tick(self) -> None:
+        """mark the end of a cycle, dump report once enough cycles have been profiled"""
+        if self._cycles <= 0:
+            return
+        self._cycles -= 1
+        if not self._cycles:
+            self._stop.set()
+            self._sampler.join()
+            report = io.StringIO()
+            stats = pstats.Stats(self, stream=report)
+            stats.dump_stats(self._path)
+            stats.sort_stats("cumulative").print_stats(20)
+            logger.info(f"Dumped profile to {self._path}:\n{report.getvalue()}")
+
+    def create_stats(self) -> None:
+        """called by pstats.Stats to load self.stats"""
+
+    def _sample(self) -> None:
+        """sample the stacks of all other threads every interval until stopped"""
+        tic = time.perf_counter()
+        while not self._stop.wait(self._interval):
+            toc = time.perf_counter()
+            elapsed, tic = toc - tic, toc
+            for ident, frame in sys._current_frames().items():
+                if ident != threading.get_ident():
+                    self._record(frame, elapsed)
+
+    def _record(self, frame, elapsed: float) -> None:
+        """
+        add the stack ending in frame (frame) to the stats, as if each function on it had been called and the innermost one had been running for elapsed (float) seconds
+        """
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+            frame = frame.f_back
+        stack.reverse()  # outermost first
+        seen, caller = set(), None
+        for depth, key in enumerate(stack):
+            cc, nc, tt, ct, callers = self.stats.get(key, (0, 0, 0.0, 0.0, {}))
+            tt += elapsed if depth == len(stack) - 1 else 0.0
+            ct += elapsed if key not in seen else 0.0  # count recursion once
+            if caller is not None:
+                edge = callers.get(caller, (0, 0, 0.0, 0.0))
+                callers[caller] = (edge[0] + 1, edge[1] + 1, edge[2], edge[3] + elapsed)
+            self.stats[key] = (cc + (key not in seen), nc + 1, tt, ct, callers)
+            seen.add(key)
+            caller = key
+
+
+# metrics HAL is instrumented with
+STAGE_SECONDS = Histogram(
+    "hal_stage_seconds", "Time spent in each stage of the main loop", ("stage",)
+)
+PARAM_SECONDS = Histogram(
+    "hal_param_seconds",
+    "Time spent parsing and validating each Param",
+    ("fridge", "param", "stage"),
+)
+POST_SECONDS = Histogram("hal_post_seconds", "Round-trip time of Notion API calls")
+READ_BYTES = Counter("hal_read_bytes_total", "Bytes read from logfiles")
+READ_LINES = Counter("hal_read_lines_total", "Lines read from logfiles")
+POSTS = Counter("hal_posts_total", "Values posted to Notion", ("fridge", "result"))
+RETRIES = Counter("hal_retries_total", "Retries scheduled after failed posts")
+RATE_LIMITED = Counter("hal_rate_limited_total", "Notion API calls rejected with 429")
+ALERTS = Counter("hal_alerts_total", "Alerts sent to Slack", ("fridge", "param"))
+HIT_RATE = Gauge(
+    "hal_hit_rate",
+    "Fraction of updates not posted to Notion as the displayed value was unchanged",
+    ("fridge",),
+)
+STALENESS = Gauge(
+    "hal_staleness_seconds",
+    "Age of the latest logged value of each Param",
+    ("fridge", "param"),
+)
@@ -1,8 +1,23 @@
 """ """
 
+from collections.abc import Sequence
+from functools import cached_property
 import math
+import threading
 
-import pint
+_registry = None  # pint.UnitRegistry shared by all NumParams, see get_registry()
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """return the pint.UnitRegistry shared by all NumParams, it is created on first use as importing pint and loading its unit definitions takes a while"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            import pint
+
+            _registry = pint.UnitRegistry()
+        return _registry
 
 
 class Param:
@@ -41,6 +56,10 @@ class Param:
         """ """
         raise NotImplementedError("Subclass(es) to implement validate()")
 
+    def changed(self, old: str, new: str) -> bool:
+        """return bool indicating whether parsed value new (str) differs enough from old (str) to be worth displaying"""
+        return old != new
+
 
 class BinParam(Param):
     """binary parameter that takes on two values - 0 (TRUE) and 1 (FALSE)"""
@@ -50,15 +69,17 @@ class BinParam(Param):
         return str(bool(float(value)))
 
     def validate(self, value: str) -> bool:
-        """ """
-        return value in ("True", "False")
+        """check if raw value (str) as logged can be read as a binary value"""
+        try:
+            float(value)
+        except ValueError:
+            return False
+        return True
 
 
 class NumParam(Param):
     """numerical parameter that takes on real number values with the option of attaching physical units"""
 
-    ureg = pint.UnitRegistry()
-
     def __init__(
         self,
         units: str,
@@ -66,6 +87,10 @@ class NumParam(Param):
         uformats: dict[str, range] = None,
         has_scinot: bool = False,
         bounds: tuple[float, float] = None,
+        deadband: float = 0.0,
+        rel_deadband: float = 0.0,
+        hysteresis: float = 0.0,
+        rules: Sequence = (),
         **kwargs,
     ) -> None:
         """
@@ -73,40 +98,106 @@ class NumParam(Param):
         ndp (int) number of decimal places to round the value(s) to, default = 2.
         uformats (dict) additional unit formatting for the value to be displayed in human readable format. Key = units (string must be recognized by Pint) and value = range object, then the unit will be applied based on which range the order of magnitude of the value falls in.
         scinot (bool) whether or not to display the number in scientific notation
-        bounds (float, float) tuple (min, max) indicate the open interval of non-alarming values for this parameter
+        bounds (float, float) tuple (min, max) indicate the open interval of non-alarming values for this parameter, in the units the value is logged in
+        deadband (float) changes in the displayed value smaller than or equal to this, in display units, are not worth displaying, default = 0.0.
+        rel_deadband (float) like deadband, but as a fraction of the displayed value e.g. 0.01 ignores changes up to 1%, default = 0.0. the larger of the two deadbands applies.
+        hysteresis (float) once out of bounds, the value must be back inside bounds by more than this, in the units the value is logged in, for the alarm to clear, default = 0.0.
+        rules (Sequence[Rule]) hal.rules.Rule objects to alarm on rolling statistics of the value e.g. its rate of change, in addition to bounds, default = no rules.
         """
-        self.units = getattr(NumParam.ureg, str(units), None)  # None = dimensionless
+        self._units = units  # resolved against the unit registry on first use
         self.ndp = ndp
         self.uformats = uformats
         self.has_scinot = has_scinot
         self.bounds = bounds
+        self.deadband = deadband
+        self.rel_deadband = rel_deadband
+        self.hysteresis = hysteresis
+        self.rules = tuple(rules)
         super().__init__(**kwargs)
 
+        # precompute value formatting so that parsing does not go through pint
+        self._spec = f".{self.ndp}{'e' if self.has_scinot else 'f'}"
+        self._exponents, self._lowest = self._get_exponent_table()
+
+    @cached_property
+    def units(self):
+        """return pint.Unit the Param value is logged in, None if dimensionless"""
+        return getattr(get_registry(), str(self._units), None)
+
+    @cached_property
+    def _formats(self) -> tuple[list[float], list[float], list[str]]:
+        """
+        Find how to convert and format values logged in self.units to each of the units in self.uformats, on first parse so that Params that are never parsed don't need pint. Index 0 is reserved for self.units.
+        return tuple of (scales, offsets, suffixes) such that a value is displayed as f"{value * scale + offset:{self._spec}}{suffix}"
+        """
+        ureg = get_registry()
+        scales, offsets, suffixes = [], [], []
+        for units in [self.units, *(self.uformats or {})]:
+            zero, one = (ureg.Quantity(m, self.units) for m in (0.0, 1.0))
+            if units is not self.units:
+                zero, one = zero.to(units), one.to(units)
+            scales.append(one.magnitude - zero.magnitude)
+            offsets.append(zero.magnitude)
+            # let pint decide how units are displayed, strip off the magnitude
+            zero = ureg.Quantity(0.0, zero.units)
+            suffixes.append(f"{zero:~{self._spec}}"[len(f"{0.0:{self._spec}}") :])
+        return scales, offsets, suffixes
+
+    def _get_exponent_table(self) -> tuple[list[int], int]:
+        """
+        Build lookup table from order of magnitude of a value to the index of the units (as in _formats) it is to be displayed in
+        return tuple of (table, lowest exponent in table)
+        """
+        exponents = {}
+        for index, interval in enumerate((self.uformats or {}).values(), start=1):
+            for exponent in interval:
+                exponents.setdefault(exponent, index)  # first matching units win
+        if not exponents:
+            return [], 0
+        lowest, highest = min(exponents), max(exponents)
+        table = [0] * (highest - lowest + 1)
+        for exponent, index in exponents.items():
+            table[exponent - lowest] = index
+        return table, lowest
+
     def parse(self, value: str) -> str:
         """
         value (str) raw value string to be parsed, must be compatible with being casted as a float.
         return parsed value string to be displayed to user
         """
-        quantity = NumParam.ureg.Quantity(float(value), self.units)
-
-        if self.uformats and quantity.magnitude:  # ignore zero values
-            exponent = math.floor(math.log10(abs(float(value))))
-            for units, interval in self.uformats.items():
-                if exponent in interval:
-                    quantity = quantity.to(units)
-                    break
-
-        if self.has_scinot:
-            return f"{quantity:~.{self.ndp}e}"
-        else:
-            return f"{quantity:~.{self.ndp}f}"
+        magnitude = float(value)
+        index = 0
+        if self._exponents and magnitude:  # ignore zero values
+            exponent = math.floor(math.log10(abs(magnitude))) - self._lowest
+            if 0 <= exponent < len(self._exponents):
+                index = self._exponents[exponent]
+        scales, offsets, suffixes = self._formats
+        magnitude = magnitude * scales[index] + offsets[index]
+        return f"{magnitude:{self._spec}}{suffixes[index]}"
+
+    def changed(self, old: str, new: str) -> bool:
+        """
+        old (str) parsed value currently displayed
+        new (str) parsed value to be displayed
+        return bool indicating whether new differs from old by more than the deadband, values displayed in different units are always considered changed
+        """
+        if not (self.deadband or self.rel_deadband) or old == new:
+            return old != new
+        old_magnitude, _, old_units = old.partition(" ")
+        new_magnitude, _, new_units = new.partition(" ")
+        if old_units != new_units:
+            return True
+        try:
+            old_magnitude, new_magnitude = float(old_magnitude), float(new_magnitude)
+        except ValueError:  # e.g. "N/A"
+            return True
+        deadband = max(self.deadband, self.rel_deadband * abs(old_magnitude))
+        return abs(new_magnitude - old_magnitude) > deadband
 
     def validate(self, value: str) -> bool:
-        """check if value (str), which should be castable to float, is within bounds, if bounds have been defined
+        """check if raw value (str) as logged, which should be castable to float, is within bounds, if bounds have been defined. bounds are in the units the value is logged in.
         return bool indicating whether the value is valid or not
         """
-        quantity = pint.Quantity(*value.split(maxsplit=1))
-        magnitude = float(quantity.magnitude)
-        if self.bounds and not self.bounds[0] < magnitude < self.bounds[1]:
+        if self.bounds and not self.bounds[0] < float(value) < self.bounds[1]:
             return False
         return True
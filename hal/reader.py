@@ -1,21 +1,196 @@
 """ This module contains utilities that read data logged by instruments """
 
-from collections import defaultdict
+from collections import defaultdict, deque
+from collections.abc import Container, Hashable
 from datetime import datetime
+import os
 from pathlib import Path
-import time
 
-from hal.config import LOGFOLDER, PARAMS
+from hal.checkpoint import Checkpoint
+from hal.fridge import Fridge
+from hal.metrics import READ_BYTES, READ_LINES
 from hal.param import Param
 
 
+def get_logpath(folder: Path, filename: str, date: str) -> Path:
+    """
+    folder (Path) folder the instruments log to, containing one subfolder per date
+    filename (str) prefix of the logfile
+    date (str) date in yy-mm-dd format e.g. 23-01-12
+    return path of the logfile
+    """
+    return folder / f"{date}/{filename}{date}.log"
+
+
+class Plan:
+    """
+    Extraction plan compiled once per logfile schema. Maps keyword positioned values to the column they are logged in so that each row is checked with one comparison per value instead of a search, and only re-learns a column when the row layout changes.
+    """
+
+    def __init__(self, positions: dict[Hashable, int | str]) -> None:
+        """
+        positions (dict) key = anything identifying a value e.g. a Param, value = position of the value as defined by Param.pos
+        """
+        self._indices = [
+            (key, pos) for key, pos in positions.items() if isinstance(pos, int)
+        ]
+        self._keywords = [
+            (key, pos) for key, pos in positions.items() if isinstance(pos, str)
+        ]
+        self._columns: dict[Hashable, int] = {}  # key = key, value = keyword column
+
+    def extract(self, token: list[str], keys: Container = None) -> dict[Hashable, str]:
+        """
+        token (list[str]) line of a logfile split by its delimiter
+        keys (Container) if given, only extract values whose key is in keys
+        return dict with key = key and value = value string, keys whose keyword is not present in the token or has no value next to it (bad log) are left out
+        """
+        values = {}
+        for key, pos in self._indices:  # pos = col index
+            if keys is None or key in keys:
+                values[key] = token[pos]
+        for key, keyword in self._keywords:  # pos = keyword adjacent
+            if keys is not None and key not in keys:
+                continue
+            column = self._columns.get(key)
+            if column is None or column + 1 >= len(token) or token[column] != keyword:
+                try:  # layout changed, re-learn keyword column
+                    column = token.index(keyword)
+                except ValueError:  # keyword not present in token = bad log
+                    continue
+                if column + 1 >= len(token):  # keyword without value = bad log
+                    continue
+                self._columns[key] = column
+            # assume value is right next to position keyword
+            values[key] = token[column + 1]
+        return values
+
+
+class Tail:
+    """follows a logfile and keeps its latest complete lines in memory, along with all lines consumed by the latest update"""
+
+    def __init__(self, path: Path, maxlen: int, chunksize: int = 4096) -> None:
+        """
+        path (Path) path to the logfile to follow
+        maxlen (int) number of latest lines to keep in memory
+        chunksize (int) number of bytes read per step when seeking back from the end of the logfile
+        """
+        self.path = path
+        self.lines: deque[str] = deque(maxlen=maxlen)
+        self.new: list[str] = []  # lines consumed by the latest update, in order
+        self._chunksize = chunksize
+        self._inode: int | None = None  # to detect logfiles that have been replaced
+        self._mtime: int | None = None  # to detect logfiles rewritten to the same size
+        self._offset: int = 0  # byte offset up to which the logfile has been consumed
+        self._last: bytes = b""  # last consumed line, to detect rewritten logfiles
+        self._resume: tuple[int, int, bytes] | None = None  # state to resume from
+
+    @property
+    def state(self) -> tuple[int, int, bytes]:
+        """return tuple of (inode, offset, last consumed line) that can be resumed from"""
+        return self._inode, self._offset, self._last
+
+    def resume(self, state: tuple[int, int, bytes]) -> None:
+        """
+        On the first update, resume from state (tuple) as returned by 'state', so that lines appended since then are read as new lines. Ignored if the logfile has been replaced, truncated or rewritten since.
+        """
+        self._resume = state
+
+    def update(self) -> bool:
+        """
+        Read bytes appended to the logfile since the last update. On the first update, or if the logfile has been replaced, truncated or rewritten, seek back from the end of the logfile instead to recover the latest 'maxlen' lines.
+        return bool indicating whether new lines were read
+        """
+        self.new = []
+        stat = os.stat(self.path)
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            resume, self._resume = self._resume, None
+            if not resume or resume[0] != stat.st_ino or resume[1] > stat.st_size:
+                return self._seek(stat)
+            self._seek(stat, end=resume[1])  # read lines appended since below
+            if self._last != resume[2]:  # logfile has been rewritten since
+                return self._seek(stat)
+            self.new = []  # lines up to the resumed state were consumed before
+        if stat.st_size == self._offset and stat.st_mtime_ns == self._mtime:
+            return False  # nothing appended or rewritten since last update
+        self._mtime = stat.st_mtime_ns
+
+        with self.path.open("rb") as file:
+            # re-read the last consumed line, it must be unchanged if only appended to
+            file.seek(self._offset - len(self._last))
+            chunk = file.read(stat.st_size - file.tell())
+        if not chunk.startswith(self._last):  # logfile has been rewritten in place
+            return self._seek(stat)
+        chunk = chunk[len(self._last) :]
+
+        end = chunk.rfind(b"\n") + 1  # only consume complete lines
+        if not end:
+            return False
+        self._consume(chunk[:end])
+        return True
+
+    def _seek(self, stat: os.stat_result, end: int = None) -> bool:
+        """
+        Re-initialize by reading the logfile backwards from its end in chunks until 'maxlen' complete lines are found or the start of the logfile is reached
+        stat (os.stat_result) latest stat of the logfile
+        end (int) byte offset to read backwards from instead of the end of the logfile
+        return bool indicating whether any lines were read
+        """
+        self.lines.clear()
+        self._inode, self._offset, self._last = stat.st_ino, 0, b""
+        self._mtime = stat.st_mtime_ns
+        with self.path.open("rb") as file:
+            position, chunk = stat.st_size if end is None else end, b""
+            while position and chunk.count(b"\n") <= self.lines.maxlen:
+                step = min(self._chunksize, position)
+                position -= step
+                file.seek(position)
+                chunk = file.read(step) + chunk
+        if position:  # first line may be partial, it is outside 'maxlen' anyway
+            start = chunk.find(b"\n") + 1
+            position, chunk = position + start, chunk[start:]
+        self._offset = position
+        end = chunk.rfind(b"\n") + 1  # ignore incomplete last line, if any
+        return self._consume(chunk[:end])
+
+    def _consume(self, chunk: bytes) -> bool:
+        """
+        Advance past chunk (bytes) of complete lines and keep them in memory
+        return bool indicating whether chunk had any lines
+        """
+        if not chunk:
+            return False
+        self._offset += len(chunk)
+        self._last = chunk[chunk.rfind(b"\n", 0, -1) + 1 :]
+        text = chunk.decode(encoding="utf-8", errors="ignore")
+        lines = text.split("\n")[:-1]
+        lines = [line.rstrip("\r") for line in lines]
+        self.lines.extend(lines)
+        self.new.extend(lines)
+        READ_BYTES.inc(amount=len(chunk))
+        READ_LINES.inc(amount=len(lines))
+        return True
+
+
 class Reader:
     """ """
 
-    def __init__(self) -> None:
-        """ """
-        self._path: Path = Path(LOGFOLDER)
-        self._params: tuple[Param] = PARAMS
+    def __init__(self, fridge: Fridge, checkpoint: Checkpoint = None) -> None:
+        """
+        fridge (Fridge) fridge whose logfiles are read
+        checkpoint (Checkpoint) to save logfile offsets to and resume from after a restart, optional
+        """
+        self._fridge = fridge.name
+        self._path: Path = fridge.logfolder
+        self._params: tuple[Param] = fridge.params
+        self._tails: dict[Path, Tail] = {}  # key = logfile Path, value = Tail
+        # key = logfile prefix, value = Plan to extract values of Params logged in it
+        self._plans: dict[str, Plan] = {}
+        self._checkpoint = checkpoint
+        self._offsets = checkpoint.get_offsets(self._fridge) if checkpoint else {}
+        # values in lines consumed since the last read(), see 'new'
+        self._new: dict[Param, dict[str, str]] = defaultdict(dict)
+        self.new: dict[Param, dict[str, str]] = {}
         self._data: dict[Param, dict[str, str]] = self._read(last=False)
 
     @property
@@ -24,54 +199,125 @@ class Reader:
         # get current date in yy-mm-dd format e.g. 23-01-12
         date = datetime.now().strftime("%y-%m-%d")
         # get dict with key = Param and value = logfile Path
-        paths = {p: self._path / f"{date}/{p.filename}{date}.log" for p in self._params}
+        paths = {p: get_logpath(self._path, p.filename, date) for p in self._params}
         # return dict with key = logfile Path and value = list[Param]
         logspec = defaultdict(list)
         for param, filepath in paths.items():
             logspec[filepath].append(param)
         return logspec
 
-    def _read(self, last=True) -> dict[Param, dict[str, str]]:
+    def _tail(self, path: Path, params: list[Param]) -> Tail:
+        """
+        Internal method to follow a logfile without re-reading it whole
+        path (Path) logfile path
+        params (list[Param]) Params logged in the logfile, decides how many lines to keep
+        return updated Tail of the logfile
+        """
+        if path not in self._tails:
+            maxlen = max(param.nvals for param in params)
+            self._tails[path] = Tail(path, maxlen)
+            if str(path) in self._offsets:
+                self._tails[path].resume(self._offsets[str(path)])
+        tail = self._tails[path]
+        tail.update()
+        return tail
+
+    def _plan(self, params: list[Param]) -> Plan:
+        """return Plan to extract values of params (list[Param]) logged in the same logfile, compiled once per logfile prefix"""
+        filename = params[0].filename
+        if filename not in self._plans:
+            self._plans[filename] = Plan({param: param.pos for param in params})
+        return self._plans[filename]
+
+    def _collect(self, lines: list[str], params: list[Param]) -> None:
+        """keep values of params (list[Param]) in lines (list[str]) of their logfile to be returned as 'new' by the next read()"""
+        plan = self._plan(params)
+        for line in lines:
+            token = line.split(",")
+            try:
+                timestamp = f"{token[0]} {token[1]}"
+                extracted = plan.extract(token)
+            except IndexError:  # ignore bad log
+                continue
+            for param, value in extracted.items():
+                self._new[param][timestamp] = value
+
+    def _read(self, last=True, paths=None) -> dict[Param, dict[str, str]]:
         """
-        Internal method to read logfiles. If last=True, data dictionary value contains only the last timestamp and value pair, if last=False, we read last 'param.nvals' in reverse chronological order for each Param.
+        Internal method to read logfiles. If last=True, data dictionary value contains only the last timestamp and value pair, if last=False, we read last 'param.nvals' in reverse chronological order for each Param. If paths (set[Path]) is given, only logfiles in paths are read.
         return dict with same structure as read() and make same assumptions as read()
         """
-        data = {param: {} for param in self._params}
-        for path, params in self.logspec.items():
-            if path.exists():  # empty data dict if path does not exist
-                with path.open() as file:
-                    tokens = [line.rstrip("\n").split(",") for line in file.readlines()]
-                for param in params:  # read 'nvals' or latest token(s) for each param
-                    nvals = 1 if last else param.nvals
-                    for token in tokens[-nvals:][::-1]:
-                        timestamp = f"{token[0]} {token[1]}"
-                        if isinstance(param.pos, int):  # pos = col index
-                            data[param][timestamp] = token[param.pos]
-                        elif isinstance(param.pos, str):  # pos = keyword adjacent
-                            try:
-                                idx = token.index(param.pos)
-                            except ValueError:  # keyword not present in token = bad log
-                                pass  # ignore bad log
-                            else:  # assume value is right next to position keyword
-                                data[param][timestamp] = token[idx + 1]
+        logspec = self.logspec
+        # forget logfiles no longer in the logspec e.g. after the date rolls over,
+        # after keeping the values logged in them since the last read
+        for path in self._tails.keys() - logspec.keys():
+            tail = self._tails.pop(path)
+            date = path.parent.name
+            params = [
+                param
+                for param in self._params
+                if get_logpath(self._path, param.filename, date) == path
+            ]
+            try:
+                tail.update()
+            except OSError:  # e.g. moved away by archiving
+                continue
+            self._collect(tail.new, params)
+        if paths is not None:
+            logspec = {path: logspec[path] for path in paths if path in logspec}
+        data = {param: {} for params in logspec.values() for param in params}
+        for path, params in logspec.items():
+            if not path.exists():  # empty data dict if path does not exist
+                self._tails.pop(path, None)
+                continue
+            tail = self._tail(path, params)
+            lines = tail.lines
+            plan = self._plan(params)
+            self._collect(tail.new, params)  # keep every new value, not just the latest
+            # read 'nvals' or latest token(s) for each param in one pass over the lines
+            nvals = {param: 1 if last else param.nvals for param in params}
+            depth = max(nvals.values())
+            age = 0  # number of lines read so far, latest first
+            for line in reversed(lines):
+                if age == depth:
+                    break
+                token = line.split(",")
+                keys = {param for param in params if nvals[param] > age}
+                try:
+                    timestamp = f"{token[0]} {token[1]}"
+                    extracted = plan.extract(token, keys)
+                except IndexError:  # ignore bad log, it doesn't count towards nvals
+                    continue
+                age += 1
+                for param, value in extracted.items():
+                    data[param][timestamp] = value
+        if self._checkpoint:
+            self._offsets = {
+                str(path): tail.state for path, tail in self._tails.items()
+            }
+            self._checkpoint.save_offsets(self._fridge, self._offsets)
         return data
 
-    def read(self) -> dict[Param, dict[str, str]]:
+    def read(self, paths=None) -> dict[Param, dict[str, str]]:
         """
         Read logfiles for all Params and return a data dictionary containing 'param.nvals' latest timestamps and values for each Param
-        Method is purposely written in a naive inefficient way to avoid reading inconsistently logged data
+        paths (set[Path]) if given, only read these logfiles and return data for the Params logged in them, as reported by a Watcher
+        Logfiles are followed incrementally, only bytes appended since the last read are consumed, and lines are only read once they are complete to avoid reading inconsistently logged data
         return Data dictionary with key = Param, value = dict with key = timestamp string and value = Param value string. number of entries in dictionary = param.nval and insertion order is reverse chronological. Data dictionary value is empty if path to Param's logfile does not exist.
+        All values in lines consumed by this read, not just the latest 'param.nvals', are then available as 'new' with the same structure in chronological order e.g. to store them.
         assume:
             the 1st & 2nd entries of each line in log file consist of the time stamp
             the terminating character for each line is "/n" and delimiter is ","
         """
-        new_data = self._read()
-        for param, datadict in self._data.items():
+        new_data = self._read(paths=paths)
+        self.new, self._new = dict(self._new), defaultdict(dict)
+        for param in new_data:
+            datadict = self._data[param]
             num_entries = len(datadict)
             datadict |= new_data[param]  # update data dict with new data
             diff_entries = len(datadict) - num_entries
             if num_entries:  # don't remove elements if datadict is initially empty
                 for _ in range(diff_entries):  # remove earliest elements
                     del datadict[next(iter(datadict))]
-        data = {param: datadict.copy() for param, datadict in self._data.items()}
+        data = {param: self._data[param].copy() for param in new_data}
         return data  # don't return self._data, return copy instead
@@ -0,0 +1,539 @@
+""" Module to load test HAL end to end, with synthetic or replayed logfiles and local stand-ins for the Notion and Slack APIs """
+
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+from pathlib import Path
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from hal.checkpoint import Checkpoint
+from hal.dispatcher import Dispatcher
+from hal.fridge import Fridge
+from hal.limiter import RateLimiter
+from hal.logger import logger
+from hal.main import FAILURES, cycle
+from hal.param import NumParam, Param
+from hal.reader import Reader, get_logpath
+from hal.siren import Siren
+from hal.store import Store
+from hal.watcher import Watcher
+
+try:  # to measure memory use, not available on Windows
+    import resource
+except ImportError:
+    resource = None
+
+
+# a Stub hangs for this many seconds before answering calls it fails with "timeout"
+HANG = 60.0
+
+
+class Stub(ThreadingHTTPServer):
+    """local HTTP server standing in for an external API, with injected latency and errors"""
+
+    request_queue_size = 128  # so that many fridges posting at once are not refused
+
+    def __init__(
+        self,
+        handler: type,
+        latency: float = 0.0,
+        errors: float = 0.0,
+        failure: str = "ratelimit",
+    ):
+        """
+        handler (type) BaseHTTPRequestHandler subclass answering calls
+        latency (float) in seconds, time to wait before answering each call
+        errors (float) fraction of calls that fail
+        failure (str) one of FAILURES, how calls fail: "ratelimit" answers with 429 Too Many Requests, "server" with 503 Service Unavailable, "connection" drops the connection without answering, and "timeout" answers only after HANG seconds, default = "ratelimit"
+        """
+        if failure not in FAILURES:
+            raise ValueError(f"Invalid {failure = }, must be one of {FAILURES}.")
+        super().__init__(("127.0.0.1", 0), handler)
+        self.latency = latency
+        self.errors = errors
+        self.failure = failure
+        self.calls: Counter = (
+            Counter()
+        )  # key = (call, status or failure), value = count
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        """ """
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """base handler of Stub servers, subclasses implement answer()"""
+
+    def _handle(self) -> None:
+        """ """
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        failure = self.server.failure if random.random() < self.server.errors else None
+        segments = self.path.split("?")[0].strip("/").split("/")
+        call = f"{self.command} {segments[1] if len(segments) > 1 else ''}"
+        with self.server.lock:  # failed calls are counted by how they failed
+            self.server.calls[(call, 200 if failure is None else failure)] += 1
+        time.sleep(self.server.latency)
+        if failure == "ratelimit":
+            status, payload = 429, {"ok": False, "error": "ratelimited"}
+        elif failure == "server":
+            status, payload = 503, {"ok": False, "error": "service_unavailable"}
+        elif failure == "connection":  # the caller gets a connection error
+            self.close_connection = True
+            return
+        else:
+            if failure == "timeout":  # the caller gives up before the answer
+                time.sleep(HANG)
+            status, payload = 200, self.answer(body)
+        data = json.dumps(payload).encode()
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            if status == 429:
+                self.send_header("Retry-After", "1")
+            self.end_headers()
+            self.wfile.write(data)
+        except OSError:  # the caller hung up e.g. after timing out
+            self.close_connection = True
+
+    do_GET = do_POST = do_PATCH = _handle
+
+    def answer(self, body: bytes) -> dict:
+        """return JSON payload to answer a successful call with request body (bytes)"""
+        raise NotImplementedError("Subclass(es) to implement answer()")
+
+    def log_message(self, format: str, *args) -> None:
+        """ """
+
+
+class NotionHandler(StubHandler):
+    """answers the subset of Notion's API used by Client, keeps pages in memory, and records when each value is posted. Each fridge has a database of its own, with the fridge's name as id"""
+
+    BOT_ID: str = "hal"  # user id of the integration the Client calls as
+
+    def answer(self, body: bytes) -> dict:
+        """ """
+        server, path = self.server, self.path.split("?")[0]
+        payload = json.loads(body or b"{}")
+        if path.endswith("/users/me"):
+            return {"object": "user", "id": self.BOT_ID, "type": "bot"}
+        if path.endswith("/search"):
+            return {"results": [{"id": payload.get("query", "database")}]}
+        if path.endswith("/query"):  # paginated like Notion, cursor = page index
+            database = path.split("/")[-2]
+            start = int(payload.get("start_cursor", 0))
+            stop = start + payload.get("page_size", 100)
+            with server.lock:
+                page_ids = [
+                    page_id
+                    for page_id, page in server.pages.items()
+                    if page["database"] == database
+                ]
+            results = [self._get_page(page_id) for page_id in page_ids[start:stop]]
+            has_more = stop < len(page_ids)
+            return {"results": results, "has_more": has_more, "next_cursor": str(stop)}
+
+        properties = payload.get("properties", {})
+        if path.endswith("/pages"):  # create page
+            database = payload["parent"]["database_id"]
+            with server.lock:
+                page_id = f"page-{len(server.pages)}"
+                server.pages[page_id] = {"database": database, "creator": self.BOT_ID}
+        else:
+            page_id = path.rsplit("/", 1)[-1]
+        if "Value" in properties:
+            value = properties["Value"]["rich_text"][0]["text"]["content"]
+            with server.lock:
+                page = server.pages[page_id]
+                server.posts.append(
+                    (time.time(), page["database"], page["name"], value)
+                )
+        elif "Parameter" in properties:
+            name = properties["Parameter"]["title"][0]["text"]["content"]
+            category = properties["Category"]["multi_select"][0]["name"]
+            with server.lock:
+                server.pages[page_id] |= {"name": name, "category": category}
+        return {"object": "page", "id": page_id}
+
+    def _get_page(self, page_id: str) -> dict:
+        """return page with page_id (str) as returned by Notion's API"""
+        with self.server.lock:
+            page = self.server.pages[page_id]
+        title = [{"plain_text": page["name"]}] if "name" in page else []
+        categories = [{"name": page["category"]}] if "category" in page else []
+        properties = {
+            "Parameter": {"title": title},
+            "Category": {"multi_select": categories},
+        }
+        created_by = {"object": "user", "id": page.get("creator", "someone")}
+        return {"id": page_id, "created_by": created_by, "properties": properties}
+
+
+class SlackHandler(StubHandler):
+    """answers chat.postMessage calls made by Siren"""
+
+    def answer(self, body: bytes) -> dict:
+        """ """
+        return {"ok": True}
+
+
+class Writer:
+    """appends lines to one logfile from a background thread and records when each synthetic sequence number was written"""
+
+    def __init__(self, path: Path, lines, stop: threading.Event) -> None:
+        """
+        path (Path) logfile to append to, created with its folder if it does not exist
+        lines (Iterable) yields tuples of (delay in seconds before writing, line without timestamp, sequence number or None)
+        stop (threading.Event) stop writing once set
+        """
+        self.path = path
+        self.written: dict[int, float] = {}  # key = sequence number, value = time
+        self.count = 0
+        self._lines = lines
+        self._stop = stop
+        self._thread = threading.Thread(target=self._write, daemon=True)
+
+    def start(self) -> None:
+        """ """
+        self._thread.start()
+
+    def join(self) -> None:
+        """ """
+        self._thread.join()
+
+    def _write(self) -> None:
+        """ """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a", encoding="utf-8") as file:
+            for delay, line, sequence in self._lines:
+                if self._stop.wait(delay):
+                    return
+                now = datetime.now()
+                file.write(f"{now:%d-%m-%y,%H:%M:%S},{line}\n")
+                file.flush()
+                if sequence is not None:
+                    self.written[sequence] = time.time()
+                self.count += 1
+
+
+def get_synthetic_fridge(
+    logfolder: Path,
+    nparams: int,
+    nfiles: int,
+    nalarms: int = 0,
+    name: str = "synthetic",
+) -> Fridge:
+    """
+    Make a fridge with Params spread over logfiles laid out like Bluefors logs. Even logfiles have keyword positioned values like the maxigauge and status logs, odd logfiles have index positioned values like the channel logs. Values are logged as sequence numbers so the time from write to post can be measured.
+    logfolder (Path) folder the logfiles are written to
+    nparams (int) number of NumParams
+    nfiles (int) number of logfiles
+    nalarms (int) number of NumParams that are always out of bounds, to exercise alerts
+    name (str) name of the fridge
+    """
+    params = []
+    for index in range(nparams):
+        file = index % nfiles
+        pos = f"key{index}" if file % 2 == 0 else 2 + index // nfiles
+        params.append(
+            NumParam(
+                units="K",
+                ndp=0,
+                bounds=(-1, 0) if index < nalarms else None,
+                name=f"param{index}",
+                filename=f"synthetic{file} ",
+                pos=pos,
+                category="synthetic",
+            )
+        )
+    return Fridge(name, logfolder, params)
+
+
+def synthesize(params: list[Param], rate: float, prefill: int = 0):
+    """
+    Yield lines of a logfile with the synthetic Params (list[Param]) logged in it
+    rate (float) number of lines per second
+    prefill (int) number of bytes of history to yield without delay first
+    """
+    keywords = [p.pos for p in params if isinstance(p.pos, str)]
+    ncolumns = sum(isinstance(p.pos, int) for p in params)
+    size, sequence = 0, 0
+    while True:
+        value = str(sequence)
+        if keywords:
+            line = ",".join(f"{keyword},{value}" for keyword in keywords)
+        else:
+            line = ",".join([value] * ncolumns)
+        is_history = size < prefill
+        size += len(line) + 19  # timestamp and line terminator
+        yield (0 if is_history else 1 / rate), line, None if is_history else sequence
+        sequence += 1
+
+
+def replay(path: Path, speed: float):
+    """
+    Yield lines of a recorded logfile at path (Path) paced by their timestamps, speed (float) times faster than they were logged
+    """
+    previous = None
+    with path.open(encoding="utf-8", errors="ignore") as file:
+        for line in file:
+            token = line.rstrip("\n").split(",", 2)
+            try:
+                logged = datetime.strptime(
+                    f"{token[0]} {token[1]}", "%d-%m-%y %H:%M:%S"
+                )
+            except (ValueError, IndexError):  # ignore bad log
+                continue
+            delay = (logged - previous).total_seconds() / speed if previous else 0
+            previous = logged
+            yield max(delay, 0), token[2] if len(token) > 2 else "", None
+
+
+def get_rss() -> float:
+    """return resident set size of this process in MB, peak RSS if the current one is not available, nan if neither is"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:  # ru_maxrss is in kB on Linux, bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+    return float("nan")
+
+
+def get_import_time(module: str = "hal.main", repeat: int = 3) -> float:
+    """return the fastest of repeat (int) times in seconds taken to import module (str) in a fresh interpreter, to track HAL's startup time, nan if it fails to import"""
+    code = (
+        "import time; tic = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - tic)"
+    )
+    times = []
+    for _ in range(repeat):
+        try:
+            result = subprocess.run(
+                [sys.executable, "-c", code], capture_output=True, text=True, check=True
+            )
+        except subprocess.CalledProcessError as err:
+            logger.error(f"Failed to import {module}: {err.stderr}")
+            return float("nan")
+        times.append(float(result.stdout.split()[-1]))
+    return min(times)
+
+
+def get_quantiles(values: list[float]) -> dict[str, float]:
+    """return dict of median, 95th percentile and maximum of values (list[float]), nan if there are none"""
+    if len(values) < 2:
+        value = values[0] if values else float("nan")
+        return {"p50": value, "p95": value, "max": value}
+    cuts = statistics.quantiles(values, n=20, method="inclusive")
+    return {"p50": cuts[9], "p95": cuts[18], "max": max(values)}
+
+
+def loadtest(
+    duration: float = 60.0,
+    nparams: int = 100,
+    nfiles: int = 10,
+    rate: float = 1.0,
+    prefill: float = 0.0,
+    nalarms: int = 0,
+    source: Path = None,
+    date: str = None,
+    speed: float = 1.0,
+    fridge: Fridge = None,
+    nfridges: int = 1,
+    interval: float = 1.0,
+    notion_rate: float = 3.0,
+    notion_latency: float = 0.0,
+    notion_errors: float = 0.0,
+    notion_failure: str = "ratelimit",
+    slack_latency: float = 0.0,
+    slack_errors: float = 0.0,
+    slack_failure: str = "ratelimit",
+) -> dict:
+    """
+    Run HAL's main loop end to end against logfiles written into a temporary folder while they are being read, with Notion and Slack stood in for by local stubs
+    duration (float) in seconds, how long to run for
+    nparams (int) number of synthetic Params
+    nfiles (int) number of synthetic logfiles
+    rate (float) number of lines written per second to each synthetic logfile
+    prefill (float) in MB, size of the history written to each synthetic logfile before starting
+    nalarms (int) number of synthetic Params that are always out of bounds
+    source (Path) if given, replay logfiles recorded in this folder instead of synthesizing them
+    date (str) date in yy-mm-dd format of the recorded logfiles to replay
+    speed (float) how many times faster than recorded to replay logfiles
+    fridge (Fridge) fridge whose Params are replayed, required to replay logfiles
+    nfridges (int) number of fridges monitored at once, each with its own copy of the synthetic or replayed logfiles
+    interval (float) in seconds, maximum time to wait for logfiles to change in each cycle
+    notion_rate (float) number of Notion API calls allowed per second, default = 3.0 as enforced by Notion
+    notion_latency, slack_latency (float) in seconds, time the stubs take to answer each call
+    notion_errors, slack_errors (float) fraction of calls the stubs fail
+    notion_failure, slack_failure (str) one of FAILURES, how the stubs fail calls
+    return dict of results, also logged as a report
+    """
+    # measured first, so that it fails fast and doesn't compete with the load test
+    import_time = get_import_time()
+    notion = Stub(NotionHandler, notion_latency, notion_errors, notion_failure)
+    notion.pages, notion.posts = {}, []  # pages are created by the Client
+    slack = Stub(SlackHandler, slack_latency, slack_errors, slack_failure)
+    stop = threading.Event()
+    folder = tempfile.TemporaryDirectory(prefix="hal-loadtest-")
+    logfolder = Path(folder.name) / "logs"
+    today = datetime.now().strftime("%y-%m-%d")
+
+    # set up logfile writers, key = (fridge name, logfile prefix)
+    rss = [get_rss()]
+    names = ["synthetic"] if source is None else [fridge.name]
+    if nfridges > 1:
+        names = [f"{names[0]}{index}" for index in range(nfridges)]
+    fridges, writers = [], {}
+    for name in names:
+        if source is not None:
+            fridge = Fridge(name, logfolder / name, fridge.params)
+            filenames = {param.filename for param in fridge.params}
+            recordings = {f: get_logpath(Path(source), f, date) for f in filenames}
+            lines = {f: replay(path, speed) for f, path in recordings.items()}
+            lines = {f: line for f, line in lines.items() if recordings[f].exists()}
+        else:
+            fridge = get_synthetic_fridge(
+                logfolder / name, nparams, nfiles, nalarms, name=name
+            )
+            logged = defaultdict(list)
+            for param in fridge.params:
+                logged[param.filename].append(param)
+            lines = {
+                filename: synthesize(params, rate, int(prefill * 1e6))
+                for filename, params in logged.items()
+            }
+        fridges.append(fridge)
+        for filename, generator in lines.items():
+            path = get_logpath(fridge.logfolder, filename, today)
+            writers[(name, filename)] = Writer(path, generator, stop)
+    for writer in writers.values():
+        writer.start()
+    while prefill and any(
+        not w.path.exists() or w.path.stat().st_size < prefill * 1e6
+        for w in writers.values()
+    ):
+        time.sleep(0.1)  # wait for history to be written before HAL starts
+    nparams = sum(len(fridge.params) for fridge in fridges)
+    logger.info(
+        f"Load testing {nparams} Params in {len(writers)} logfiles "
+        f"of {len(fridges)} fridge(s)."
+    )
+
+    # set up HAL against the stubs
+    tokenpath = Path(folder.name) / "slack"
+    tokenpath.write_text("token,channel")
+    checkpoint = Checkpoint(Path(folder.name) / "checkpoint.db")
+    readers = [Reader(fridge, checkpoint=checkpoint) for fridge in fridges]
+    limiter = RateLimiter(rate=notion_rate, burst=max(3, int(notion_rate)))
+    session = requests.Session()  # no token needed by the stub
+    dispatchers = [
+        Dispatcher(
+            fridge,
+            checkpoint=checkpoint,
+            session=session,
+            limiter=limiter,
+            base_url=notion.url + "/v1",
+        )
+        for fridge in fridges
+    ]
+    stores = [
+        Store(fridge.name, path=Path(folder.name) / "store") for fridge in fridges
+    ]
+    siren = Siren(remind_time=0, tokenpath=tokenpath, base_url=slack.url + "/api/")
+    watcher = Watcher()
+    executor = ThreadPoolExecutor(max_workers=len(fridges))
+
+    # run HAL's main loop, as in hal.main.run()
+    cycles = []
+    deadline, paths = time.monotonic() + duration, None
+    try:
+        while time.monotonic() < deadline:
+            tic, cpu = time.perf_counter(), time.process_time()
+            cycle(readers, stores, dispatchers, siren, executor, paths)
+            cycles.append((time.perf_counter() - tic, time.process_time() - cpu))
+            rss.append(get_rss())
+            logpaths = {path for reader in readers for path in reader.logspec}
+            paths = watcher.wait_cycle(logpaths, interval=interval)
+    finally:
+        stop.set()
+        for writer in writers.values():
+            writer.join()
+        executor.shutdown()
+        siren.close()
+        checkpoint.close()
+        notion.shutdown()
+        slack.shutdown()
+        folder.cleanup()
+
+    # end to end latency from synthetic values being written to being posted
+    filenames = {
+        (fridge.name, param.name): param.filename
+        for fridge in fridges
+        for param in fridge.params
+    }
+    latencies = []
+    for posted_at, database, name, value in notion.posts:
+        writer = writers.get((database, filenames.get((database, name))))
+        try:
+            written_at = writer.written[int(value.split()[0])]
+        except (AttributeError, ValueError, KeyError):  # e.g. replayed or history
+            continue
+        latencies.append(posted_at - written_at)
+    results = {
+        "fridges": len(fridges),
+        "params": nparams,
+        "logfiles": len(writers),
+        "lines": sum(writer.count for writer in writers.values()),
+        "import seconds": import_time,
+        "first cycle seconds": cycles[0][0] if cycles else float("nan"),
+        "cycles": len(cycles),
+        "cycle seconds": get_quantiles([wall for wall, _ in cycles]),
+        "cycle cpu seconds": get_quantiles([cpu for _, cpu in cycles]),
+        "rss MB": {"start": rss[0], "end": rss[-1], "max": max(rss)},
+        "latency seconds": get_quantiles(latencies),
+        "posts": len(notion.posts),
+        "notion calls": {
+            f"{call} {status}": n for (call, status), n in notion.calls.items()
+        },
+        "slack calls": {
+            f"{call} {status}": n for (call, status), n in slack.calls.items()
+        },
+    }
+    logger.info(f"Load test results:\n{json.dumps(results, indent=2)}")
+    return results
+
+
+def scale(nfridges: int, **kwargs) -> list[dict]:
+    """
+    Run load tests with 1 up to nfridges (int) fridges, to report how HAL's cycle time and memory use grow with the number of fridges it monitors. kwargs are passed on to loadtest()
+    return list of results of each load test, also logged as a table
+    """
+    steps = (2, 5, 10, 20, 50, 100)
+    counts = sorted({1, nfridges} | {n for n in steps if n < nfridges})
+    runs = [loadtest(nfridges=count, **kwargs) for count in counts]
+    header = "fridges  params  cycle p50 s  cycle p95 s  cycle cpu p50 s  rss max MB"
+    rows = [
+        f"{r['fridges']:>7}  {r['params']:>6}  {r['cycle seconds']['p50']:>11.4f}  "
+        f"{r['cycle seconds']['p95']:>11.4f}  {r['cycle cpu seconds']['p50']:>15.4f}  "
+        f"{r['rss MB']['max']:>10.1f}"
+        for r in runs
+    ]
+    logger.info("Load test scaling:\n" + "\n".join([header, *rows]))
+    return runs
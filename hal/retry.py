@@ -0,0 +1,39 @@
+""" Module to schedule retries of failed API calls with exponential backoff """
+
+import random
+import time
+
+
+class Backoff:
+    """exponential backoff with jitter that tells callers when the next attempt is due, without ever sleeping"""
+
+    def __init__(
+        self, base: float = 1.0, cap: float = 300.0, factor: float = 2.0
+    ) -> None:
+        """
+        base (float) in seconds, delay before the first retry
+        cap (float) in seconds, maximum delay between retries
+        factor (float) multiplier applied to the delay after every consecutive failure
+        """
+        self._base = base
+        self._cap = cap
+        self._factor = factor
+        self.failures: int = 0  # number of consecutive failures
+        self._due: float = 0.0  # monotonic time at which the next attempt is due
+
+    @property
+    def ready(self) -> bool:
+        """return bool indicating whether the next attempt is due"""
+        return time.monotonic() >= self._due
+
+    def failure(self) -> float:
+        """record a failed attempt and return the delay (in seconds) before the next one"""
+        delay = min(self._cap, self._base * self._factor**self.failures)
+        delay = random.uniform(0, delay)  # full jitter, spreads out retries
+        self.failures += 1
+        self._due = time.monotonic() + delay
+        return delay
+
+    def success(self) -> None:
+        """record a successful attempt, the next attempt is due immediately"""
+        self.failures, self._due = 0, 0.0
@@ -0,0 +1,239 @@
+""" Module to raise alarms from rolling statistics of Param values, with hysteresis so that values hovering at a threshold do not flap """
+
+from collections import deque
+from collections.abc import Sequence
+import math
+
+from hal.param import Param
+from hal.store import parse_timestamp
+
+# statistics a Rule can check, see Window
+STATISTICS = ("value", "ewma", "min", "max", "mean", "slope")
+
+
+class Window:
+    """
+    Rolling statistics of the values of one Param, each updated in amortized O(1) time per sample. min, max, mean and slope are computed over the values logged in the last span seconds, ewma is time weighted with time constant tau seconds.
+    """
+
+    def __init__(self, span: float, tau: float) -> None:
+        """
+        span (float) in seconds, length of the window min, max, mean and slope are computed over
+        tau (float) in seconds, time constant of the exponentially weighted moving average
+        """
+        self._span = span
+        self._tau = tau
+        self._samples: deque[tuple[float, float]] = deque()  # (time, value)
+        # samples that may yet become the min (max), values ascending (descending)
+        self._mins: deque[tuple[float, float]] = deque()
+        self._maxs: deque[tuple[float, float]] = deque()
+        # running sums for the least squares slope, of times relative to origin
+        self._origin = 0.0
+        self._sx, self._sy, self._sxx, self._sxy = 0.0, 0.0, 0.0, 0.0
+        self.time: float = math.nan  # time of the latest sample
+        self.value: float = math.nan  # latest value
+        self.ewma: float = math.nan
+
+    def add(self, time: float, value: float) -> None:
+        """add sample with POSIX time (float) and value (float), samples must be added in chronological order"""
+        if math.isnan(self.ewma):
+            self.ewma = value
+        else:
+            alpha = 1 - math.exp(-(time - self.time) / self._tau)
+            self.ewma += alpha * (value - self.ewma)
+        self.time, self.value = time, value
+
+        if not self._samples:
+            self._origin = time
+        self._samples.append((time, value))
+        x = time - self._origin
+        self._sx, self._sy = self._sx + x, self._sy + value
+        self._sxx, self._sxy = self._sxx + x * x, self._sxy + x * value
+        while self._mins and self._mins[-1][1] >= value:
+            self._mins.pop()
+        self._mins.append((time, value))
+        while self._maxs and self._maxs[-1][1] <= value:
+            self._maxs.pop()
+        self._maxs.append((time, value))
+
+        # expire samples that have left the window
+        cutoff = time - self._span
+        while self._samples[0][0] <= cutoff:
+            old_time, old_value = self._samples.popleft()
+            x = old_time - self._origin
+            self._sx, self._sy = self._sx - x, self._sy - old_value
+            self._sxx, self._sxy = self._sxx - x * x, self._sxy - x * old_value
+        while self._mins[0][0] <= cutoff:
+            self._mins.popleft()
+        while self._maxs[0][0] <= cutoff:
+            self._maxs.popleft()
+        if time - self._origin > 2 * self._span:  # amortized O(1), bounds rounding
+            self._rebase()
+
+    def _rebase(self) -> None:
+        """recompute running sums relative to the oldest sample in the window, so they neither grow without bound nor accumulate rounding errors"""
+        self._origin = self._samples[0][0]
+        self._sx, self._sy, self._sxx, self._sxy = 0.0, 0.0, 0.0, 0.0
+        for time, value in self._samples:
+            x = time - self._origin
+            self._sx, self._sy = self._sx + x, self._sy + value
+            self._sxx, self._sxy = self._sxx + x * x, self._sxy + x * value
+
+    @property
+    def min(self) -> float:
+        """ """
+        return self._mins[0][1] if self._mins else math.nan
+
+    @property
+    def max(self) -> float:
+        """ """
+        return self._maxs[0][1] if self._maxs else math.nan
+
+    @property
+    def mean(self) -> float:
+        """ """
+        return self._sy / len(self._samples) if self._samples else math.nan
+
+    @property
+    def slope(self) -> float:
+        """return least squares rate of change of the values in the window, in units per second, nan if there are fewer than two samples"""
+        n = len(self._samples)
+        denominator = n * self._sxx - self._sx * self._sx
+        if n < 2 or denominator <= 0:
+            return math.nan
+        return (n * self._sxy - self._sx * self._sy) / denominator
+
+
+class Rule:
+    """
+    Alarms when a statistic of a Param's values leaves the open interval (below, above), and clears only once it is back inside the interval by more than the hysteresis. Thresholds are in the units the Param is logged in (per second for slope).
+    """
+
+    def __init__(
+        self,
+        statistic: str,
+        below: float = None,
+        above: float = None,
+        hysteresis: float = 0.0,
+        window: float = 600.0,
+        tau: float = 60.0,
+        name: str = None,
+    ) -> None:
+        """
+        statistic (str) one of STATISTICS i.e. "value", "ewma", "min", "max", "mean" or "slope" (rate of change)
+        below (float) alarm when the statistic is less than or equal to this, optional
+        above (float) alarm when the statistic is greater than or equal to this, optional
+        hysteresis (float) margin by which the statistic must be back inside (below, above) for the alarm to clear, default = 0.0
+        window (float) in seconds > 0, length of the window min, max, mean and slope are computed over, default = 600.0
+        tau (float) in seconds > 0, time constant of the ewma, default = 60.0
+        name (str) name of the rule shown in alerts, default = statistic
+        """
+        if statistic not in STATISTICS:
+            raise ValueError(f"Invalid {statistic = }, must be one of {STATISTICS}.")
+        if below is None and above is None:
+            raise ValueError("Rule must have at least one of 'below' or 'above'.")
+        if not window > 0 or not tau > 0:  # also rejects nan
+            raise ValueError(f"Rule must have {window = } and {tau = } > 0.")
+        self.statistic = statistic
+        self.below = below
+        self.above = above
+        self.hysteresis = hysteresis
+        self.window = window
+        self.tau = tau
+        self.name = name if name is not None else statistic
+
+    def __repr__(self) -> str:
+        """ """
+        return f"Rule({self.name}: {self.statistic} in ({self.below}, {self.above}))"
+
+    def check(self, value: float, active: bool) -> bool:
+        """
+        value (float) current value of the statistic
+        active (bool) whether the rule is currently alarming
+        return bool indicating whether the rule is alarming after seeing value
+        """
+        if math.isnan(value):  # e.g. slope of a single sample, keep state
+            return active
+        margin = self.hysteresis if active else 0.0
+        is_low = self.below is not None and value <= self.below + margin
+        is_high = self.above is not None and value >= self.above - margin
+        return is_low or is_high
+
+    def describe(self, value: float) -> str:
+        """return description of the alarm raised with statistic value (float) for alerts"""
+        label = (
+            self.name
+            if self.name == self.statistic
+            else f"{self.name} {self.statistic}"
+        )
+        return f"{label} = {value:.4g} outside ({self.below}, {self.above})"
+
+
+class Engine:
+    """
+    Evaluates the rules of Params over the stream of values read from logfiles. Each NumParam with bounds gets a "bounds" rule on its latest value with the NumParam's hysteresis, followed by its own rules. Rules of a Param with the same window and tau share one Window, so each sample costs one Window update per distinct (window, tau) and one comparison per rule.
+    """
+
+    def __init__(self, params: Sequence[Param]) -> None:
+        """params (Sequence[Param]) Params whose rules are evaluated, Params without rules are ignored"""
+        self._rules: dict[Param, list[Rule]] = {}
+        self._windows: dict[Param, dict[tuple[float, float], Window]] = {}
+        self._active: dict[Param, list[bool]] = {}
+        self._last: dict[Param, float] = {}  # key = Param, value = latest sample time
+        self._latest: dict[Param, str] = {}  # key = Param, value = latest timestamp
+        self._reasons: dict[Param, list[str]] = {}  # key = Param, value = last result
+        for param in params:
+            rules = list(getattr(param, "rules", ()))
+            bounds = getattr(param, "bounds", None)
+            if bounds:
+                hysteresis = getattr(param, "hysteresis", 0.0)
+                rules.insert(0, Rule("value", *bounds, hysteresis, name="bounds"))
+            if not rules:
+                continue
+            self._rules[param] = rules
+            self._windows[param] = {
+                (rule.window, rule.tau): Window(rule.window, rule.tau) for rule in rules
+            }
+            self._active[param] = [False] * len(rules)
+            self._last[param] = -math.inf
+            self._reasons[param] = []
+
+    def __contains__(self, param: Param) -> bool:
+        """return bool indicating whether param (Param) has any rules"""
+        return param in self._rules
+
+    def update(self, param: Param, values: dict[str, str]) -> list[str] | None:
+        """
+        Add samples of a Param newer than those already added and evaluate its rules. Rules are only evaluated again if there are new samples, as their result can't change otherwise.
+        param (Param) Param the samples belong to
+        values (dict) key = timestamp string, value = raw value string, e.g. all values read in a cycle as in Reader.new, with the latest one last
+        return list of descriptions of the Param's alarming rules, None if the Param has no rules
+        """
+        if param not in self._rules:
+            return None
+        if not values or next(reversed(values)) == self._latest.get(param):
+            return self._reasons[param]  # nothing new since the last update
+        self._latest[param] = next(reversed(values))
+        samples = []
+        for timestamp, value in values.items():
+            try:
+                samples.append((parse_timestamp(timestamp), float(value)))
+            except ValueError:  # ignore bad logs
+                continue
+        samples.sort()
+        windows = self._windows[param].values()
+        for time, value in samples:
+            if time > self._last[param]:
+                for window in windows:
+                    window.add(time, value)
+                self._last[param] = time
+
+        reasons, active = [], self._active[param]
+        for index, rule in enumerate(self._rules[param]):
+            window = self._windows[param][(rule.window, rule.tau)]
+            value = getattr(window, rule.statistic)
+            active[index] = rule.check(value, active[index])
+            if active[index]:
+                reasons.append(rule.describe(value))
+        self._reasons[param] = reasons
+        return reasons
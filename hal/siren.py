@@ -1,41 +1,167 @@
 """ Module that sends alerts to HAL's slack channel for alarming Param values """
 
+from pathlib import Path
+import queue
+import threading
 import time
 
-import slack_sdk as slack
-
-from hal.config import FRIDGE_NAME, SLACK_TOKENPATH
+from hal.config import SLACK_TOKENPATH
 from hal.logger import logger
+from hal.metrics import ALERTS
 from hal.param import Param
 
 
 class Siren:
-    """ """
+    """
+    Collects alerts raised during a cycle and sends them as one message per fridge from a background worker, so that slow or failing Slack API calls never hold up the main loop. Alerts may be raised from many threads, one per fridge.
+    """
 
-    def __init__(self, remind_time: int = 600, retry_time: int = 30) -> None:
+    def __init__(
+        self,
+        remind_time: int = 600,
+        retry_time: int = 30,
+        escalate_time: int = 1800,
+        maxsize: int = 100,
+        tokenpath: Path = SLACK_TOKENPATH,
+        base_url: str = None,
+    ) -> None:
         """
         remind_time (int) in seconds, time to wait before sending alert again
         retry_time (int) in seconds, time to wait for before re-trying API call
+        escalate_time (int) in seconds, time a Param must stay out of bounds for its alert to be escalated to the whole channel
+        maxsize (int) maximum number of messages waiting to be sent, newer messages are dropped when full
+        tokenpath (Path) path to the file containing the Slack API token and channel id separated by a comma
+        base_url (str) URL of Slack's Web API, e.g. to point the Siren at a local stub, default = Slack's
         """
+        from slack_sdk import WebClient  # imported here as it is slow to import
+
         self._remind_time = remind_time
         self._retry_time = retry_time
-        with SLACK_TOKENPATH.open() as tokenfile:
+        self._escalate_time = escalate_time
+        with tokenpath.open() as tokenfile:
             token, self._channel_id = tokenfile.read().split(",")
-        self._client = slack.WebClient(token=token)
-        self._log: dict[Param, float] = {}  # to record previous alert timestamp
+        base_url = base_url if base_url is not None else WebClient.BASE_URL
+        self._client = WebClient(token=token, base_url=base_url)
+        # all keyed by (fridge name, Param) as fridges may share Param objects
+        self._log: dict[tuple, float] = {}  # to record previous alert timestamp
+        self._since: dict[tuple, float] = {}  # to record when Param went out of bounds
+        self._escalated: set[tuple] = set()  # Params whose alert has been escalated
+        self._queued: set[tuple] = set()  # Params with an alert waiting to be sent
+        self._pending: dict[tuple, tuple[str, str]] = {}  # alerts in current cycle
+        self._lock = threading.Lock()  # guards the above
+        self._queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self._worker = threading.Thread(target=self._work, daemon=True)
+        self._worker.start()
         logger.info(f"Siren ready to send alerts to Slack channel {self._channel_id}.")
 
-    def warn(self, param: Param, value: str) -> None:
-        """ """
-        timestamp = self._log[param] if param in self._log else 0
-        text = f"{FRIDGE_NAME} {param.name} {value = } out of bounds {param.bounds}"
-        channel = self._channel_id
-        # post only if more than self.remind_time has passed since last message
-        if int(time.time() - timestamp) > self._remind_time:
-            result = self._client.chat_postMessage(channel=channel, text=text)
-            if result.get("ok"):  # ensure no error response received
-                self._log[param] = time.time()  # save for later check
-                logger.info(f"Posted '{text = }' to slack!")
-            else:
-                errorstring = result.get("error")
-                logger.debug(f"Didn't post '{text = }' due to {errorstring = }.")
+    def warn(self, param: Param, value: str, fridge: str, reason: str) -> None:
+        """
+        Raise an alert for param (Param) of fridge (str) with alarming value (str) for reason (str) e.g. the rules it broke, it is sent with all other alerts of the fridge raised in the cycle on flush()
+        """
+        key, now = (fridge, param), time.time()
+        with self._lock:
+            since = self._since.setdefault(key, now)
+            timestamp = self._log[key] if key in self._log else 0
+            # post only if more than self.remind_time has passed since last message
+            is_due = int(now - timestamp) > self._remind_time
+            is_escalating = (
+                now - since > self._escalate_time and key not in self._escalated
+            )
+            if (is_due or is_escalating) and key not in self._queued:
+                self._pending[key] = (value, reason)
+
+    def clear(self, param: Param, fridge: str) -> None:
+        """reset escalation window of param (Param) of fridge (str) once its value is back in bounds. when it was last alerted about is kept, so a value flapping in and out of bounds is still only alerted about every remind_time"""
+        key = (fridge, param)
+        with self._lock:
+            if self._since.pop(key, None) is not None:
+                self._escalated.discard(key)
+
+    def flush(self) -> None:
+        """group alerts raised since the last flush into one message per fridge and queue them to be sent, an alert counts as sent only once Slack accepted it, see _done()"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            now, messages = time.time(), {}  # key = fridge, value = (lines, escalate)
+            for (fridge, param), (value, reason) in pending.items():
+                lines, escalate = messages.get(fridge, ([], False))
+                lines.append(f"{param.name} {value = } {reason}")
+                key = (fridge, param)
+                if now - self._since[key] > self._escalate_time:
+                    escalate = escalate or key not in self._escalated
+                messages[fridge] = (lines, escalate)
+
+            for fridge, (lines, escalate) in messages.items():
+                prefix = "<!channel> " if escalate else ""
+                text = f"{prefix}{fridge} alert(s):\n" + "\n".join(lines)
+                keys = tuple(key for key in pending if key[0] == fridge)
+                try:
+                    self._queue.put_nowait((text, keys, escalate, now))
+                except queue.Full:  # alerts are raised again next cycle
+                    logger.warning(
+                        f"Dropped '{text = }' as too many alerts are queued."
+                    )
+                else:
+                    self._queued.update(keys)
+
+    def close(self, timeout: float = 10.0) -> None:
+        """stop the worker after it has sent queued messages, waiting at most timeout (float) seconds"""
+        self._queue.put(None)
+        self._worker.join(timeout)
+
+    def _work(self) -> None:
+        """send queued messages one by one till stopped"""
+        while (message := self._queue.get()) is not None:
+            text, keys, escalate, raised_at = message
+            while (posted := self._post(text, keys)) is None:
+                pass
+            self._done(keys, escalate, raised_at, posted)
+
+    def _done(
+        self,
+        keys: tuple[tuple[str, Param]],
+        escalate: bool,
+        raised_at: float,
+        posted: bool,
+    ) -> None:
+        """
+        record that keys (tuple of (fridge name, Param)) were alerted about at raised_at (float) if the message was posted (bool), so they are only alerted about again after remind_time, and whether the alert was escalated (bool). if it was dropped, they are alerted about again next time they are out of bounds
+        """
+        with self._lock:
+            self._queued.difference_update(keys)
+            if not posted:
+                return
+            for key in keys:
+                self._log[key] = raised_at
+                if escalate and key in self._since:
+                    self._escalated.add(key)
+
+    def _post(self, text: str, keys: tuple[tuple[str, Param]]) -> bool | None:
+        """
+        make one attempt at posting text (str) alerting about keys (tuple of (fridge name, Param)) to the Slack channel, sleeping before returning if it should be retried
+        return True if the message was posted, False if it was dropped, or None if it should be retried
+        """
+        from slack_sdk.errors import SlackApiError
+
+        try:
+            result = self._client.chat_postMessage(channel=self._channel_id, text=text)
+        except SlackApiError as err:
+            if err.response.status_code == 429:  # rate limited, honor Retry-After
+                delay = int(err.response.headers.get("Retry-After", self._retry_time))
+                logger.debug(f"Slack rate limited, retrying in {delay}s...")
+                time.sleep(delay)
+                return None
+            logger.debug(f"Didn't post '{text = }' due to {err.response['error'] = }.")
+            return False
+        except OSError as err:  # network error, includes urllib errors
+            logger.debug(f"Got {err = }, retrying in {self._retry_time}s...")
+            time.sleep(self._retry_time)
+            return None
+
+        if result.get("ok"):  # ensure no error response received
+            logger.info(f"Posted '{text = }' to slack!")
+            for fridge, param in keys:
+                ALERTS.inc(fridge, param.name)
+            return True
+        errorstring = result.get("error")
+        logger.debug(f"Didn't post '{text = }' due to {errorstring = }.")
+        return False
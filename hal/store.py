@@ -0,0 +1,293 @@
+""" Module to keep a local history of all parsed Param values for fast range queries """
+
+from datetime import date, datetime, timezone
+from functools import lru_cache
+import os
+from pathlib import Path
+import re
+
+import numpy as np
+
+from hal.logger import logger
+from hal.param import Param
+
+# set store folder path
+STOREPATH = Path.cwd() / "store"
+
+# record layouts of raw sample chunks and rollup chunks
+SAMPLE = np.dtype([("time", "<f8"), ("value", "<f8")])
+ROLLUP = np.dtype(
+    [("time", "<f8"), ("min", "<f8"), ("max", "<f8"), ("mean", "<f8"), ("count", "<i8")]
+)
+
+# rollup resolutions in seconds
+RESOLUTIONS = {"1m": 60, "1h": 3600, "1d": 86400}
+
+# format of timestamps as read by the Reader e.g. 12-01-23 13:45:07
+TIMESTAMP_FORMAT = "%d-%m-%y %H:%M:%S"
+
+
+def parse_timestamp(timestamp: str) -> float:
+    """return POSIX time of timestamp (str) as read by the Reader, raise ValueError if it is not in TIMESTAMP_FORMAT"""
+    if len(timestamp) != 17 or timestamp[11] != ":" or timestamp[14] != ":":
+        return datetime.strptime(timestamp, TIMESTAMP_FORMAT).timestamp()
+    # only parse each hour once, timestamps of a cycle mostly share the hour
+    minutes, seconds = timestamp[12:14], timestamp[15:17]
+    if not (minutes.isdigit() and seconds.isdigit()) or max(minutes, seconds) > "59":
+        return datetime.strptime(timestamp, TIMESTAMP_FORMAT).timestamp()
+    return _parse_hour(timestamp[:11]) + int(minutes) * 60 + int(seconds)
+
+
+@lru_cache(maxsize=256)
+def _parse_hour(hour: str) -> float:
+    """return POSIX time of the start of hour (str) in dd-mm-yy HH format"""
+    return datetime.strptime(hour, "%d-%m-%y %H").timestamp()
+
+
+class Store:
+    """
+    Append-only columnar store of (timestamp, value) samples with one chunk per day per Param, along with min/max/mean rollups at 1 minute, 1 hour and 1 day resolutions.
+    Chunks are saved as flat binary arrays at path / fridge / {yy-mm-dd} / {param name}.{raw|1m|1h|1d}
+    """
+
+    def __init__(self, fridge: str, path: Path = STOREPATH) -> None:
+        """
+        fridge (str) name of the fridge whose Params are stored
+        path (Path) path to the folder the store is saved in, created if it does not exist
+        """
+        self._path = path / fridge
+        self._path.mkdir(parents=True, exist_ok=True)
+        # days and rollup buckets follow local time, fixed at startup
+        self._utcoffset = datetime.now().astimezone().utcoffset().total_seconds()
+        # key = param name, value = latest sample time
+        self._last: dict[str, float] = {}
+        # key = param name, value = dict of open (not yet saved) bucket per resolution
+        self._buckets: dict[str, dict[str, np.ndarray]] = {}
+
+    def append(self, data: dict[Param, dict[str, str]]) -> int:
+        """
+        Save samples newer than the latest stored sample of each Param
+        data (dict) datadict as returned by the Reader
+        return number of samples saved
+        """
+        count = 0
+        for param, values in data.items():
+            samples = []
+            for timestamp, value in values.items():
+                try:
+                    samples.append((parse_timestamp(timestamp), float(value)))
+                except ValueError:  # ignore bad logs
+                    continue
+            if samples:
+                samples.sort()
+                times, values = zip(*samples)
+                count += self.extend(param.name, np.array(times), np.array(values))
+        return count
+
+    def extend(self, name: str, times: np.ndarray, values: np.ndarray) -> int:
+        """
+        Save samples of a Param in bulk, samples not newer than the latest stored sample are ignored
+        name (str) Param name
+        times (np.ndarray) POSIX times of samples in ascending order
+        values (np.ndarray) sample values
+        return number of samples saved
+        """
+        last = self._load(name)
+        mask = times > last
+        times, values = times[mask], values[mask]
+        if not times.size:
+            return 0
+
+        samples = np.empty(times.size, dtype=SAMPLE)
+        samples["time"], samples["value"] = times, values
+        self._write(name, "raw", samples)
+        for resolution in RESOLUTIONS:
+            self._rollup(name, resolution, samples)
+        self._last[name] = times[-1]
+        return times.size
+
+    def insert(self, name: str, times: np.ndarray, values: np.ndarray) -> int:
+        """
+        Save samples of a Param in bulk, including samples older than the latest stored sample e.g. backfilled from past logfiles. Newer samples are appended as by extend(). Older samples are merged into the day chunks they belong to, and the rollups of those days are rebuilt. Samples at times already stored are ignored.
+        name (str) Param name
+        times (np.ndarray) POSIX times of samples in any order
+        values (np.ndarray) sample values
+        return number of samples saved
+        """
+        last = self._load(name)
+        order = np.argsort(times, kind="stable")
+        times, values = times[order], values[order]
+        older = times <= last
+        count = 0
+        if older.any():
+            days = (times[older] + self._utcoffset) // 86400
+            indices = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+            for start, stop in zip(indices, np.r_[indices[1:], days.size]):
+                count += self._merge(
+                    name, times[older][start:stop], values[older][start:stop]
+                )
+        return count + self.extend(name, times[~older], values[~older])
+
+    def _merge(self, name: str, times: np.ndarray, values: np.ndarray) -> int:
+        """
+        Merge samples of a Param from one day, older than its latest stored sample, into the day chunk and rebuild the day's rollups from it
+        name (str) Param name
+        times (np.ndarray) POSIX times of samples of one day in ascending order
+        values (np.ndarray) sample values
+        return number of samples saved
+        """
+        folder = self._path / self._day(times[0])
+        folder.mkdir(exist_ok=True)
+        chunkpath = folder / f"{self._filename(name)}.raw"
+        stored = np.fromfile(chunkpath, dtype=SAMPLE) if chunkpath.exists() else None
+        stored = stored if stored is not None else np.empty(0, dtype=SAMPLE)
+        times, indices = np.unique(times, return_index=True)  # first sample wins
+        mask = ~np.isin(times, stored["time"])
+        samples = np.empty(np.count_nonzero(mask), dtype=SAMPLE)
+        samples["time"], samples["value"] = times[mask], values[indices][mask]
+        if not samples.size:
+            return 0
+
+        merged = np.concatenate([stored, samples])
+        merged = merged[np.argsort(merged["time"], kind="stable")]
+        self._replace(chunkpath, merged)
+        last = self._last[name]
+        for resolution, seconds in RESOLUTIONS.items():
+            buckets = self._get_buckets(merged, resolution)
+            # the bucket of the latest sample is still open, it is kept in memory
+            start = (last + self._utcoffset) // seconds * seconds - self._utcoffset
+            if buckets.size and buckets["time"][-1] == start:
+                self._buckets[name][resolution] = buckets[-1:]
+                buckets = buckets[:-1]
+            self._replace(folder / f"{self._filename(name)}.{resolution}", buckets)
+        return samples.size
+
+    def _replace(self, path: Path, records: np.ndarray) -> None:
+        """replace the chunk at path (Path) with records (np.ndarray) atomically, so that readers never see a partial chunk"""
+        partpath = path.with_name(path.name + ".part")
+        records.tofile(partpath)
+        os.replace(partpath, path)
+
+    def query(
+        self, name: str, start: float, stop: float, resolution: str = None
+    ) -> np.ndarray:
+        """
+        Get stored samples or rollups of a Param in a time range
+        name (str) Param name
+        start (float) POSIX time from which to get data (inclusive)
+        stop (float) POSIX time till which to get data (exclusive)
+        resolution (str) one of "1m", "1h", "1d" to get rollups, raw samples are returned if None
+        return structured array with SAMPLE or ROLLUP dtype in ascending time order
+        """
+        self._load(name)
+        suffix, dtype = ("raw", SAMPLE) if resolution is None else (resolution, ROLLUP)
+        chunks = []
+        first_day, last_day = self._localdate(start), self._localdate(stop)
+        chunkpaths = self._path.glob(f"*/{self._filename(name)}.{suffix}")
+        for chunkpath in sorted(chunkpaths, key=lambda path: self._date(path.parent)):
+            if first_day <= self._date(chunkpath.parent) <= last_day:
+                chunks.append(np.fromfile(chunkpath, dtype=dtype))
+        if resolution is not None and resolution in self._buckets[name]:
+            chunks.append(self._buckets[name][resolution])  # include open bucket
+        data = np.concatenate(chunks) if chunks else np.empty(0, dtype=dtype)
+        lo, hi = np.searchsorted(data["time"], [start, stop])
+        return data[lo:hi]
+
+    def _rollup(self, name: str, resolution: str, samples: np.ndarray) -> None:
+        """
+        Update rollups of a Param at a resolution with new samples, buckets are saved once a sample from a later bucket arrives
+        name (str) Param name
+        resolution (str) one of the keys of RESOLUTIONS
+        samples (np.ndarray) new samples with SAMPLE dtype in ascending time order
+        """
+        buckets = self._get_buckets(samples, resolution)
+
+        # merge first new bucket with the open bucket if they are the same
+        bucket = self._buckets[name].get(resolution)
+        if bucket is not None and bucket["time"][0] == buckets["time"][0]:
+            first, old = buckets[:1], bucket[0]
+            count = first["count"] + old["count"]
+            first["mean"] = (
+                first["mean"] * first["count"] + old["mean"] * old["count"]
+            ) / count
+            first["min"] = np.minimum(first["min"], old["min"])
+            first["max"] = np.maximum(first["max"], old["max"])
+            first["count"] = count
+        elif bucket is not None:
+            buckets = np.concatenate([bucket, buckets])
+
+        if buckets.size > 1:  # all buckets but the latest are closed
+            self._write(name, resolution, buckets[:-1])
+        self._buckets[name][resolution] = buckets[-1:]
+
+    def _get_buckets(self, samples: np.ndarray, resolution: str) -> np.ndarray:
+        """return rollups with ROLLUP dtype of samples (np.ndarray) with SAMPLE dtype in ascending time order at resolution (str), one of the keys of RESOLUTIONS"""
+        if not samples.size:
+            return np.empty(0, dtype=ROLLUP)
+        seconds = RESOLUTIONS[resolution]
+        starts = (samples["time"] + self._utcoffset) // seconds * seconds
+        starts -= self._utcoffset
+        # find indices where each bucket begins
+        indices = np.flatnonzero(np.r_[True, starts[1:] != starts[:-1]])
+        values = samples["value"]
+        buckets = np.empty(indices.size, dtype=ROLLUP)
+        buckets["time"] = starts[indices]
+        buckets["min"] = np.minimum.reduceat(values, indices)
+        buckets["max"] = np.maximum.reduceat(values, indices)
+        buckets["count"] = np.diff(np.r_[indices, values.size])
+        buckets["mean"] = np.add.reduceat(values, indices) / buckets["count"]
+        return buckets
+
+    def _load(self, name: str) -> float:
+        """
+        Recover the latest sample time and open buckets of a Param from its latest day chunk on first use
+        name (str) Param name
+        return POSIX time of the latest stored sample, -inf if there is none
+        """
+        if name in self._last:
+            return self._last[name]
+        self._last[name], self._buckets[name] = -np.inf, {}
+        chunkpaths = self._path.glob(f"*/{self._filename(name)}.raw")
+        chunkpath = max(
+            chunkpaths, key=lambda path: self._date(path.parent), default=None
+        )
+        if chunkpath:
+            samples = np.fromfile(chunkpath, dtype=SAMPLE)
+            if samples.size:
+                last = samples["time"][-1]
+                for resolution, seconds in RESOLUTIONS.items():
+                    start = (last + self._utcoffset) // seconds * seconds
+                    start -= self._utcoffset
+                    pending = samples[samples["time"] >= start]
+                    self._rollup(name, resolution, pending)
+                self._last[name] = last
+                logger.debug(f"Loaded {name} store with latest sample at {last}.")
+        return self._last[name]
+
+    def _write(self, name: str, suffix: str, records: np.ndarray) -> None:
+        """append records (np.ndarray) of a Param (name) to the day chunks with suffix (str) they belong to"""
+        days = (records["time"] + self._utcoffset) // 86400
+        indices = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+        for start, stop in zip(indices, np.r_[indices[1:], days.size]):
+            folder = self._path / self._day(records["time"][start])
+            folder.mkdir(exist_ok=True)
+            with (folder / f"{self._filename(name)}.{suffix}").open("ab") as file:
+                records[start:stop].tofile(file)
+
+    def _day(self, time: float) -> str:
+        """return local date string in yy-mm-dd format of POSIX time (float)"""
+        return self._localdate(time).strftime("%y-%m-%d")
+
+    def _localdate(self, time: float) -> date:
+        """return local date of POSIX time (float)"""
+        return datetime.fromtimestamp(time + self._utcoffset, timezone.utc).date()
+
+    @staticmethod
+    def _date(folder: Path) -> date:
+        """return date of a day chunk folder (Path)"""
+        return datetime.strptime(folder.name, "%y-%m-%d").date()
+
+    @staticmethod
+    def _filename(name: str) -> str:
+        """return name (str) with characters that are not allowed in filenames replaced"""
+        return re.sub(r'[\\/:*?"<>|]', "_", name)
@@ -0,0 +1,181 @@
+""" Module to wait for logfiles to change instead of polling them at fixed intervals """
+
+from collections.abc import Iterable
+import ctypes
+import ctypes.util
+import os
+from pathlib import Path
+import select
+import struct
+import sys
+import time
+
+from hal.logger import logger
+
+# inotify event masks, see inotify(7)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_IGNORED = 0x00008000
+IN_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+# inotify event header layout i.e. wd, mask, cookie, len
+EVENT = struct.Struct("iIII")
+
+
+class Watcher:
+    """
+    Waits for logfiles to change. Uses inotify on Linux to sleep till the kernel reports a write, and falls back to polling logfile sizes and modification times elsewhere or if inotify is unavailable.
+    """
+
+    def __init__(
+        self, debounce: float = 0.5, max_wait: float = 1.0, poll: float = 1.0
+    ) -> None:
+        """
+        debounce (float) in seconds, time a logfile must stay unchanged after a write before it is reported, so a burst of writes is reported once
+        max_wait (float) in seconds, time after which a changed logfile is reported even if it is still being written to, so logfiles written to more often than debounce are still reported
+        poll (float) in seconds, time between checks of logfile stats when falling back to polling
+        """
+        self._debounce = debounce
+        self._max_wait = max_wait
+        self._poll = poll
+        # key = logfile, value = tuple of (first, last) change time since reported
+        self._pending: dict[Path, tuple[float, float]] = {}
+        self._stats: dict[Path, tuple[int, int]] = {}  # key = logfile, value = stat
+        # key = inotify watch descriptor, value = folder
+        self._watches: dict[int, Path] = {}
+        self._fd: int | None = self._init_inotify()
+        self._read_all_at = time.monotonic()  # when all logfiles were last due
+        backend = "polling" if self._fd is None else "inotify"
+        logger.debug(f"Watcher ready to watch logfiles with {backend}.")
+
+    def wait(self, paths: Iterable[Path], timeout: float) -> set[Path]:
+        """
+        Block till any of the logfiles change or the timeout elapses, whichever is earlier
+        paths (Iterable[Path]) paths of the logfiles to watch, need not exist yet
+        timeout (float) in seconds, maximum time to block for
+        return set of logfile Paths that changed, empty if the timeout elapsed without any changes
+        """
+        paths = set(paths)
+        deadline = time.monotonic() + timeout
+        self._pending = {p: t for p, t in self._pending.items() if p in paths}
+        if self._fd is not None:
+            self._watch({path.parent for path in paths})
+        else:  # catch changes made since the last call
+            self._touch(self._stat(paths), deadline - timeout)
+
+        while True:
+            now = time.monotonic()
+            ready = {p for p, t in self._pending.items() if now >= self._due(*t)}
+            if ready:
+                for path in ready:
+                    del self._pending[path]
+                return ready
+            if now >= deadline:
+                return set()
+
+            # wake up in time for the earliest pending logfile to be due
+            wakeup = min(
+                (self._due(*t) for t in self._pending.values()), default=deadline
+            )
+            wakeup = min(wakeup, deadline) - now
+            if self._fd is not None:
+                changed = self._read_inotify(wakeup)
+            else:
+                time.sleep(min(wakeup, self._poll))
+                changed = self._stat(paths)
+            self._touch(changed & paths, time.monotonic())
+
+    def wait_cycle(self, paths: Iterable[Path], interval: float) -> set[Path] | None:
+        """
+        Wait for logfiles to change as in wait(), but never for longer than interval (float) seconds since all logfiles were last due to be read. All logfiles are due at least every interval even if some of them keep changing, so that Params of missing or idle logfiles still get their N/A and heartbeat updates.
+        paths (Iterable[Path]) paths of the logfiles to watch, need not exist yet
+        return set of logfile Paths that changed, None if all logfiles are due to be read
+        """
+        timeout = self._read_all_at + interval - time.monotonic()
+        changed = self.wait(paths, timeout) if timeout > 0 else set()
+        if not changed or time.monotonic() - self._read_all_at >= interval:
+            self._read_all_at = time.monotonic()
+            return None
+        return changed
+
+    def _touch(self, paths: set[Path], now: float) -> None:
+        """record that logfiles (set[Path]) changed at monotonic time now (float)"""
+        for path in paths:
+            first, _ = self._pending.get(path, (now, now))
+            self._pending[path] = (first, now)
+
+    def _due(self, first: float, last: float) -> float:
+        """return monotonic time at which a logfile first (float) and last (float) changed at since it was last reported is to be reported"""
+        return min(last + self._debounce, first + self._max_wait)
+
+    def _init_inotify(self) -> int | None:
+        """return inotify file descriptor, None if inotify is not available"""
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        return fd if fd >= 0 else None
+
+    def _watch(self, folders: set[Path]) -> None:
+        """
+        Watch folders (set[Path]) for writes to files in them. Folders that do not exist yet e.g. the next date's folder, are detected through a watch on their parent.
+        """
+        targets = {folder if folder.exists() else folder.parent for folder in folders}
+        for wd, folder in list(self._watches.items()):
+            if folder not in targets:  # e.g. previous date's folder
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._watches[wd]
+        for target in targets - set(self._watches.values()):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(target), IN_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                logger.warning(f"Failed to watch {target} ({os.strerror(errno)}).")
+                continue
+            self._watches[wd] = target
+
+    def _read_inotify(self, timeout: float) -> set[Path]:
+        """return set of Paths written to, blocking till an event arrives or timeout (float) in seconds elapses"""
+        readable, _, _ = select.select([self._fd], [], [], max(timeout, 0))
+        if not readable:
+            return set()
+        try:
+            buffer = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return set()
+
+        changed, offset = set(), 0
+        while offset < len(buffer):
+            wd, mask, _, length = EVENT.unpack_from(buffer, offset)
+            name = buffer[offset + EVENT.size : offset + EVENT.size + length]
+            offset += EVENT.size + length
+            if mask & IN_IGNORED:  # folder was removed
+                self._watches.pop(wd, None)
+            elif wd in self._watches and name:
+                path = self._watches[wd] / os.fsdecode(name.rstrip(b"\0"))
+                changed.add(path)
+                if mask & IN_CREATE and path.is_dir():  # e.g. next date's folder
+                    self._watch(set(self._watches.values()) | {path})
+                    changed |= set(path.iterdir())  # written to before being watched
+        return changed
+
+    def _stat(self, paths: set[Path]) -> set[Path]:
+        """return set of Paths whose size or modification time changed since they were last checked"""
+        changed = set()
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                stat = None
+            else:
+                stat = (stat.st_size, stat.st_mtime_ns)
+            if path in self._stats and self._stats[path] != stat:
+                changed.add(path)
+            self._stats[path] = stat
+        for path in self._stats.keys() - paths:  # forget logfiles no longer watched
+            del self._stats[path]
+        return changed
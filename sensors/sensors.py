@@ -1,97 +1,314 @@
 """
-Script to read sensor data from the Arduino Nano board and save it to a log file on disk. Currently, we are sensing cooling water flow and compressed air pressure.
+Script to read sensor data from Arduino boards and save it to log files on disk. Currently, we are sensing cooling water flow and compressed air pressure.
+Each board in DEVICES is read concurrently in its own thread, so a slow or disconnected board never delays the others.
 This script is meant to be always running in the background.
-Logformat: <dd-mm-yy>,<hh-mm-ss>,<water flow in L/min>,<compressed air pressure in bar>
+Logformat: <dd-mm-yy>,<hh-mm-ss>,<value 1>,<value 2>,... with values as listed in the device's schema
 """
 
 from datetime import datetime
+import os
 from pathlib import Path
+import threading
 import time
 
 from loguru import logger
 import serial
 
-PORT = "COM4"  # serial port to be read
 BAUDRATE = 9600
 TIMEOUT = 90
 RETRY = 60
+JOIN_TIMEOUT = 5  # seconds to wait for each device's thread to stop on exit
 
-# log file will be saved to LOGPATH / {yy-mm-dd} / {FILEPREFIX}{yy-mm-dd}.log
+# log file will be saved to LOGPATH / {yy-mm-dd} / {prefix}{yy-mm-dd}.log
 LOGPATH = Path("C:/Users/Qcrew/Bluefors logs")
-FILEPREFIX = "ArduinoNano "
+
+# buffered lines are flushed to disk once there are FLUSH_SIZE of them or FLUSH_TIME seconds after the first of them was buffered, whichever is earlier
+FLUSH_SIZE = 64
+FLUSH_TIME = 5
+REPORT_TIME = 3600  # seconds between reports of sample counts
+
+
+class Device:
+    """a serial device and the schema of the comma-separated values it sends per line"""
+
+    def __init__(
+        self,
+        port: str,
+        prefix: str,
+        schema: dict[str, type],
+        baudrate: int = BAUDRATE,
+        timeout: float = TIMEOUT,
+    ) -> None:
+        """
+        port (str) serial port to be read, any pyserial URL e.g. "loop://" also works
+        prefix (str) logfile name prefix, must be unique among devices
+        schema (dict[str, type]) key = value name, value = type each value must be castable to, in the order they are sent
+        baudrate (int) baudrate of the serial connection
+        timeout (float) in seconds, time to wait for a line before reading again
+        """
+        self.port = port
+        self.prefix = prefix
+        self.schema = schema
+        self.baudrate = baudrate
+        self.timeout = timeout
+
+    def __repr__(self) -> str:
+        """ """
+        return f"Device({self.port}, {self.prefix!r})"
+
+    def validate(self, line: str) -> list:
+        """
+        line (str) line received from the device, without the line terminator
+        return list of values cast according to the schema, raise ValueError if the line does not match it
+        """
+        values = line.split(",")
+        if len(values) != len(self.schema):
+            raise ValueError(f"Expected {len(self.schema)} values, got {len(values)}")
+        return [cast(value) for cast, value in zip(self.schema.values(), values)]
+
+
+# devices to be read, add one entry per board
+DEVICES = [
+    Device("COM4", "ArduinoNano ", {"flow": int, "pres": float}),
+]
+
+
+class Logfile:
+    """keeps the current logfile open and appends lines to it in buffered batches, a timer flushes lines that are not followed by enough others to fill a batch"""
+
+    def __init__(
+        self,
+        prefix: str,
+        folder: Path = LOGPATH,
+        flush_size: int = FLUSH_SIZE,
+        flush_time: float = FLUSH_TIME,
+    ) -> None:
+        """
+        prefix (str) prefix of the logfile name
+        folder (Path) folder to save logfiles to, in one subfolder per date
+        flush_size (int) number of buffered lines that triggers a flush
+        flush_time (float) in seconds, time after a line is buffered by which it is flushed
+        """
+        self._folder = folder
+        self._prefix = prefix
+        self._flush_size = flush_size
+        self._flush_time = flush_time
+        self._buffer: list[str] = []
+        self._timer: threading.Timer | None = None  # flushes the buffer when due
+        self._date: str | None = None
+        self._file = None
+        self._lock = threading.Lock()  # guards the above against the timer
+
+    def write(self, line: str, date: str) -> None:
+        """
+        line (str) line to append, including the line terminator
+        date (str) date in yy-mm-dd format the line belongs to, the logfile is rotated when it changes
+        """
+        with self._lock:
+            if date != self._date:
+                self._rotate(date)
+            self._buffer.append(line)
+            if len(self._buffer) >= self._flush_size:
+                self._flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(self._flush_time, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self) -> None:
+        """write buffered lines and make sure they reach the disk"""
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        """ """
+        with self._lock:
+            self._close()
+
+    def _flush(self) -> None:
+        """ """
+        if self._file is not None and self._buffer:
+            self._file.writelines(self._buffer)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._buffer.clear()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _rotate(self, date: str) -> None:
+        """flush and close the current logfile and open the one for date (str) in yy-mm-dd format"""
+        self._close()
+        self._date = date
+        filepath = get_filepath(date, self._folder, self._prefix)
+        self._file = filepath.open("a")
+        logger.debug(f"Rotated logfile to {filepath = }.")
+
+    def _close(self) -> None:
+        """ """
+        if self._file is not None:
+            self._flush()
+            self._file.close()
+            self._file = None
+            self._date = None  # re-open the logfile if written to again
+
+
+class Stats:
+    """counts of samples received, for reporting"""
+
+    def __init__(self, name: str) -> None:
+        """name (str) name of the device whose samples are counted"""
+        self.name = name
+        self.written = 0  # samples logged
+        self.malformed = 0  # complete lines that failed the sanity check
+        self.dropped = 0  # incomplete lines e.g. cut off by a read timeout
+        self.disconnects = 0  # times the board had to be reconnected
+        self._reported_at = time.monotonic()
+
+    def report(self, force: bool = False) -> None:
+        """log counts if REPORT_TIME has passed since the last report or if force (bool) is True"""
+        if force or time.monotonic() - self._reported_at >= REPORT_TIME:
+            logger.info(
+                f"{self.name} samples {self.written = }, {self.malformed = }, {self.dropped = }, "
+                f"{self.disconnects = }."
+            )
+            self._reported_at = time.monotonic()
 
 
 @logger.catch
-def main():
-    """ """
-    board = connect()
+def main(devices: list[Device] = DEVICES):
+    """read all devices (list[Device]) concurrently till interrupted"""
+    prefixes = [device.prefix for device in devices]
+    if len(set(prefixes)) != len(prefixes):
+        raise ValueError(f"Devices must have unique logfile prefixes, got {prefixes}.")
+
+    stop = threading.Event()
+    workers = []  # list of (thread, logfile, stats), one per device
+    for device in devices:
+        logfile, stats = Logfile(prefix=device.prefix), Stats(device.prefix.strip())
+        args = (device, logfile, stats, stop)
+        thread = threading.Thread(target=run, args=args, name=device.port, daemon=True)
+        thread.start()
+        workers.append((thread, logfile, stats))
+
+    try:
+        while any(thread.is_alive() for thread, _, _ in workers):
+            time.sleep(1)  # sleep in short spans so KeyboardInterrupt is caught
+    except KeyboardInterrupt:
+        logger.debug("Exited after detecting keyboard interrupt!")
+    finally:
+        stop.set()
+        for thread, logfile, stats in workers:
+            thread.join(JOIN_TIMEOUT)  # a thread may be blocked on a read
+            if thread.is_alive():  # it closes its logfile once the read returns
+                logger.warning(f"{thread.name} is still reading, flushed its log.")
+                logfile.flush()
+            stats.report(force=True)
+
+
+@logger.catch
+def run(device: Device, logfile: Logfile, stats: Stats, stop: threading.Event):
+    """connect to and read device (Device) till stop (threading.Event) is set, then close logfile (Logfile), meant to be run in a thread"""
+    try:
+        board = connect(device, stop)
+        if board is not None:
+            acquire(board, device, logfile, stats, stop)
+    finally:
+        logfile.close()
 
-    old_date = get_datetime("%y-%m-%d")
-    filepath = get_filepath(old_date)
 
+def acquire(
+    board: serial.Serial,
+    device: Device,
+    logfile: Logfile,
+    stats: Stats,
+    stop: threading.Event,
+    count: int = None,
+):
+    """
+    Read data from the board and log it till stopped, reconnecting whenever the board is lost. The board, or the one it was last reconnected to, is closed on return
+    board (serial.Serial) connected board
+    device (Device) the board belongs to
+    logfile (Logfile) to log data to
+    stats (Stats) to count samples in
+    stop (threading.Event) stop reading once set
+    count (int) stop after this many lines have been received, runs forever if None
+    """
+    date_cache: tuple = (None, "")  # (date, yy-mm-dd) to format dates once a day
     try:
-        while True:
+        while not stop.is_set() and (count is None or count > 0):
             # this readline() call returns only after a new line is available
             # hence, we retrieve the data first and then proceed to log it
-            logger.debug("Waiting to receive sensor data...")
             try:
                 data = board.readline()
             except serial.SerialException:
-                logger.debug(f"Failed to get serial data, retrying after {RETRY}s...")
-                time.sleep(RETRY)
-                main()
-            else:
-                new_date = get_datetime("%y-%m-%d")
-                if old_date != new_date:  # time to rotate log file
-                    filepath = get_filepath(new_date)
-                    logger.debug("Rotated logfile!")
-                    old_date = new_date
-
-                with filepath.open("a") as log:
-                    datestamp = get_datetime("%d-%m-%y")
-                    timestamp = get_datetime("%H:%M:%S")
-                    value = data.decode(encoding="utf-8", errors="ignore").strip()
-
-                    try:  # do a sanity check on the received value string
-                        values = value.split(",")
-                        flow, pres = int(values[0]), float(values[1])
-                    except (ValueError, IndexError):
-                        logger.warning(f"Received bad {values = } and ignored them.")
-                    else:
-                        content = f"{datestamp},{timestamp},{flow},{pres}\n"
-                        log.write(content)
-                        logger.debug(f"Received and wrote {content = } to logfile.")
+                logger.debug(f"Failed to read {device}, reconnecting after {RETRY}s...")
+                board.close()
+                logfile.flush()  # don't hold lines in memory while disconnected
+                stats.disconnects += 1
+                if stop.wait(RETRY) or (board := connect(device, stop)) is None:
+                    return
+                continue
 
-    except KeyboardInterrupt:
-        logger.debug("Exited after detecting keyboard interrupt!")
+            if not data:  # read timed out without any data
+                continue
+            if count is not None:
+                count -= 1
+            if not data.endswith(b"\n"):  # read timed out midway through a line
+                stats.dropped += 1
+                continue
 
+            now = datetime.now()
+            line = data.decode(encoding="utf-8", errors="ignore").strip()
+            try:  # do a sanity check on the received line
+                values = device.validate(line)
+            except ValueError as err:
+                stats.malformed += 1
+                logger.warning(
+                    f"Received bad {line = } from {device} and ignored it ({err})."
+                )
+                continue
 
-def connect() -> serial.Serial:
-    """ """
-    try:
-        board = serial.Serial(port=PORT, baudrate=BAUDRATE, timeout=TIMEOUT)
-    except serial.SerialException:
-        time.sleep(RETRY)
-        connect()
-    else:
-        logger.debug(f"Connected to {board = }.")
-        return board
+            if date_cache[0] != now.date():
+                date_cache = (now.date(), now.strftime("%y-%m-%d"))
+            text = ",".join(str(value) for value in values)
+            logfile.write(f"{now:%d-%m-%y,%H:%M:%S},{text}\n", date_cache[1])
+            stats.written += 1
+            stats.report()
+    finally:
+        if board is not None:  # None if stopped while reconnecting
+            board.close()
 
 
-def get_filepath(date) -> Path:
+def connect(device: Device, stop: threading.Event) -> serial.Serial | None:
+    """
+    Keep trying to connect to the device (Device) every RETRY seconds till it succeeds
+    stop (threading.Event) stop trying once set
+    return connected board, None if stopped before connecting
+    """
+    while not stop.is_set():
+        try:
+            board = serial.serial_for_url(
+                device.port, baudrate=device.baudrate, timeout=device.timeout
+            )
+        except serial.SerialException as err:
+            logger.debug(f"Failed to connect {device} due to {err = }, retrying...")
+            stop.wait(RETRY)
+        else:
+            logger.debug(f"Connected to {device}.")
+            return board
+    return None
+
+
+def get_filepath(date, folder: Path, prefix: str) -> Path:
     """ """
-    subfolder = LOGPATH / date
+    subfolder = folder / date
     subfolder.mkdir(exist_ok=True)
-    filepath = subfolder / f"{FILEPREFIX}{date}.log"
+    filepath = subfolder / f"{prefix}{date}.log"
     logger.debug(f"Got {filepath = }.")
     return filepath
 
 
-def get_datetime(fmt):
-    """ """
-    return datetime.now().strftime(fmt)
-
-
 if __name__ == "__main__":
     """ """
     main()
@@ -0,0 +1,83 @@
+""" Shared fixtures. HAL's config is specific to each deployment, so a test config stands in for it """
+
+from pathlib import Path
+import sys
+import tempfile
+import types
+
+import pytest
+
+TOKENS = Path(tempfile.mkdtemp(prefix="hal-tests-"))
+(TOKENS / "notion").write_text("token")
+(TOKENS / "slack").write_text("token,channel")
+
+config = types.ModuleType("hal.config")
+config.FRIDGE_NAME = "test"
+config.LOGFOLDER = TOKENS / "logs"
+config.PARAMS = ()
+config.INTERVAL = 1
+config.NOTION_TOKENPATH = TOKENS / "notion"
+config.SLACK_TOKENPATH = TOKENS / "slack"
+sys.modules.setdefault("hal.config", config)
+
+from hal.client import Client  # noqa: E402, needs the test config
+from hal.replay import NotionHandler, SlackHandler, Stub  # noqa: E402
+
+
+def pytest_addoption(parser):
+    """ """
+    parser.addoption(
+        "--benchmark",
+        action="store_true",
+        help="also run benchmarks, they assert wall clock timings that depend on the machine",
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    """skip benchmarks unless --benchmark is given"""
+    if config.getoption("--benchmark"):
+        return
+    skip = pytest.mark.skip(reason="benchmark, run with --benchmark")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture
+def notion(monkeypatch):
+    """local stand-in for Notion's API that Clients call instead of Notion"""
+    server = Stub(NotionHandler)
+    server.pages, server.posts = {}, []
+    monkeypatch.setattr(Client, "BASE_URL", server.url + "/v1")
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def slack():
+    """local stand-in for Slack's API, pass base_url=slack.url + "/api/" to Siren"""
+    server = Stub(SlackHandler)
+    yield server
+    server.shutdown()
+
+
+class Alarms:
+    """records alerts raised by a Dispatcher, in place of a Siren"""
+
+    def __init__(self) -> None:
+        """ """
+        self.warned: dict = {}  # key = (fridge, param name), value = (value, reason)
+
+    def warn(self, param, value, fridge, reason) -> None:
+        """ """
+        self.warned[(fridge, param.name)] = (value, reason)
+
+    def clear(self, param, fridge) -> None:
+        """ """
+        self.warned.pop((fridge, param.name), None)
+
+
+@pytest.fixture
+def alarms():
+    """ """
+    return Alarms()
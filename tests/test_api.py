@@ -0,0 +1,106 @@
+""" Tests for serving the latest values to local clients """
+
+import json
+import threading
+
+import pytest
+import requests
+
+from hal.api import Board, serve
+from hal.param import NumParam
+
+PARAM = NumParam(name="T", filename="T ", pos=2, category="temps", units="K")
+
+
+@pytest.fixture
+def board():
+    """ """
+    return Board()
+
+
+@pytest.fixture
+def url(board):
+    """URL of a server serving board"""
+    server = serve(board, port=0)
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def publish(board, value, timestamp="10-01-23 12:00:00", alarms=()):
+    """update PARAM of fridge "test" on board and publish it"""
+    board.update("test", PARAM, value, timestamp, list(alarms))
+    board.publish()
+
+
+def test_wait_wakes_up_on_publish(board):
+    timer = threading.Timer(0.1, publish, (board, "1.00 K"))
+    timer.start()
+    version, events = board.wait(0, timeout=5)
+    timer.join()
+    assert version == 1 and len(events) == 1
+    assert b'"T": {"value": "1.00 K"' in events[0]
+
+
+def test_wait_times_out_without_updates(board):
+    board.publish()  # nothing changed, nothing to publish
+    assert board.wait(0, timeout=0.05) == (0, [])
+
+
+def test_subscriber_that_fell_behind_needs_a_snapshot():
+    board = Board(history=2)
+    for value in ("1", "2", "3"):
+        publish(board, value)
+    assert board.wait(0, timeout=0) is None
+    version, events = board.wait(1, timeout=0)
+    assert version == 3 and len(events) == 2
+
+
+def test_snapshot_is_cached_by_version(board, url):
+    publish(board, "1.00 K", alarms=["bounds"])
+    response = requests.get(url + "/values", timeout=5)
+    assert response.status_code == 200 and response.headers["ETag"] == '"1"'
+    entry = response.json()["fridges"]["test"]["T"]
+    assert entry == {
+        "value": "1.00 K",
+        "timestamp": "10-01-23 12:00:00",
+        "category": "temps",
+        "alarms": ["bounds"],
+    }
+    headers = {"If-None-Match": '"1"'}
+    response = requests.get(url + "/values", headers=headers, timeout=5)
+    assert response.status_code == 304 and not response.content
+    publish(board, "2.00 K")
+    response = requests.get(url + "/values", headers=headers, timeout=5)
+    assert response.status_code == 200 and response.json()["version"] == 2
+
+
+def test_unknown_path_is_not_found(url):
+    assert requests.get(url + "/nothing", timeout=5).status_code == 404
+
+
+def test_stream_sends_snapshot_then_published_updates(board, url):
+    publish(board, "1.00 K")
+    with requests.get(url + "/events", stream=True, timeout=5) as response:
+        assert response.headers["Content-Type"] == "text/event-stream"
+        lines = response.iter_lines(chunk_size=1, decode_unicode=True)
+        id_, event, data, end = (next(lines) for _ in range(4))
+        assert (id_, event, end) == ("id: 1", "event: snapshot", "")
+        assert json.loads(data.removeprefix("data: "))["version"] == 1
+        publish(board, "2.00 K")
+        id_, event, data = (next(lines) for _ in range(3))
+    assert id_ == "id: 2" and event == "event: update"
+    update = json.loads(data.removeprefix("data: "))
+    assert update == {
+        "version": 2,
+        "fridges": {
+            "test": {
+                "T": {
+                    "value": "2.00 K",
+                    "timestamp": "10-01-23 12:00:00",
+                    "category": "temps",
+                    "alarms": [],
+                }
+            }
+        },
+    }
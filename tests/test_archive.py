@@ -0,0 +1,56 @@
+""" Tests for archiving logfiles and reading time ranges back from them """
+
+from datetime import date, datetime
+import zlib
+
+from hal import archive as archiving
+from hal.archive import archive, read_range
+from hal.fridge import Fridge
+from hal.param import NumParam
+from hal.reader import get_logpath
+
+
+def get_fridge(logfolder):
+    """return fridge with a keyword and an index positioned NumParam logged in one logfile"""
+    params = [
+        NumParam(units="K", name="T", filename="status ", pos="T", category="t"),
+        NumParam(units="K", name="P", filename="status ", pos=5, category="t"),
+    ]
+    return Fridge("test", logfolder, params)
+
+
+def write_day(fridge, day):
+    """write a logfile of day (date) with a line every 10 seconds and a bad line every hour"""
+    path = get_logpath(fridge.logfolder, "status ", day.strftime("%y-%m-%d"))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w") as file:
+        for second in range(0, 86400, 10):
+            stamp = f"{day:%d-%m-%y},{second // 3600:02}:{second // 60 % 60:02}:"
+            file.write(f"{stamp}{second % 60:02},T,{second},P,{-second}\n")
+            if second % 3600 == 0:
+                file.write("bad log\n")
+
+
+def test_read_range_is_unchanged_by_archiving(tmp_path, monkeypatch):
+    fridge = get_fridge(tmp_path / "logs")
+    for day in (date(2023, 1, 10), date(2023, 1, 11)):
+        write_day(fridge, day)
+    start, stop = datetime(2023, 1, 10, 23, 30), datetime(2023, 1, 11, 0, 30)
+    before = read_range(fridge, start, stop)
+    assert [len(values) for values in before.values()] == [360, 360]
+    assert list(before[fridge.params[0]].items())[0] == ("10-01-23 23:30:00", "84600")
+    assert list(before[fridge.params[1]].items())[-1] == ("11-01-23 00:29:50", "-1790")
+
+    archive(fridge.logfolder, date(2023, 1, 12), blocksize=1 << 12)
+    assert not get_logpath(fridge.logfolder, "status ", "23-01-10").exists()
+    blocks, decompress = [], zlib.decompress
+
+    def counting_decompress(data, wbits):
+        """ """
+        blocks.append(data)
+        return decompress(data, wbits)
+
+    monkeypatch.setattr(archiving.zlib, "decompress", counting_decompress)
+    assert read_range(fridge, start, stop) == before
+    nblocks = 2 * 86400 * 30 // (1 << 12)  # about 30 bytes per line
+    assert 0 < len(blocks) < nblocks / 20  # blocks out of range are skipped
@@ -0,0 +1,113 @@
+""" Tests for backfilling past logfiles into the store, and a benchmark of how backfilling scales with cores """
+
+import os
+import random
+
+import numpy as np
+import pytest
+
+from hal.backfill import backfill
+from hal.fridge import Fridge
+from hal.param import NumParam
+from hal.reader import get_logpath
+from hal.store import Store, parse_timestamp
+
+
+def get_fridge(logfolder, nparams=1):
+    """return fridge with NumParams logged at index 2 onwards of one logfile"""
+    params = [
+        NumParam(
+            units="K", name=f"T{index}", filename="CH T ", pos=2 + index, category="t"
+        )
+        for index in range(nparams)
+    ]
+    return Fridge("test", logfolder, params)
+
+
+def write_day(fridge, day, step=60, nparams=1):
+    """write a logfile of day (date) with a line every step (int) seconds, return logged values of the first Param"""
+    path = get_logpath(fridge.logfolder, "CH T ", day.strftime("%y-%m-%d"))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    values = []
+    with path.open("w") as file:
+        for second in range(0, 86400, step):
+            value = round(random.uniform(0, 10), 3)
+            values.append(value)
+            stamp = f"{day:%d-%m-%y},{second // 3600:02}:{second // 60 % 60:02}:00"
+            file.write(f"{stamp},{','.join([str(value)] * nparams)}\n")
+    return values
+
+
+def test_backfill_into_store_with_newer_live_data(tmp_path):
+    from datetime import date
+
+    fridge = get_fridge(tmp_path / "logs")
+    store = Store(fridge.name, path=tmp_path / "store")
+    live = parse_timestamp("12-01-23 10:00:00")  # HAL has stored data of a later day
+    store.extend("T0", np.array([live]), np.array([1.0]))
+    values = write_day(fridge, date(2023, 1, 10), step=600)
+
+    stats = backfill(fridge, date(2023, 1, 10), date(2023, 1, 12), 1, store)
+    assert stats["samples"] == len(values) and stats["skipped"] == 0
+    start = parse_timestamp("10-01-23 00:00:00")
+    samples = store.query("T0", start, start + 86400)
+    assert samples["value"].tolist() == values
+    day = store.query("T0", start, start + 86400, "1d")
+    assert day["count"].tolist() == [len(values)] and day["max"][0] == max(values)
+    hours = store.query("T0", start, start + 86400, "1h")
+    assert hours.size == 24 and hours["count"].sum() == len(values)
+    assert store.query("T0", live, live + 1)["value"].tolist() == [1.0]
+
+    stats = backfill(fridge, date(2023, 1, 10), date(2023, 1, 10), 1, store)
+    assert stats["samples"] == 0 and stats["skipped"] == len(values)
+
+
+def test_insert_into_latest_day_updates_open_buckets(tmp_path):
+    store = Store("test", path=tmp_path)
+    start = parse_timestamp("10-01-23 12:00:00")
+    store.extend("T", np.array([start + 30.0]), np.array([4.0]))
+    assert store.insert("T", np.array([start + 10.0, start]), np.array([8.0, 0.0])) == 2
+    minute = store.query("T", start, start + 60, "1m")
+    assert minute["count"].tolist() == [3] and minute["mean"].tolist() == [4.0]
+    assert store.query("T", start, start + 60)["value"].tolist() == [0.0, 8.0, 4.0]
+    store.extend("T", np.array([start + 60.0]), np.array([5.0]))  # closes the bucket
+    reloaded = Store("test", path=tmp_path)
+    minutes = reloaded.query("T", start, start + 120, "1m")
+    assert minutes["count"].tolist() == [3, 1]
+
+
+@pytest.mark.benchmark
+@pytest.mark.skipif((os.cpu_count() or 1) < 2, reason="needs more than one core")
+def test_backfill_scales_with_cores(tmp_path):
+    from datetime import date, timedelta
+
+    fridge = get_fridge(tmp_path / "logs", nparams=4)
+    first = date(2023, 1, 1)
+    for offset in range(8):
+        write_day(fridge, first + timedelta(days=offset), step=4, nparams=4)
+    last = first + timedelta(days=7)
+    throughput = {}
+    for workers in sorted({1, 2, min(4, os.cpu_count())}):
+        store = Store(fridge.name, path=tmp_path / f"store{workers}")
+        stats = backfill(fridge, first, last, workers, store)
+        throughput[workers] = stats["lines/s"]
+    print(
+        "\n" + ", ".join(f"{w} workers: {t:.0f} lines/s" for w, t in throughput.items())
+    )
+    assert max(throughput.values()) > 1.3 * throughput[1]
+
+
+def test_throughput_counts_uncompressed_bytes(tmp_path):
+    from datetime import date
+
+    from hal.archive import archive
+    from hal.backfill import parse_logfile
+
+    fridge = get_fridge(tmp_path / "logs")
+    write_day(fridge, date(2023, 1, 10))
+    path = get_logpath(fridge.logfolder, "CH T ", "23-01-10")
+    size = path.stat().st_size
+    archive(fridge.logfolder, date(2023, 1, 11))
+    assert not path.exists()
+    _, nbytes, nlines = parse_logfile(path, {"T0": 2})
+    assert (nbytes, nlines) == (size, 1440)
@@ -0,0 +1,93 @@
+""" Tests for the Notion client """
+
+import pytest
+import requests
+
+from hal.checkpoint import Checkpoint
+from hal.client import Client
+from hal.limiter import RateLimiter
+from hal.replay import get_synthetic_fridge
+
+
+def get_client(fridge, checkpoint):
+    """return Client of fridge posting to the local stand-in for Notion"""
+    return Client(fridge, session=requests.Session(), checkpoint=checkpoint)
+
+
+def test_restored_pages_get_category_edits(notion, tmp_path):
+    fridge = get_synthetic_fridge(tmp_path, 3, nfiles=1)
+    checkpoint = Checkpoint(tmp_path / "checkpoint.db")
+    get_client(fridge, checkpoint)
+    fridge.params[1].category = "edited"
+    get_client(fridge, checkpoint)
+    categories = {page["name"]: page["category"] for page in notion.pages.values()}
+    assert categories == {
+        "param0": "synthetic",
+        "param1": "edited",
+        "param2": "synthetic",
+    }
+    assert notion.calls[("PATCH pages", 200)] == 1
+    assert notion.calls[("POST search", 200)] == 1  # database id is restored
+    checkpoint.close()
+
+
+def test_missing_restored_pages_are_mapped_again(notion, tmp_path):
+    fridge = get_synthetic_fridge(tmp_path, 3, nfiles=1)
+    checkpoint = Checkpoint(tmp_path / "checkpoint.db")
+    get_client(fridge, checkpoint)
+    del notion.pages["page-2"]  # deleted in Notion
+    get_client(fridge, checkpoint)
+    assert sorted(page["name"] for page in notion.pages.values()) == [
+        "param0",
+        "param1",
+        "param2",
+    ]
+    checkpoint.close()
+
+
+def test_outage_costs_one_timeout_per_batch(notion, tmp_path):
+    """once a post times out, posts of the batch that are not in flight yet are given up"""
+    fridge = get_synthetic_fridge(tmp_path, 40, nfiles=1)
+    limiter = RateLimiter(rate=1000.0, burst=1000)  # set up pages quickly
+    client = Client(fridge, session=requests.Session(), limiter=limiter, timeout=0.2)
+    client._limiter = RateLimiter()  # posts queue up for tokens as in production
+    notion.latency = 1.0  # Notion hangs
+    results = client.post_many({param: "1" for param in fridge.params})
+    assert set(results.values()) == {"error"}
+    assert notion.calls[("PATCH pages", 200)] <= 8  # not all 40 one after another
+
+
+@pytest.mark.parametrize(
+    "status, result", [(200, "ok"), (404, "rejected"), (409, "error"), (429, "error")]
+)
+def test_retryable_conflicts_are_errors(notion, tmp_path, status, result):
+    client = get_client(get_synthetic_fridge(tmp_path, 1, nfiles=1), None)
+    response = requests.Response()
+    response.status_code = status
+    assert client._errorcheck(response) == result
+
+
+@pytest.mark.parametrize(
+    "failure, calls", [("ratelimit", 4), ("server", 4), ("connection", 1)]
+)
+def test_failed_posts_are_errors(notion, tmp_path, failure, calls):
+    """posts may be retried whichever way Notion fails them, and a dropped connection gives up the rest of the batch"""
+    fridge = get_synthetic_fridge(tmp_path, 4, nfiles=1)
+    client = Client(fridge, session=requests.Session(), workers=1)
+    notion.errors, notion.failure = 1.0, failure
+    results = client.post_many({param: "1" for param in fridge.params})
+    assert set(results.values()) == {"error"}
+    assert notion.calls[("PATCH pages", failure)] == calls
+
+
+def test_only_pages_created_by_hal_are_reused(notion, tmp_path):
+    fridge = get_synthetic_fridge(tmp_path, 3, nfiles=1)
+    notes = {"database": fridge.name, "name": "notes", "category": "lab"}
+    notion.pages["notes"] = notes  # added by hand
+    get_client(fridge, None)
+    assert notion.pages["notes"] == notes
+    fridge.params[2].name = "renamed"
+    get_client(fridge, None)
+    assert len(notion.pages) == 4  # param2's page was reused
+    names = sorted(page["name"] for page in notion.pages.values())
+    assert names == ["notes", "param0", "param1", "renamed"]
@@ -0,0 +1,157 @@
+""" Tests and benchmarks of dispatching Param values to a local stand-in for Notion """
+
+import time
+
+import pytest
+import requests
+
+from hal.dispatcher import Dispatcher
+from hal.fridge import Fridge
+from hal.limiter import RateLimiter
+from hal.metrics import STALENESS, render
+from hal.param import NumParam
+from hal.replay import get_synthetic_fridge
+from hal.rules import Rule
+
+LATENCY = 0.05  # seconds the stand-in for Notion takes to answer each call
+
+
+def get_dispatcher(fridge, rate=1000.0, burst=1000):
+    """return Dispatcher for fridge posting to the local stand-in for Notion"""
+    limiter = RateLimiter(rate=rate, burst=burst)
+    dispatcher = Dispatcher(fridge, session=requests.Session(), limiter=limiter)
+    fridge.params[0].parse("0")  # load units now, it is not part of a cycle
+    return dispatcher
+
+
+def get_data(fridge, value="1", timestamp="10-01-23,12:00:00"):
+    """return data dict as returned by the Reader with one value for each Param"""
+    timestamp = timestamp.replace(",", " ")
+    return {param: {timestamp: value} for param in fridge.params}
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("nparams", [10, 50, 200])
+def test_cycle_latency_against_param_count(notion, alarms, tmp_path, nparams):
+    """posts of a cycle are made concurrently, so a cycle takes far less than one call per Param back to back"""
+    fridge = get_synthetic_fridge(tmp_path, nparams, nfiles=1)
+    dispatcher = get_dispatcher(fridge)
+    notion.latency = LATENCY
+    tic = time.perf_counter()
+    dispatcher.dispatch(get_data(fridge), alarms)
+    latency = time.perf_counter() - tic
+    print(f"\n{nparams} Params: cycle took {latency:.3f}s")
+    assert len(notion.posts) == nparams
+    assert latency < nparams * LATENCY / 3
+
+
+@pytest.mark.benchmark
+def test_cycle_latency_is_paced_by_rate_limit(notion, alarms, tmp_path):
+    """posts are paced by the rate limiter instead of sleeping after each post"""
+    fridge = get_synthetic_fridge(tmp_path, 20, nfiles=1)
+    dispatcher = get_dispatcher(fridge, rate=50.0, burst=1)
+    tic = time.perf_counter()
+    dispatcher.dispatch(get_data(fridge), alarms)
+    latency = time.perf_counter() - tic
+    assert len(notion.posts) == 20
+    assert 20 / 50.0 * 0.8 < latency < 20 / 50.0 * 3
+
+
+def test_unchanged_values_are_not_posted_again(notion, alarms, tmp_path):
+    fridge = get_synthetic_fridge(tmp_path, 5, nfiles=1)
+    dispatcher = get_dispatcher(fridge)
+    dispatcher.dispatch(get_data(fridge), alarms)
+    dispatcher.dispatch(get_data(fridge, timestamp="10-01-23,12:00:01"), alarms)
+    assert len(notion.posts) == 5
+    assert dispatcher.hit_rate == 0.5
+    assert f'hal_hit_rate{{fridge="{fridge.name}"}} 0.5' in render()
+
+
+class FlakyClient:
+    """stands in for a Client whose posts of some Params fail"""
+
+    def __init__(self, results: dict[str, str]) -> None:
+        """results (dict) key = param name, value = result of its posts, "ok" if not given"""
+        self.results = results
+        self.posted: list[str] = []  # names of Params posted successfully
+
+    def post_many(self, values):
+        """ """
+        results = {param: self.results.get(param.name, "ok") for param in values}
+        self.posted += [
+            param.name for param, result in results.items() if result == "ok"
+        ]
+        return results
+
+
+def get_cycles(fridge, ncycles):
+    """yield data dicts of ncycles (int) cycles in which every Param changes"""
+    for cycle in range(ncycles):
+        yield get_data(fridge, str(cycle), f"10-01-23,12:00:{cycle:02}")
+
+
+def test_rejected_param_does_not_block_others(notion, alarms, tmp_path):
+    fridge = get_synthetic_fridge(tmp_path, 3, nfiles=1)
+    dispatcher = get_dispatcher(fridge)
+    client = FlakyClient({"param0": "rejected"})
+    dispatcher._client = client
+    for data in get_cycles(fridge, 8):
+        dispatcher.dispatch(data, alarms)
+    assert client.posted.count("param1") == client.posted.count("param2") == 8
+    assert not dispatcher._outbox
+
+
+def test_rejected_param_is_posted_again_after_reject_time(notion, alarms, tmp_path):
+    fridge = get_synthetic_fridge(tmp_path, 1, nfiles=1)
+    dispatcher = Dispatcher(fridge, session=requests.Session(), reject_time=0.1)
+    client = FlakyClient({"param0": "rejected"})
+    dispatcher._client = client
+    cycles = get_cycles(fridge, 2)
+    dispatcher.dispatch(next(cycles), alarms)
+    client.results = {}  # page was fixed
+    time.sleep(0.1)
+    dispatcher.dispatch(next(cycles), alarms)
+    assert client.posted == ["param0"]
+
+
+def test_failing_param_does_not_block_others(notion, alarms, tmp_path):
+    fridge = get_synthetic_fridge(tmp_path, 3, nfiles=1)
+    dispatcher = get_dispatcher(fridge)
+    client = FlakyClient({"param0": "error", "param1": "error", "param2": "error"})
+    dispatcher._client = client
+    dispatcher.dispatch(next(get_cycles(fridge, 1)), alarms)  # outage
+    assert dispatcher._backoff.failures == 1
+    client.results = {"param0": "error"}  # Notion is back but param0 keeps failing
+    for data in get_cycles(fridge, 8):
+        dispatcher._backoff._due = 0  # don't wait for the backoff delay
+        dispatcher.dispatch(data, alarms)
+    assert client.posted.count("param1") >= 7 and client.posted.count("param2") >= 7
+    assert list(dispatcher._outbox) == [fridge.params[0]]
+
+
+def test_rules_see_all_new_values(notion, alarms, tmp_path):
+    param = NumParam(
+        units="K",
+        rules=[Rule("max", above=5)],
+        name="T",
+        filename="f ",
+        pos=2,
+        category="t",
+    )
+    dispatcher = get_dispatcher(Fridge("test", tmp_path, [param]))
+    new = {param: {f"10-01-23 12:00:0{second}": str(second) for second in range(9)}}
+    data = {param: {"10-01-23 12:00:08": "1"}}
+    new[param]["10-01-23 12:00:08"] = "1"  # spike to 7 before the latest value
+    dispatcher.dispatch(data, alarms, new)
+    assert alarms.warned[("test", "T")] == ("1.00 K", "max = 7 outside (None, 5)")
+
+
+def test_staleness_grows_while_param_is_missing_from_data(notion, alarms, tmp_path):
+    fridge = get_synthetic_fridge(tmp_path, 2, nfiles=2)
+    dispatcher = get_dispatcher(fridge)
+    dispatcher.dispatch(get_data(fridge), alarms)
+    key = (fridge.name, "param1")
+    staleness = STALENESS._values[key]
+    time.sleep(0.2)
+    dispatcher.dispatch({fridge.params[0]: {}}, alarms)  # param1's logfile is gone
+    assert STALENESS._values[key] >= staleness + 0.2
@@ -0,0 +1,37 @@
+""" Tests for loading the fridges to monitor from the config """
+
+import pytest
+
+from hal import config
+from hal.fridge import Fridge, get_fridges
+from hal.param import NumParam
+
+
+def get_params(filename):
+    """ """
+    return [NumParam(units="K", name="T", filename=filename, pos=2, category="t")]
+
+
+def test_one_fridge_is_loaded_from_fridge_name():
+    (fridge,) = get_fridges()
+    assert fridge.name == config.FRIDGE_NAME
+    assert fridge.logfolder == config.LOGFOLDER
+
+
+def test_two_fridges_are_loaded_from_fridges(monkeypatch, tmp_path):
+    fridges = [
+        Fridge("XLD", tmp_path / "xld", get_params("CH T ")),
+        Fridge("LD", str(tmp_path / "ld"), get_params("CH6 T ")),
+    ]
+    monkeypatch.setattr(config, "FRIDGES", fridges, raising=False)
+    loaded = get_fridges()
+    assert [fridge.name for fridge in loaded] == ["XLD", "LD"]
+    assert loaded[1].logfolder == tmp_path / "ld"
+    assert [param.filename for param in loaded[1].params] == ["CH6 T "]
+
+
+def test_fridges_must_have_unique_names(monkeypatch, tmp_path):
+    fridges = [Fridge("XLD", tmp_path, ()), Fridge("XLD", tmp_path, ())]
+    monkeypatch.setattr(config, "FRIDGES", fridges, raising=False)
+    with pytest.raises(ValueError):
+        get_fridges()
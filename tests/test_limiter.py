@@ -0,0 +1,48 @@
+""" Tests for rate limiting calls to external APIs """
+
+import threading
+import time
+
+from hal.limiter import RateLimiter
+
+
+def test_waiting_caller_gives_up_once_aborted():
+    limiter, abort, results = RateLimiter(rate=0.001, burst=1), threading.Event(), []
+    assert limiter.acquire("a")  # no tokens left for ~1000s
+
+    def wait(key):
+        """ """
+        results.append(limiter.acquire(key, abort))
+
+    waiters = [threading.Thread(target=wait, args=(key,)) for key in ("a", "b", "a")]
+    for waiter in waiters:
+        waiter.start()
+    while sum(len(tickets) for tickets in limiter._waiters.values()) < 3:
+        time.sleep(0.01)  # till all of them are waiting in line
+    abort.set()
+    limiter.wake()
+    for waiter in waiters:
+        waiter.join(timeout=5)
+    assert results == [False] * 3
+    assert not limiter._waiters and not limiter._turns  # nobody left in line
+
+
+def test_busy_key_cannot_starve_a_quiet_one():
+    limiter, order = RateLimiter(rate=50.0, burst=1), []
+    assert limiter.acquire("busy")  # callers from now on wait for tokens
+
+    def call(key):
+        """ """
+        limiter.acquire(key)
+        order.append(key)
+
+    callers = [threading.Thread(target=call, args=("busy",)) for _ in range(10)]
+    callers.append(threading.Thread(target=call, args=("quiet",)))
+    for index, caller in enumerate(callers, start=1):
+        caller.start()
+        while sum(len(tickets) for tickets in limiter._waiters.values()) < index:
+            time.sleep(0.001)  # till it is waiting in line, quiet arrives last
+    for caller in callers:
+        caller.join(timeout=5)
+    assert len(order) == 11
+    assert order.index("quiet") <= 1  # takes turns with busy instead of waiting last
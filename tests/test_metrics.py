@@ -0,0 +1,31 @@
+""" Tests for HAL's instrumentation """
+
+import pstats
+import threading
+import time
+
+from hal.metrics import Profiler
+
+
+def spin(stop):
+    """keep a worker thread busy till stop (threading.Event) is set"""
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_profiler_samples_worker_threads(tmp_path):
+    stop = threading.Event()
+    worker = threading.Thread(target=spin, args=(stop,))
+    profiler = Profiler(2, path=tmp_path / "profile.prof", interval=0.001)
+    worker.start()
+    try:
+        profiler.tick()
+        time.sleep(0.2)
+        profiler.tick()
+    finally:
+        stop.set()
+        worker.join()
+    stats = pstats.Stats(str(tmp_path / "profile.prof")).stats
+    spins = [value for key, value in stats.items() if key[2] == "spin"]
+    assert spins and spins[0][3] > 0.1  # cumulative time
+    profiler.tick()  # no-op once the report is dumped
@@ -0,0 +1,44 @@
+""" Tests for parsing and validating Param values """
+
+import pytest
+
+from hal.param import BinParam, NumParam
+
+KWARGS = {"name": "p", "filename": "f ", "pos": 1, "category": "c"}
+
+
+@pytest.mark.parametrize(
+    "kwargs, value, parsed",
+    [
+        ({"units": "K", "ndp": 3}, "1.23456", "1.235 K"),
+        ({"units": "mbar", "has_scinot": True}, "0.00012", "1.20e-04 mbar"),
+        ({"units": "K", "uformats": {"mK": range(-4, -1)}}, "0.0123", "12.30 mK"),
+        ({"units": "K", "uformats": {"mK": range(-4, -1)}}, "0", "0.00 K"),
+        ({"units": "degC", "uformats": {"K": range(0, 5)}}, "20", "293.15 K"),
+        ({"units": "", "ndp": 1}, "-3.25", "-3.2"),
+    ],
+)
+def test_numparam_parse(kwargs, value, parsed):
+    assert NumParam(**kwargs, **KWARGS).parse(value) == parsed
+
+
+def test_numparam_bounds_are_in_logged_units():
+    param = NumParam(
+        units="mbar", uformats={"ubar": range(-6, -3)}, bounds=(0, 5e-3), **KWARGS
+    )
+    assert param.parse("0.0004") == "0.40 µbar"
+    assert param.validate("0.0004")
+    assert not param.validate("4")
+
+
+def test_numparam_deadband():
+    param = NumParam(units="K", deadband=0.05, rel_deadband=0.01, **KWARGS)
+    assert not param.changed("10.00 K", "10.05 K")
+    assert param.changed("10.00 K", "10.20 K")
+    assert param.changed("10.00 K", "10.00 mK")
+
+
+def test_binparam():
+    param = BinParam(**KWARGS)
+    assert param.parse("1") == "True"
+    assert param.validate("0") and not param.validate("on")
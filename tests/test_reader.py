@@ -0,0 +1,124 @@
+""" Tests for following logfiles with Tail and extracting values from them """
+
+from datetime import datetime
+import os
+
+from hal.fridge import Fridge
+from hal.param import NumParam
+from hal.reader import Plan, Reader, Tail, get_logpath
+
+
+def write(path, text, mode="w"):
+    """write text to path and bump its mtime, as filesystems may not resolve quick successive writes"""
+    with path.open(mode) as file:
+        file.write(text)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_tail_reads_appended_complete_lines(tmp_path):
+    path = tmp_path / "log.log"
+    write(path, "a,0\nb,1\n")
+    tail = Tail(path, maxlen=2)
+    assert tail.update()
+    assert list(tail.lines) == ["a,0", "b,1"]
+    assert not tail.update()
+    write(path, "c,2\nd,", mode="a")
+    assert tail.update()
+    assert list(tail.lines) == ["b,1", "c,2"]
+    write(path, "3\n", mode="a")
+    write(path, "e,4\nf,5\ng,6\n", mode="a")
+    assert tail.update()
+    assert list(tail.lines) == ["f,5", "g,6"]
+    assert tail.new == ["d,3", "e,4", "f,5", "g,6"]  # all of them, not just maxlen
+
+
+def test_tail_detects_truncated_logfile(tmp_path):
+    path = tmp_path / "log.log"
+    write(path, "a,0\nb,1\n")
+    tail = Tail(path, maxlen=2)
+    tail.update()
+    write(path, "c,0\n")
+    assert tail.update()
+    assert list(tail.lines) == ["c,0"]
+
+
+def test_tail_detects_logfile_rewritten_to_same_size(tmp_path):
+    path = tmp_path / "log.log"
+    write(path, "b,0\n")
+    tail = Tail(path, maxlen=2)
+    tail.update()
+    write(path, "c,0\n")
+    assert tail.update()
+    assert list(tail.lines) == ["c,0"]
+    assert not tail.update()
+
+
+def test_tail_resumes_from_state(tmp_path):
+    path = tmp_path / "log.log"
+    write(path, "a,0\nb,1\n")
+    tail = Tail(path, maxlen=5)
+    tail.update()
+    state = tail.state
+    write(path, "c,2\n", mode="a")
+    resumed = Tail(path, maxlen=5)
+    resumed.resume(state)
+    resumed.update()
+    assert list(resumed.lines) == ["a,0", "b,1", "c,2"]
+    assert resumed.new == ["c,2"]  # only lines appended since the state was saved
+
+
+def test_plan_relearns_keyword_columns_when_layout_changes():
+    plan = Plan({"a": "ka", "b": "kb", "i": 2})
+    token = ["10-01-23", "12:00:00", "ka", "1", "kb", "2"]
+    assert plan.extract(token) == {"a": "1", "b": "2", "i": "ka"}
+    assert plan._columns == {"a": 2, "b": 4}
+    token = ["10-01-23", "12:00:01", "kb", "3", "kc", "0", "ka", "4"]
+    assert plan.extract(token) == {"a": "4", "b": "3", "i": "kb"}
+    assert plan._columns == {"a": 6, "b": 2}
+    token = ["10-01-23", "12:00:02", "kb", "5", "ka"]  # ka's value is missing
+    assert plan.extract(token, keys={"a", "b"}) == {"b": "5"}
+
+
+def test_reader_follows_layout_changed_mid_day(tmp_path):
+    params = [
+        NumParam(name=name, filename="status ", pos=name, category="", units="")
+        for name in ("p1", "p2")
+    ]
+    reader = Reader(Fridge("test", tmp_path, params))
+    date = datetime.now().strftime("%y-%m-%d")
+    path = get_logpath(tmp_path, "status ", date)
+    path.parent.mkdir()
+    write(path, "10-01-23,12:00:00,p1,1,p2,2\n")
+    assert reader.read() == {
+        params[0]: {"10-01-23 12:00:00": "1"},
+        params[1]: {"10-01-23 12:00:00": "2"},
+    }
+    # a line without a timestamp sneaks in, then a new instrument is logged first
+    write(path, "garbage\n10-01-23,12:00:01,p3,0,p2,4,p1,3\n", mode="a")
+    latest = {
+        params[0]: {"10-01-23 12:00:01": "3"},
+        params[1]: {"10-01-23 12:00:01": "4"},
+    }
+    assert reader.read() == latest
+    assert reader.new == latest
+    write(path, "garbage\n", mode="a")
+    assert reader.read() == latest  # latest values are kept
+
+
+def test_lines_logged_before_the_date_rolls_over_are_kept(tmp_path, monkeypatch):
+    param = NumParam(name="T", filename="CH T ", pos=2, category="", units="K")
+    yesterday = get_logpath(tmp_path, "CH T ", "23-01-10")
+    today = get_logpath(tmp_path, "CH T ", "23-01-11")
+    logspec = {yesterday: [param]}
+    monkeypatch.setattr(Reader, "logspec", property(lambda self: dict(logspec)))
+    yesterday.parent.mkdir()
+    write(yesterday, "10-01-23,23:59:50,1\n")
+    reader = Reader(Fridge("test", tmp_path, [param]))
+    reader.read()
+    write(yesterday, "10-01-23,23:59:59,2\n", mode="a")  # after the last read
+    today.parent.mkdir()
+    write(today, "11-01-23,00:00:05,3\n")
+    logspec = {today: [param]}
+    assert reader.read() == {param: {"11-01-23 00:00:05": "3"}}
+    assert reader.new == {param: {"10-01-23 23:59:59": "2", "11-01-23 00:00:05": "3"}}
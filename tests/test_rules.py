@@ -0,0 +1,133 @@
+""" Tests for alarm rules, and a benchmark of evaluating them over a replayed day of logs """
+
+import math
+import random
+import statistics
+import time
+
+import pytest
+
+from hal.fridge import Fridge
+from hal.param import NumParam
+from hal.reader import Reader, get_logpath
+from hal.rules import Engine, Rule, Window
+from hal.store import parse_timestamp
+
+DATE = "23-01-10"
+
+
+def get_timestamp(second: int) -> str:
+    """return timestamp as logged second (int) seconds after midnight"""
+    return f"10-01-23,{second // 3600:02}:{second // 60 % 60:02}:{second % 60:02}"
+
+
+def test_window_matches_brute_force():
+    window, samples = Window(span=60, tau=10), []
+    for second in range(0, 600, 3):
+        value = random.gauss(0, 1)
+        window.add(second, value)
+        samples.append((second, value))
+        inside = [(t, v) for t, v in samples if t > second - 60]
+        values = [v for _, v in inside]
+        assert window.min == min(values) and window.max == max(values)
+        assert math.isclose(window.mean, statistics.fmean(values), abs_tol=1e-9)
+        if len(inside) > 1:
+            times = [t for t, _ in inside]
+            slope = statistics.linear_regression(times, values).slope
+            assert math.isclose(window.slope, slope, abs_tol=1e-9)
+
+
+def test_rule_hysteresis():
+    rule = Rule("value", above=10, hysteresis=1)
+    assert rule.check(10, active=False)
+    assert rule.check(9.5, active=True)  # not back inside by more than 1 yet
+    assert not rule.check(8.9, active=True)
+    assert not rule.check(9.5, active=False)
+
+
+@pytest.mark.parametrize(
+    "kwargs", [{"statistic": "stat"}, {"window": 0}, {"tau": -1}, {"above": None}]
+)
+def test_invalid_rule_is_refused(kwargs):
+    with pytest.raises(ValueError):
+        Rule(**({"statistic": "max", "above": 5} | kwargs))
+
+
+def test_engine_skips_unchanged_values():
+    param = NumParam(
+        units="K", bounds=(0, 5), name="T", filename="f ", pos=2, category="t"
+    )
+    engine = Engine([param])
+    values = {"10-01-23 12:00:00": "9"}
+    assert engine.update(param, values) == ["bounds value = 9 outside (0, 5)"]
+    engine._windows[param].clear()  # would fail if the rules were evaluated again
+    assert engine.update(param, values) == ["bounds value = 9 outside (0, 5)"]
+    assert engine.update(param, {}) == ["bounds value = 9 outside (0, 5)"]
+
+
+def test_rules_see_values_logged_between_cycles(tmp_path, monkeypatch):
+    param = NumParam(
+        units="K",
+        rules=[Rule("max", above=5, window=60)],
+        name="T",
+        filename="CH6 T ",
+        pos=2,
+        category="t",
+    )
+    fridge = Fridge("test", tmp_path, [param])
+    path = get_logpath(tmp_path, param.filename, DATE)
+    path.parent.mkdir()
+    monkeypatch.setattr(Reader, "logspec", property(lambda self: {path: [param]}))
+    path.write_text(f"{get_timestamp(43200)},1\n")
+    reader = Reader(fridge)
+    with path.open("a") as file:  # spike between cycles
+        for second, value in zip(range(43201, 43205), [2, 9, 3, 1]):
+            file.write(f"{get_timestamp(second)},{value}\n")
+    engine = Engine(fridge.params)
+    data = reader.read()
+    assert list(data[param].values()) == ["1"]
+    assert engine.update(param, reader.new[param]) == ["max = 9 outside (None, 5)"]
+
+
+@pytest.mark.benchmark
+def test_replayed_day_cycle_cost(tmp_path, monkeypatch):
+    """evaluate 300 rules of 100 Params over a day of logs read in 10 minute cycles"""
+    params = [
+        NumParam(
+            units="K",
+            bounds=(-3, 3),
+            rules=[Rule("slope", above=0.1), Rule("mean", -2, 2, window=3600)],
+            name=f"param{index}",
+            filename="synthetic ",
+            pos=2 + index,
+            category="synthetic",
+        )
+        for index in range(100)
+    ]
+    fridge = Fridge("test", tmp_path, params)
+    path = get_logpath(tmp_path, "synthetic ", DATE)
+    path.parent.mkdir()
+    path.touch()
+    monkeypatch.setattr(Reader, "logspec", property(lambda self: {path: params}))
+    reader, engine = Reader(fridge), Engine(params)
+
+    walks, costs = [0.0] * len(params), []
+    for cycle in range(144):  # a line every 10s, a cycle every 10 minutes
+        with path.open("a") as file:
+            for second in range(cycle * 600, (cycle + 1) * 600, 10):
+                walks = [walk + random.gauss(0, 0.05) for walk in walks]
+                values = ",".join(f"{walk:.4f}" for walk in walks)
+                file.write(f"{get_timestamp(second)},{values}\n")
+        reader.read()
+        tic = time.perf_counter()
+        for param in params:
+            engine.update(param, reader.new.get(param, {}))
+        costs.append(time.perf_counter() - tic)
+    costs = sorted(costs)
+    print(
+        f"\n300 rules, 60 samples per Param per cycle: median "
+        f"{costs[len(costs) // 2] * 1e3:.1f} ms, max {costs[-1] * 1e3:.1f} ms per cycle"
+    )
+    latest = parse_timestamp("10-01-23 23:59:50")
+    assert engine._windows[params[0]][(600.0, 60.0)].time == latest  # saw all
+    assert costs[len(costs) // 2] < 0.5
@@ -0,0 +1,123 @@
+""" Tests for the script that logs Arduino sensor data, boards are stood in for by pyserial's loop:// URL """
+
+from importlib.util import module_from_spec, spec_from_file_location
+from pathlib import Path
+import threading
+import time
+
+import pytest
+import serial
+
+from hal.reader import Tail, get_logpath
+
+spec = spec_from_file_location(
+    "sensors", Path(__file__).parents[1] / "sensors/sensors.py"
+)
+sensors = module_from_spec(spec)
+spec.loader.exec_module(sensors)
+
+DATE = "23-01-12"
+
+
+def get_device():
+    """ """
+    return sensors.Device(
+        "loop://", "Arduino ", {"flow": int, "pres": float}, timeout=0.1
+    )
+
+
+def get_board(lines):
+    """return loop:// board that has sent lines (list[bytes])"""
+    board = serial.serial_for_url("loop://", timeout=0.1)
+    board.write(b"".join(lines))
+    return board
+
+
+def test_lines_reach_hal(tmp_path):
+    """lines sent by a board end up in the logfile HAL reads, in HAL's logformat"""
+    device, stop = get_device(), threading.Event()
+    logfile = sensors.Logfile(device.prefix, folder=tmp_path)
+    stats = sensors.Stats("Arduino")
+    lines = [b"12,1.5\n", b"oops\n", b"13,1.6\n", b"14,1."]
+    sensors.acquire(get_board(lines), device, logfile, stats, stop, count=4)
+    logfile.close()
+
+    path = next(tmp_path.glob("*/*.log"))
+    date = path.parent.name
+    assert path == get_logpath(tmp_path, device.prefix, date)
+    tail = Tail(path, maxlen=10)
+    tail.update()
+    assert [line.split(",")[2:] for line in tail.lines] == [
+        ["12", "1.5"],
+        ["13", "1.6"],
+    ]
+    assert (stats.written, stats.malformed, stats.dropped) == (2, 1, 1)
+
+
+def test_lone_line_is_flushed_on_time(tmp_path):
+    """a line that is not followed by others is on disk within flush_time"""
+    logfile = sensors.Logfile("Arduino ", folder=tmp_path, flush_time=0.2)
+    logfile.write("12-01-23,12:00:00,12,1.5\n", DATE)
+    path = get_logpath(tmp_path, "Arduino ", DATE)
+    assert path.read_text() == ""
+    time.sleep(0.5)
+    assert path.read_text() == "12-01-23,12:00:00,12,1.5\n"
+    logfile.close()
+
+
+def test_full_batch_is_flushed_at_once(tmp_path):
+    logfile = sensors.Logfile("Arduino ", folder=tmp_path, flush_size=3)
+    for _ in range(3):
+        logfile.write("12-01-23,12:00:00,12,1.5\n", DATE)
+    assert len(get_logpath(tmp_path, "Arduino ", DATE).read_text().splitlines()) == 3
+    logfile.close()
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("flush_size", [1, sensors.FLUSH_SIZE])
+def test_throughput(tmp_path, flush_size):
+    """lines per second a board can send before the script falls behind"""
+    # loop:// boards block once 4096 bytes are waiting to be read
+    nlines, device, stop = 500, get_device(), threading.Event()
+    logfile = sensors.Logfile(device.prefix, folder=tmp_path, flush_size=flush_size)
+    board = get_board([b"12,1.5\n"] * nlines)
+    tic = time.perf_counter()
+    sensors.acquire(board, device, logfile, sensors.Stats("Arduino"), stop, nlines)
+    logfile.close()
+    rate = nlines / (time.perf_counter() - tic)
+    print(f"\n{flush_size = }: {rate:.0f} lines/s")
+    assert len(next(tmp_path.glob("*/*.log")).read_text().splitlines()) == nlines
+    assert rate > 100  # Arduinos send a few lines per second
+
+
+class LostBoard:
+    """board that has been unplugged"""
+
+    def readline(self):
+        """ """
+        raise serial.SerialException("device disconnected")
+
+    def close(self):
+        """ """
+
+
+def test_reconnected_board_is_closed(tmp_path, monkeypatch):
+    device, stop = get_device(), threading.Event()
+    board = get_board([b"12,1.5\n"])
+    monkeypatch.setattr(sensors, "RETRY", 0)
+    monkeypatch.setattr(sensors, "connect", lambda device, stop: board)
+    logfile, stats = sensors.Logfile(device.prefix, folder=tmp_path), sensors.Stats("")
+    sensors.acquire(LostBoard(), device, logfile, stats, stop, count=1)
+    logfile.close()
+    assert not board.is_open
+    assert (stats.disconnects, stats.written) == (1, 1)
+
+
+def test_lines_written_after_close_are_kept(tmp_path):
+    """a thread still blocked on a read when the script exits may log after its logfile was closed"""
+    logfile = sensors.Logfile("Arduino ", folder=tmp_path)
+    logfile.write("12-01-23,12:00:00,12,1.5\n", DATE)
+    logfile.close()
+    logfile.write("12-01-23,12:00:01,13,1.6\n", DATE)
+    logfile.close()
+    assert len(get_logpath(tmp_path, "Arduino ", DATE).read_text().splitlines()) == 2
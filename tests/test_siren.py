@@ -0,0 +1,78 @@
+""" Tests for sending alerts to Slack """
+
+import time
+
+import pytest
+
+from hal.param import NumParam
+from hal.siren import Siren
+
+from conftest import TOKENS
+
+POST = ("POST chat.postMessage", 200)
+
+
+@pytest.fixture
+def param():
+    """ """
+    return NumParam(name="T", filename="T ", pos=2, category="", units="K")
+
+
+def get_siren(slack, **kwargs):
+    """return Siren posting to the local stand-in for Slack"""
+    return Siren(tokenpath=TOKENS / "slack", base_url=slack.url + "/api/", **kwargs)
+
+
+def test_flapping_value_is_alerted_once_per_remind_time(slack, param):
+    siren = get_siren(slack, remind_time=600)
+    for _ in range(6):  # out of bounds and back every other cycle
+        siren.warn(param, "9 K", "fridge", "bounds")
+        siren.flush()
+        siren.clear(param, "fridge")
+        siren.flush()
+    siren.close()
+    assert slack.calls[POST] == 1
+
+
+def test_value_is_alerted_again_after_remind_time(slack, param):
+    siren = get_siren(slack, remind_time=0)
+    siren.warn(param, "9 K", "fridge", "bounds")
+    siren.flush()
+    siren.clear(param, "fridge")
+    time.sleep(1.1)  # remind_time is checked in whole seconds
+    siren.warn(param, "9 K", "fridge", "bounds")
+    siren.flush()
+    siren.close()
+    assert slack.calls[POST] == 2
+
+
+@pytest.mark.benchmark
+def test_slow_slack_does_not_hold_up_cycles(slack, param):
+    slack.latency = 0.5
+    siren = get_siren(slack, remind_time=0)
+    tic = time.perf_counter()
+    for _ in range(3):
+        siren.warn(param, "9 K", "fridge", "bounds")
+        siren.flush()
+        time.sleep(1.1)
+    latency = time.perf_counter() - tic - 3 * 1.1
+    siren.close()
+    assert latency < 0.1
+    assert slack.calls[POST] == 3
+
+
+def test_dropped_alert_is_raised_again(slack, param):
+    slack.latency = 0.2
+    siren = get_siren(slack, remind_time=600, maxsize=1)
+    siren.warn(param, "9 K", "a", "bounds")
+    siren.flush()
+    time.sleep(0.05)  # worker is sending a's alert
+    siren.warn(param, "9 K", "b", "bounds")
+    siren.warn(param, "9 K", "c", "bounds")
+    siren.flush()  # b's alert is queued, c's is dropped
+    time.sleep(0.5)
+    for fridge in ("a", "b", "c"):
+        siren.warn(param, "9 K", fridge, "bounds")
+    siren.flush()
+    siren.close()
+    assert slack.calls[POST] == 3
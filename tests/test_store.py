@@ -0,0 +1,45 @@
+""" Tests for storing every value read from logfiles """
+
+from hal.fridge import Fridge
+from hal.param import NumParam
+from hal.reader import Reader, get_logpath
+from hal.store import Store, parse_timestamp
+
+DATE = "23-01-10"
+
+
+def get_fridge(logfolder, nvals=1):
+    """return fridge with one NumParam logged at index 2 of a logfile"""
+    param = NumParam(
+        units="K", name="T", filename="CH6 T ", pos=2, category="t", nvals=nvals
+    )
+    return Fridge("test", logfolder, [param])
+
+
+def append(path, seconds, values):
+    """append lines logged at seconds (list[int]) after noon with values to path"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a") as file:
+        for second, value in zip(seconds, values):
+            file.write(f"10-01-23,12:{second // 60:02}:{second % 60:02},{value}\n")
+
+
+def test_every_appended_value_is_stored(tmp_path, monkeypatch):
+    fridge = get_fridge(tmp_path / "logs")
+    path = get_logpath(fridge.logfolder, "CH6 T ", DATE)
+    monkeypatch.setattr(Reader, "logspec", property(lambda self: {path: fridge.params}))
+    append(path, [0], [1.0])
+    reader = Reader(fridge)
+    store = Store(fridge.name, path=tmp_path / "store")
+    data = reader.read()
+    assert store.append(reader.new) == 1
+    append(path, range(1, 6), [2.0, 3.0, 9.0, 4.0, 5.0])
+    data = reader.read()
+    assert len(data[fridge.params[0]]) == 1  # nvals = 1, only the latest
+    assert store.append(reader.new) == 5
+    start = parse_timestamp("10-01-23 12:00:00")
+    samples = store.query("T", start, start + 60)
+    assert samples["value"].tolist() == [1.0, 2.0, 3.0, 9.0, 4.0, 5.0]
+    assert store.query("T", start, start + 60, "1m")["max"].tolist() == [9.0]
+    reader.read()
+    assert reader.new == {}  # nothing appended since
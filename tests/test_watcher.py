@@ -0,0 +1,81 @@
+""" Tests for waiting on logfile changes """
+
+import threading
+import time
+
+import pytest
+
+from hal.watcher import Watcher
+
+
+def write_every(path, period, stop, line="line\n"):
+    """append line (str) to path every period (float) seconds till stop (threading.Event) is set"""
+    with path.open("a") as file:
+        while not stop.wait(period):
+            file.write(line)
+            file.flush()
+
+
+@pytest.mark.parametrize("polling", [False, True])
+def test_busy_logfile_is_reported_within_max_wait(tmp_path, polling):
+    path = tmp_path / "log.log"
+    path.touch()
+    watcher = Watcher(debounce=0.5, max_wait=1.0, poll=0.1)
+    if polling:
+        watcher._fd = None
+    watcher.wait([path], timeout=0)  # start watching
+    stop = threading.Event()
+    writer = threading.Thread(target=write_every, args=(path, 0.3, stop))
+    writer.start()
+    try:
+        tic = time.monotonic()
+        assert watcher.wait([path], timeout=5) == {path}
+        assert time.monotonic() - tic < 2.0
+    finally:
+        stop.set()
+        writer.join()
+
+
+def test_burst_is_reported_once(tmp_path):
+    path = tmp_path / "log.log"
+    path.touch()
+    watcher = Watcher(debounce=0.2, max_wait=1.0)
+    watcher.wait([path], timeout=0)
+    with path.open("a") as file:
+        for _ in range(5):
+            file.write("line\n")
+            file.flush()
+    assert watcher.wait([path], timeout=2) == {path}
+    assert watcher.wait([path], timeout=0.5) == set()
+
+
+def test_missing_logfile_is_read_every_interval(tmp_path):
+    """a logfile that keeps changing does not keep Params of a missing logfile from being read"""
+    from datetime import datetime
+
+    from hal.fridge import Fridge
+    from hal.param import NumParam
+    from hal.reader import Reader, get_logpath
+
+    params = [
+        NumParam(units="K", name=name, filename=f"{name} ", pos=2, category="")
+        for name in ("A", "B")
+    ]
+    reader = Reader(Fridge("test", tmp_path, params))
+    path = get_logpath(tmp_path, "A ", datetime.now().strftime("%y-%m-%d"))
+    path.parent.mkdir()
+    line = "12-01-23,12:00:00,1\n"
+    path.write_text(line)
+    watcher, stop = Watcher(debounce=0.1, max_wait=0.2), threading.Event()
+    writer = threading.Thread(target=write_every, args=(path, 0.05, stop, line))
+    writer.start()
+    try:
+        cycles, paths, deadline = [], None, time.monotonic() + 3.5
+        while time.monotonic() < deadline:
+            cycles.append(sorted(param.name for param in reader.read(paths)))
+            paths = watcher.wait_cycle(reader.logspec, interval=1.0)
+    finally:
+        stop.set()
+        writer.join()
+    assert cycles.count(["A"]) > 3  # changed logfile is read as it changes
+    assert cycles.count(["A", "B"]) >= 3  # all logfiles are read every interval